@@ -36,13 +36,23 @@ if [ ! -f "$CERT_FILE" ]; then
 fi
 
 # Calculate the SPKI SHA-256 hash (3 1 1 configuration)
+# Prefer the zone compiler (same code that validates TLSA rows in
+# dns-records.csv); fall back to openssl if it isn't deployed or fails:
 # 1. Extract the public key (SPKI) from the certificate
 # 2. Convert from PEM to DER format
 # 3. Calculate SHA-256 hash
-TLSA_HASH=$(openssl x509 -in "$CERT_FILE" -noout -pubkey |
-    openssl pkey -pubin -outform DER |
-    openssl dgst -sha256 -binary |
-    hexdump -v -e '/1 "%02x"')
+ZONE_COMPILER="${ZONE_COMPILER:-/opt/vps-root/scripts/csv_to_bind.py}"
+TLSA_HASH=""
+if [ -f "$ZONE_COMPILER" ] && command -v python3 >/dev/null; then
+    TLSA_HASH=$(python3 "$ZONE_COMPILER" tlsa "$CERT_FILE" | awk '{print $4}')
+fi
+if [ -z "$TLSA_HASH" ]; then
+    # Compiler missing or failed
+    TLSA_HASH=$(openssl x509 -in "$CERT_FILE" -noout -pubkey |
+        openssl pkey -pubin -outform DER |
+        openssl dgst -sha256 -binary |
+        hexdump -v -e '/1 "%02x"')
+fi
 
 if [ -z "$TLSA_HASH" ]; then
     echo "TLSA script: failed to compute TLSA hash"
@@ -50,6 +60,8 @@ if [ -z "$TLSA_HASH" ]; then
 fi
 
 echo "Computed new TLSA Hash: $TLSA_HASH"
+# Keep dns-records.csv in sync so `csv_to_bind.py diff` stays clean
+echo "dns-records.csv row: _25._tcp.mail,TLSA,3600,3 1 1 $TLSA_HASH,"
 
 # Cloudflare API payload for TLSA record
 PAYLOAD=$(
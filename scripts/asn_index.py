@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Offline IP -> ASN / country lookups backed by sorted interval arrays.
+
+Loads a local database once into per-family arrays of range starts/ends and
+answers lookups with a bisect (O(log n)), never a linear scan. Supported
+inputs:
+
+  * MaxMind GeoLite2 CSV blocks (`network,...` header), ASN or Country; for
+    Country blocks the sibling *-Locations-en.csv maps geoname ids to ISO codes
+  * range CSV/TSV without a header: `start,end,label...` (db-ip lite,
+    iptoasn.com ip2asn-combined.tsv)
+  * .mmdb files, if the optional `maxminddb` package is installed
+
+Sources can be mixed: CSV/TSV ranges are consulted first, then each .mmdb in
+the order given.
+
+Usage:
+    python3 asn_index.py --db GeoLite2-ASN-Blocks-IPv4.csv 1.2.3.4 8.8.8.8
+"""
+
+import argparse
+import csv
+import ipaddress
+import sys
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+
+class IntervalIndex:
+    """Non-overlapping [start, end] ranges with a label each."""
+
+    def __init__(self):
+        # IPv4 keys fit in 32 bits, so they get compact arrays; IPv6 keys are
+        # 128-bit ints and stay in lists.
+        self._starts = {4: array("I"), 6: []}
+        self._ends = {4: array("I"), 6: []}
+        self._label_ids = {4: array("I"), 6: array("I")}
+        self._labels = []
+        self._label_lookup = {}
+        self._sorted = True
+        self._mmdbs = []
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def add(self, start, end, label):
+        """Add a range of ipaddress objects (inclusive) with a label."""
+        version = start.version
+        label_id = self._label_lookup.get(label)
+        if label_id is None:
+            label_id = self._label_lookup[label] = len(self._labels)
+            self._labels.append(label)
+        starts = self._starts[version]
+        if starts and int(start) < starts[-1]:
+            self._sorted = False
+        starts.append(int(start))
+        self._ends[version].append(int(end))
+        self._label_ids[version].append(label_id)
+
+    def add_network(self, network, label):
+        net = ipaddress.ip_network(network, strict=False)
+        self.add(net.network_address, net.broadcast_address, label)
+
+    def finalize(self):
+        """Sort ranges if they were loaded out of order."""
+        if self._sorted:
+            return self
+        for version in (4, 6):
+            rows = sorted(
+                zip(
+                    self._starts[version],
+                    self._ends[version],
+                    self._label_ids[version],
+                )
+            )
+            starts = [r[0] for r in rows]
+            ends = [r[1] for r in rows]
+            if version == 4:
+                starts, ends = array("I", starts), array("I", ends)
+            self._starts[version] = starts
+            self._ends[version] = ends
+            self._label_ids[version] = array("I", (r[2] for r in rows))
+        self._sorted = True
+        return self
+
+    def lookup(self, ip):
+        """Return the label of the range containing `ip`, or None."""
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+        label = self._lookup_ranges(ip)
+        if label is None:
+            for db in self._mmdbs:
+                label = _mmdb_label(db.get(str(ip)))
+                if label is not None:
+                    break
+        return label
+
+    def _lookup_ranges(self, ip):
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        key = int(ip)
+        starts = self._starts[ip.version]
+        i = bisect_right(starts, key) - 1
+        if i < 0 or key > self._ends[ip.version][i]:
+            return None
+        return self._labels[self._label_ids[ip.version][i]]
+
+
+# ----------------- Loaders -----------------
+
+
+def _mmdb_label(record):
+    if not record:
+        return None
+    if "autonomous_system_number" in record:
+        org = record.get("autonomous_system_organization", "")
+        return f"AS{record['autonomous_system_number']} {org}".strip()
+    country = record.get("country") or record.get("registered_country") or {}
+    return country.get("iso_code")
+
+
+def _load_geoname_countries(blocks_path):
+    """Map geoname_id -> ISO code from the Locations CSV next to `blocks_path`."""
+    for locations in sorted(blocks_path.parent.glob("*-Locations-en.csv")):
+        with open(locations, newline="", encoding="utf-8") as f:
+            return {
+                row["geoname_id"]: row.get("country_iso_code")
+                or row.get("continent_code", "")
+                for row in csv.DictReader(f)
+            }
+    return {}
+
+
+def _load_maxmind_csv(index, path, reader):
+    header = next(reader)
+    cols = {name: i for i, name in enumerate(header)}
+    net_col = cols["network"]
+    if "autonomous_system_number" in cols:
+        asn_col = cols["autonomous_system_number"]
+        org_col = cols.get("autonomous_system_organization")
+
+        def label(row):
+            org = row[org_col] if org_col is not None else ""
+            return f"AS{row[asn_col]} {org}".strip()
+
+    else:
+        countries = _load_geoname_countries(path)
+        geo_cols = [
+            cols[c]
+            for c in ("geoname_id", "registered_country_geoname_id")
+            if c in cols
+        ]
+
+        def label(row):
+            for col in geo_cols:
+                if row[col]:
+                    return countries.get(row[col], row[col])
+            return ""
+
+    for row in reader:
+        if row:
+            index.add_network(row[net_col], label(row))
+
+
+def _load_ranges(index, reader):
+    for row in reader:
+        if len(row) < 3 or row[0].startswith("#"):
+            continue
+        try:
+            start = ipaddress.ip_address(row[0])
+            end = ipaddress.ip_address(row[1])
+        except ValueError:
+            continue
+        rest = [c for c in row[2:] if c]
+        # iptoasn: asn country description; asn 0 means "not routed"
+        if rest and rest[0].isdigit():
+            if rest[0] == "0":
+                continue
+            rest[0] = f"AS{rest[0]}"
+        index.add(start, end, " ".join(rest))
+
+
+def load_index(*paths):
+    """
+    Build an IntervalIndex from CSV/TSV/mmdb database files.
+
+    MaxMind ships IPv4 and IPv6 blocks as separate CSVs; pass both. Ranges
+    from CSV/TSV files take precedence over .mmdb files, which are tried in
+    order.
+    """
+    index = IntervalIndex()
+    for path in map(Path, paths):
+        if path.suffix == ".mmdb":
+            if maxminddb is None:
+                print(f"Error: reading {path} needs the 'maxminddb' package.")
+                sys.exit(1)
+            index._mmdbs.append(maxminddb.open_database(str(path)))
+            continue
+
+        with open(path, newline="", encoding="utf-8", errors="replace") as f:
+            first = f.readline()
+            f.seek(0)
+            delimiter = "\t" if "\t" in first else ","
+            reader = csv.reader(f, delimiter=delimiter)
+            if first.startswith("network"):
+                _load_maxmind_csv(index, path, reader)
+            else:
+                _load_ranges(index, reader)
+    return index.finalize()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up IPs in an offline ASN DB")
+    parser.add_argument(
+        "--db", action="append", required=True, help="Database file (repeatable)"
+    )
+    parser.add_argument("ips", nargs="+")
+    args = parser.parse_args()
+
+    index = load_index(*args.db)
+    print(f"Loaded {len(index)} ranges from {', '.join(args.db)}")
+    for ip in args.ips:
+        print(f"{ip}: {index.lookup(ip) or '(unknown)'}")
+
+
+if __name__ == "__main__":
+    main()
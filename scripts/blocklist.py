@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+Blocklist engine for etc/nginx/conf.d/blocked_ips.conf
+
+Parses both the `geo $bad_ip { ... }` and the older `deny x;` syntax into
+rules, and answers "is this IP blocked, and by which rule/comment" with an
+array-backed binary radix tree (one per address family).
+
+Like nginx's geo, the most specific entry wins, so an entry with value 0
+inside a blocked range un-blocks it. Those entries are kept as allow rules.
+
+Usage:
+    python3 blocklist.py lookup 1.2.3.4 2001:db8::1
+    python3 blocklist.py list
+    python3 blocklist.py compact [--widen K] [--write]
+"""
+
+import argparse
+import ipaddress
+import re
+import sys
+from array import array
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+# Paths relative to repo root
+REPO_ROOT = Path(__file__).parent.parent
+BLOCKED_CONF = REPO_ROOT / "etc/nginx/conf.d/blocked_ips.conf"
+
+# network: ipaddress.IPv4Network/IPv6Network
+# value:   geo value (e.g. "1"; "0" allows), or "deny" for deny lines
+# comment: the last "# Header" seen above the entry (or an inline comment)
+# lineno:  1-based line in the source file (0 if added programmatically)
+Rule = namedtuple("Rule", ["network", "value", "comment", "lineno"])
+
+# geo block parameters that are not address entries
+GEO_KEYWORDS = {"default", "ranges", "delete", "include", "proxy", "proxy_recursive"}
+
+GEO_START = re.compile(r"^geo\s+(?:\S+\s+)?\$\w+\s*\{$")
+ENTRY = re.compile(r"^(\S+)\s+([^;]+?)\s*;$")
+DENY = re.compile(r"^deny\s+([^;\s]+)\s*;$")
+
+# geo value that un-blocks an address (and the geo default)
+ALLOW = "0"
+
+
+def blocks(rule):
+    return rule.value != ALLOW
+
+
+def rule_str(rule):
+    """Display form: bare address for host routes, CIDR otherwise."""
+    net = rule.network
+    if net.prefixlen == net.max_prefixlen:
+        return str(net.network_address)
+    return str(net)
+
+
+def _networks(token):
+    """Expand an address, CIDR or `a-b` range token into networks."""
+    if "-" in token:
+        start, end = token.split("-", 1)
+        return list(
+            ipaddress.summarize_address_range(
+                ipaddress.ip_address(start), ipaddress.ip_address(end)
+            )
+        )
+    return [ipaddress.ip_network(token, strict=False)]
+
+
+def unmap(net):
+    """::ffff:a.b.c.d/n as the IPv4 network it covers; others unchanged."""
+    if net.version == 6 and net.prefixlen >= 96:
+        mapped = net.network_address.ipv4_mapped
+        if mapped is not None:
+            return ipaddress.IPv4Network((mapped, net.prefixlen - 96))
+    return net
+
+
+def parse_lines(lines):
+    """
+    Parse blocked_ips.conf content into a list of Rules.
+
+    Comment lines set the group header for the entries that follow (blank
+    lines don't reset it). An inline `# note` after an entry wins over the
+    group header for that entry only.
+    """
+    rules = []
+    current_comment = ""
+    in_geo = False
+
+    for lineno, raw in enumerate(lines, 1):
+        line = raw.strip()
+        if not line:
+            continue
+
+        if line.startswith("#"):
+            current_comment = line.lstrip("# ").strip()
+            continue
+
+        comment = current_comment
+        if "#" in line:
+            line, inline = line.split("#", 1)
+            line = line.strip()
+            comment = inline.strip() or current_comment
+
+        if GEO_START.match(line):
+            in_geo = True
+            continue
+        if line == "}":
+            in_geo = False
+            continue
+
+        if in_geo:
+            match = ENTRY.match(line)
+            if not match or match.group(1) in GEO_KEYWORDS:
+                continue
+            token, value = match.groups()
+        else:
+            match = DENY.match(line)
+            if not match or match.group(1) == "all":
+                continue
+            token, value = match.group(1), "deny"
+
+        try:
+            networks = _networks(token)
+        except ValueError:
+            print(f"Warning: line {lineno}: invalid address {token!r}", file=sys.stderr)
+            continue
+
+        for net in networks:
+            rules.append(Rule(net, value, comment, lineno))
+
+    return rules
+
+
+def parse_conf(path=BLOCKED_CONF):
+    path = Path(path)
+    if not path.exists():
+        print(f"Warning: {path} not found.")
+        return []
+    with open(path, "r") as f:
+        return parse_lines(f)
+
+
+def collapse(networks):
+    """Merge overlapping and adjacent prefixes into the minimal CIDR set."""
+    networks = list(networks)
+    v4 = [n for n in networks if n.version == 4]
+    v6 = [n for n in networks if n.version == 6]
+    return list(ipaddress.collapse_addresses(v4)) + list(
+        ipaddress.collapse_addresses(v6)
+    )
+
+
+class RadixTree:
+    """
+    Binary prefix tree stored in flat arrays (no per-node objects).
+
+    Node 0 is the root. left/right hold child node indices (0 = none, since
+    the root can never be a child) and slot holds an index into the caller's
+    rule list (-1 = no rule terminates here).
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.left = array("l", [0])
+        self.right = array("l", [0])
+        self.slot = array("l", [-1])
+
+    def __len__(self):
+        return len(self.slot)
+
+    def insert(self, key, prefixlen, slot):
+        node = 0
+        shift = self.bits - 1
+        for _ in range(prefixlen):
+            branch = self.right if (key >> shift) & 1 else self.left
+            child = branch[node]
+            if not child:
+                child = len(self.slot)
+                self.left.append(0)
+                self.right.append(0)
+                self.slot.append(-1)
+                branch[node] = child
+            node = child
+            shift -= 1
+        # Keep the first rule for a given prefix; later duplicates add nothing
+        if self.slot[node] == -1:
+            self.slot[node] = slot
+
+    def longest_match(self, key):
+        left, right, slot = self.left, self.right, self.slot
+        node = 0
+        found = slot[0]
+        shift = self.bits - 1
+        while shift >= 0:
+            node = right[node] if (key >> shift) & 1 else left[node]
+            if not node:
+                break
+            if slot[node] != -1:
+                found = slot[node]
+            shift -= 1
+        return found
+
+
+class Blocklist:
+    """Rules plus a radix tree per address family for fast lookups."""
+
+    def __init__(self, rules=()):
+        self.rules = []
+        self._trees = {4: RadixTree(32), 6: RadixTree(128)}
+        for rule in rules:
+            self.add(rule)
+
+    @classmethod
+    def from_file(cls, path=BLOCKED_CONF):
+        return cls(parse_conf(path))
+
+    def add(self, rule):
+        if not isinstance(rule, Rule):
+            rule = Rule(ipaddress.ip_network(rule, strict=False), "1", "", 0)
+        # lookup() checks v4-mapped addresses in the IPv4 tree
+        net = unmap(rule.network)
+        if net is not rule.network:
+            rule = rule._replace(network=net)
+        self._trees[net.version].insert(
+            int(net.network_address), net.prefixlen, len(self.rules)
+        )
+        self.rules.append(rule)
+
+    def match(self, ip):
+        """Return the most specific Rule covering `ip` (allow rules too), or None."""
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        idx = self._trees[ip.version].longest_match(int(ip))
+        return self.rules[idx] if idx != -1 else None
+
+    def lookup(self, ip):
+        """Return the Rule blocking `ip`, or None if it is not blocked."""
+        rule = self.match(ip)
+        return rule if rule is not None and blocks(rule) else None
+
+    def __contains__(self, ip):
+        try:
+            return self.lookup(ip) is not None
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def collapsed(self):
+        """Blocked prefixes merged (allow rules punching holes are ignored)."""
+        return collapse(r.network for r in self.rules if blocks(r))
+
+    def groups(self):
+        """Rules grouped by comment header, in file order."""
+        grouped = OrderedDict()
+        for rule in self.rules:
+            grouped.setdefault(rule.comment, []).append(rule)
+        return grouped
+
+
+def render_geo(groups, variable="$bad_ip", default="0", header=None):
+    """
+    Render an nginx geo block.
+
+    groups: iterable of (comment, [Rule or network, ...]) pairs
+    """
+    lines = []
+    if header:
+        lines.extend(f"# {h}" if h else "#" for h in header)
+    lines.append(f"geo {variable} {{")
+    lines.append(f"    default {default};")
+    for comment, rules in groups:
+        lines.append("")
+        if comment:
+            lines.append(f"    # {comment}")
+        for rule in rules:
+            if isinstance(rule, Rule):
+                lines.append(f"    {rule_str(rule)} {rule.value};")
+            else:
+                lines.append(f"    {rule_str(Rule(rule, '1', '', 0))} 1;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def read_preamble(path):
+    """Comment lines above the geo/deny entries, without the leading '# '."""
+    header = []
+    path = Path(path)
+    if not path.exists():
+        return header
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith("#"):
+                break
+            header.append(line.lstrip("#").strip())
+    return header
+
+
+WIDEN_HEADER = "Widened to /24 (more than {k} hosts banned)"
+
+
+def _families(table):
+    """Split {network: value} into {bits: {(address int, prefixlen): value}}."""
+    families = {32: {}, 128: {}}
+    for net, value in table.items():
+        key = (int(net.network_address), net.prefixlen)
+        families[net.max_prefixlen][key] = value
+    return families
+
+
+def _nested(nodes, bits):
+    """
+    Yield (key, value, parent key or None) for {(address, prefixlen): value},
+    parents first. Sorting by (address, prefixlen) is a preorder walk of the
+    prefix tree, so a stack of open ancestors finds every parent in one pass.
+    """
+    stack = []
+    for key in sorted(nodes):
+        addr, plen = key
+        while stack:
+            top_addr, top_plen = stack[-1]
+            shift = bits - top_plen
+            if top_plen <= plen and addr >> shift == top_addr >> shift:
+                break
+            stack.pop()
+        yield key, nodes[key], stack[-1] if stack else None
+        stack.append(key)
+
+
+def _drop_shadowed(nodes, bits):
+    """
+    Drop entries that resolve like their parent (or the default) would. A
+    dropped entry has its parent's effective value, so comparing with the
+    immediate parent's value is enough.
+    """
+    return {
+        key: value
+        for key, value, parent in _nested(nodes, bits)
+        if value != (nodes[parent] if parent is not None else ALLOW)
+    }
+
+
+def _reduce(table):
+    """
+    Drop and merge entries of {network: value} without changing what any
+    address resolves to under longest-prefix matching (default ALLOW).
+
+    Entries shadowed by a same-valued ancestor (or the default) are dropped,
+    then sibling halves with the same value are merged into their supernet
+    level by level from the longest prefix up, and shadowed entries are
+    dropped once more. Each step is a single pass.
+    """
+    result = {}
+    for bits, nodes in _families(table).items():
+        levels = [{} for _ in range(bits + 1)]
+        for (addr, plen), value in _drop_shadowed(nodes, bits).items():
+            levels[plen][addr] = value
+        for plen in range(bits, 0, -1):
+            level = levels[plen]
+            half = 1 << (bits - plen)
+            for addr in sorted(level):
+                if addr & half or level.get(addr | half, None) != level[addr]:
+                    continue
+                # Whatever the supernet held before is fully shadowed
+                levels[plen - 1][addr] = level.pop(addr)
+                del level[addr | half]
+        nodes = {
+            (addr, plen): value
+            for plen, level in enumerate(levels)
+            for addr, value in level.items()
+        }
+        factory = ipaddress.IPv4Network if bits == 32 else ipaddress.IPv6Network
+        for (addr, plen), value in _drop_shadowed(nodes, bits).items():
+            result[factory((addr, plen))] = value
+    return result
+
+
+def _blocked_addresses(table):
+    """Addresses whose most specific entry in {network: value} blocks."""
+    total = 0
+    for bits, nodes in _families(table).items():
+        own = {key: 1 << (bits - key[1]) for key in nodes}
+        for key, _, parent in _nested(nodes, bits):
+            if parent is not None:
+                own[parent] -= 1 << (bits - key[1])
+        total += sum(n for key, n in own.items() if nodes[key] != ALLOW)
+    return total
+
+
+def compact(rules, widen=None):
+    """
+    Reduce rules to a minimal equivalent entry set, keeping comment groups.
+
+    Entries are merged and dropped only where that leaves every address
+    resolving to the same value (so allow rules keep their holes). Each
+    resulting network is filed under the group of the first rule (in file
+    order) it covers. With `widen`, any IPv4 /24 holding more than `widen`
+    banned hosts is replaced by the whole /24 and filed under its own
+    header.
+
+    Returns ([(comment, [Rule, ...]), ...], summary dict).
+    """
+    rules = [r._replace(network=unmap(r.network)) for r in rules]
+    before = {}
+    for rule in rules:
+        # The first rule for a prefix wins, as in Blocklist
+        before.setdefault(rule.network, rule.value)
+
+    seeds = []
+    widen_header = None
+    if widen is not None:
+        widen_header = WIDEN_HEADER.format(k=widen)
+        per_24 = OrderedDict()
+        for rule in rules:
+            net = rule.network
+            if net.version == 4 and net.prefixlen > 24 and blocks(rule):
+                key = (net.supernet(new_prefix=24), rule.value)
+                per_24[key] = per_24.get(key, 0) + net.num_addresses
+        seeds = [
+            Rule(net, value, widen_header, 0)
+            for (net, value), hosts in per_24.items()
+            if hosts > widen
+        ]
+
+    # Widened /24s claim their members first, then everything in file order
+    ordered = seeds + rules
+    table = dict(before)
+    for rule in seeds:
+        table[rule.network] = rule.value
+    table = _reduce(table)
+
+    group_order = [r.comment for r in rules]
+    if widen_header:
+        group_order.append(widen_header)
+    groups = OrderedDict((comment, []) for comment in group_order)
+
+    by_value = OrderedDict()
+    for net, value in table.items():
+        by_value.setdefault(value, []).append(net)
+    for value, merged in by_value.items():
+        tree = Blocklist(Rule(net, value, "", 0) for net in merged)
+        claimed = {}
+        for rule in ordered:
+            if rule.value != value:
+                continue
+            target = tree.match(rule.network.network_address)
+            if target is not None:
+                claimed.setdefault(target.network, rule.comment)
+        for net in merged:
+            if net not in claimed:
+                # Only reachable through a more specific entry above; file it
+                # with the first rule it contains
+                claimed[net] = next(
+                    (
+                        r.comment
+                        for r in ordered
+                        if r.value == value
+                        and r.network.version == net.version
+                        and r.network.subnet_of(net)
+                    ),
+                    "",
+                )
+                groups.setdefault(claimed[net], [])
+            groups[claimed[net]].append(Rule(net, value, claimed[net], 0))
+
+    result = []
+    for comment, members in groups.items():
+        if members:
+            members.sort(key=lambda r: (r.network.version, r.network))
+            result.append((comment, members))
+
+    summary = {
+        "entries_before": len(rules),
+        "entries_after": len(table),
+        "addresses_before": _blocked_addresses(before),
+        "addresses_after": _blocked_addresses(table),
+        "widened": [str(r.network) for r in seeds],
+    }
+    return result, summary
+
+
+def cmd_lookup(args, blocklist):
+    status = 1
+    for ip in args.ips:
+        try:
+            rule = blocklist.match(ip)
+        except ValueError:
+            print(f"{ip}: invalid address")
+            continue
+        if rule is None:
+            print(f"{ip}: not blocked")
+            continue
+        comment = f" ({rule.comment})" if rule.comment else ""
+        if blocks(rule):
+            status = 0
+            print(f"{ip}: BLOCKED by {rule_str(rule)} [line {rule.lineno}]{comment}")
+        else:
+            print(
+                f"{ip}: not blocked, allowed by {rule_str(rule)} "
+                f"[line {rule.lineno}]{comment}"
+            )
+    return status
+
+
+def cmd_list(args, blocklist):
+    for comment, rules in blocklist.groups().items():
+        print(f"# {comment or '(no comment)'} ({len(rules)})")
+        for rule in rules:
+            print(f"  {rule_str(rule)}" + ("" if blocks(rule) else " (allow)"))
+    collapsed = blocklist.collapsed()
+    print(f"\n{len(blocklist)} rules, {len(collapsed)} after merging prefixes")
+    return 0
+
+
+def cmd_compact(args, blocklist):
+    groups, summary = compact(blocklist.rules, widen=args.widen)
+    text = render_geo(groups, header=read_preamble(args.conf))
+
+    if args.write:
+        with open(args.conf, "w") as f:
+            f.write(text)
+        print(f"Wrote compacted blocklist to {args.conf}", file=sys.stderr)
+    else:
+        sys.stdout.write(text)
+
+    print(
+        f"Entries:   {summary['entries_before']} -> {summary['entries_after']}\n"
+        f"Addresses: {summary['addresses_before']} -> {summary['addresses_after']}",
+        file=sys.stderr,
+    )
+    for net in summary["widened"]:
+        print(f"Widened:   {net}", file=sys.stderr)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the nginx IP blocklist")
+    parser.add_argument(
+        "--conf", default=str(BLOCKED_CONF), help="Path to blocked_ips.conf"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_lookup = subparsers.add_parser("lookup", help="Check whether IPs are blocked")
+    p_lookup.add_argument("ips", nargs="+")
+    p_lookup.set_defaults(func=cmd_lookup)
+
+    p_list = subparsers.add_parser("list", help="List rules grouped by comment")
+    p_list.set_defaults(func=cmd_list)
+
+    p_compact = subparsers.add_parser(
+        "compact", help="Rewrite as the minimal CIDR set, keeping comment groups"
+    )
+    p_compact.add_argument(
+        "--widen",
+        type=int,
+        metavar="K",
+        help="Ban a whole /24 once more than K of its hosts are banned",
+    )
+    p_compact.add_argument(
+        "--write", action="store_true", help="Overwrite --conf instead of printing"
+    )
+    p_compact.set_defaults(func=cmd_compact)
+
+    args = parser.parse_args()
+    blocklist = Blocklist.from_file(args.conf)
+    sys.exit(args.func(args, blocklist))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,572 @@
+#!/usr/bin/env python3
+"""
+Compile dns-records.csv into a canonical BIND zone, validate it, and diff it
+against a zone exported from the DNS provider.
+
+The CSV (Name,Type,TTL,Target,Priority, plus an optional Zone column for
+files covering several zones) is parsed once into typed records indexed by
+(zone, name, type). Names are relative to the zone ("" or "@" is the apex)
+and compared case-insensitively. Owner names and host targets that end in
+the zone name are taken as fully qualified, trailing dot or not, so
+"mail.nutra.tk", "mail.nutra.tk." and (as an owner) "mail" are the same.
+
+check reports CNAMEs sharing a name with other records, duplicate records,
+bad or missing MX/SRV priorities, malformed addresses, TTLs and TLSA data,
+with CSV line numbers.
+
+diff compares against a BIND export (e.g. Cloudflare's) and prints only the
+records to add and delete plus TTL changes. SOA records and apex NS records
+are managed by the provider and ignored.
+
+tlsa prints the DANE "3 1 1" record data for a certificate; the certbot
+deploy hook (update_tlsa.sh) uses it.
+
+Usage:
+    python3 csv_to_bind.py compile dns-records.csv > nutra.tk.zone
+    python3 csv_to_bind.py check dns-records.csv
+    python3 csv_to_bind.py diff dns-records.csv exported.zone
+    python3 csv_to_bind.py tlsa /etc/letsencrypt/live/nutra.tk/cert.pem
+"""
+
+import argparse
+import base64
 import csv
+import hashlib
+import ipaddress
+import os
+import re
 import sys
+from collections import defaultdict, namedtuple
+
+DEFAULT_ORIGIN = "nutra.tk"
+DEFAULT_TTL = 3600
+TXT_CHUNK = 255
+
+# Canonical output order; anything else sorts after these, alphabetically
+TYPE_ORDER = ["SOA", "NS", "A", "AAAA", "CNAME", "MX", "TXT", "SRV", "CAA", "TLSA"]
+HOST_TYPES = {"CNAME", "NS"}
+PROVIDER_TYPES = {"SOA"}
+
+Record = namedtuple("Record", ["zone", "name", "type", "ttl", "rdata", "line"])
+
+
+class ZoneError(ValueError):
+    pass
+
 
-# Usage: python csv_to_bind.py records.csv > zone.txt
-input_file = sys.argv[1]
-domain = "nutra.tk"  # Change this if needed, or relying on relative names
+# ----------------- Names and record data -----------------
 
-with open(input_file, "r") as f:
-    reader = csv.DictReader(f)
 
-    # Check headers to ensure they match your CSV
-    # Common variations: 'Type'/'Record Type', 'Name'/'Host', 'Content'/'Value'/'Target'
+def relative_name(name, zone):
+    """Owner name relative to `zone`, lowercased; "@" for the apex."""
+    name = name.strip().lower()
+    if name in ("", "@"):
+        return "@"
+    absolute = name.endswith(".")
+    if absolute:
+        name = name[:-1]
+    # Same suffix rule as absolute_host: "www.nutra.tk" is not relative
+    if name == zone:
+        return "@"
+    if name.endswith(f".{zone}"):
+        return name[: -len(zone) - 1]
+    if absolute:
+        raise ZoneError(f"{name}. is outside zone {zone}")
+    return name
+
+
+def absolute_host(host, zone):
+    """Target host as an absolute name with a trailing dot."""
+    host = host.strip().lower()
+    if host in ("", "@"):
+        return f"{zone}."
+    if host.endswith("."):
+        return host
+    if host == zone or host.endswith(f".{zone}"):
+        return f"{host}."
+    return f"{host}.{zone}."
+
+
+def _int(value, what, low=0, high=65535):
     try:
-        # adjust these keys based on your actual CSV headers
-        headers = reader.fieldnames
-        print(f"; Converted from {input_file}")
+        n = int(value)
+    except (TypeError, ValueError):
+        raise ZoneError(f"{what} must be a number, got {value!r}")
+    if not low <= n <= high:
+        raise ZoneError(f"{what} {n} out of range {low}-{high}")
+    return n
+
+
+def normalize_rdata(rtype, target, priority, zone):
+    """
+    Canonical record data string for one record.
+
+    TXT data is kept unquoted (one logical string) and only split into
+    255-byte chunks on output.
+    """
+    target = target.strip()
+    if not target:
+        raise ZoneError("empty target")
+    if rtype == "A":
+        return str(ipaddress.IPv4Address(target))
+    if rtype == "AAAA":
+        return str(ipaddress.IPv6Address(target))
+    if rtype in HOST_TYPES:
+        return absolute_host(target, zone)
+    if rtype == "MX":
+        if priority in (None, ""):
+            raise ZoneError("MX record needs a Priority")
+        return f"{_int(priority, 'MX priority')} {absolute_host(target, zone)}"
+    if rtype == "SRV":
+        # Target column: "weight port host"
+        parts = target.split()
+        if priority in (None, "") or len(parts) != 3:
+            raise ZoneError("SRV needs a Priority and 'weight port target'")
+        weight, port = _int(parts[0], "SRV weight"), _int(parts[1], "SRV port")
+        host = absolute_host(parts[2], zone)
+        return f"{_int(priority, 'SRV priority')} {weight} {port} {host}"
+    if rtype == "TXT":
+        return target
+    if rtype == "TLSA":
+        parts = target.split()
+        if len(parts) != 4:
+            raise ZoneError("TLSA needs 'usage selector matching-type data'")
+        usage, selector, mtype = (_int(p, "TLSA field", 0, 255) for p in parts[:3])
+        data = parts[3].lower()
+        lengths = {1: 64, 2: 128}
+        if not re.fullmatch(r"[0-9a-f]+", data) or (
+            mtype in lengths and len(data) != lengths[mtype]
+        ):
+            raise ZoneError(f"TLSA data does not fit matching type {mtype}")
+        return f"{usage} {selector} {mtype} {data}"
+    return " ".join(target.split())
+
+
+def quote_txt(text):
+    # Split before escaping so no escape sequence is cut in half
+    chunks = [text[i : i + TXT_CHUNK] for i in range(0, len(text), TXT_CHUNK)]
+    return " ".join(
+        '"' + c.replace("\\", "\\\\").replace('"', '\\"') + '"' for c in chunks
+    )
+
+
+def format_rdata(rtype, rdata):
+    return quote_txt(rdata) if rtype == "TXT" else rdata
 
+
+# ----------------- CSV input -----------------
+
+
+def load_csv(path, origin=DEFAULT_ORIGIN):
+    """
+    Parse the CSV once. Returns (records, errors); errors are strings with
+    line numbers, for rows that could not be turned into records.
+    """
+    records = []
+    errors = []
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        missing = {"Name", "Type", "Target"} - set(reader.fieldnames or [])
+        if missing:
+            raise ZoneError(f"{path}: missing columns {', '.join(sorted(missing))}")
         for row in reader:
-            # Clean up data
-            r_type = row.get("Type", "A").strip().upper()
-            r_name = row.get("Name", "@").strip()
-            r_content = row.get("Content", "").strip()
-            r_ttl = row.get("TTL", "1").strip()  # Default to auto
-
-            # Skip empty lines
-            if not r_content:
+            line = reader.line_num
+            target = (row.get("Target") or "").strip()
+            rtype = (row.get("Type") or "").strip().upper()
+            if not target and not rtype:
                 continue
+            zone = (row.get("Zone") or origin).strip().lower().rstrip(".")
+            try:
+                ttl = _int(row.get("TTL") or DEFAULT_TTL, "TTL", 1, 2**31 - 1)
+                name = relative_name(row.get("Name") or "", zone)
+                rdata = normalize_rdata(rtype, target, row.get("Priority"), zone)
+            except ValueError as e:
+                # ZoneError, or a bad address from ipaddress
+                errors.append(f"line {line}: {rtype} {row.get('Name') or '@'}: {e}")
+                continue
+            records.append(Record(zone, name, rtype, ttl, rdata, line))
+    return records, errors
+
+
+def index_records(records):
+    """{(zone, name, type): [records]}"""
+    index = defaultdict(list)
+    for r in records:
+        index[(r.zone, r.name, r.type)].append(r)
+    return index
+
+
+def validate(index):
+    """Problems that need the whole record set: conflicts and duplicates."""
+    errors = []
+    types_at = defaultdict(set)
+    for zone, name, rtype in index:
+        types_at[(zone, name)].add(rtype)
+
+    for (zone, name), types in sorted(types_at.items()):
+        if "CNAME" not in types:
+            continue
+        cnames = index[(zone, name, "CNAME")]
+        where = ", ".join(f"line {r.line}" for r in cnames)
+        if name == "@":
+            errors.append(f"{where}: CNAME at the zone apex of {zone}")
+        if len(cnames) > 1:
+            errors.append(f"{where}: {name} has {len(cnames)} CNAME records")
+        others = sorted(types - {"CNAME"})
+        if others:
+            errors.append(
+                f"{where}: CNAME {name} conflicts with {', '.join(others)} records"
+            )
+
+    for key, records in sorted(index.items()):
+        seen = {}
+        for r in records:
+            if r.rdata in seen:
+                errors.append(
+                    f"line {r.line}: duplicate {r.type} {r.name} "
+                    f"(first on line {seen[r.rdata]})"
+                )
+            else:
+                seen[r.rdata] = r.line
+        ttls = {r.ttl for r in records}
+        if len(ttls) > 1:
+            lines = ", ".join(str(r.line) for r in records)
+            errors.append(f"lines {lines}: {key[2]} {key[1]} has mixed TTLs")
+    return errors
+
+
+# ----------------- Zone output -----------------
+
+
+def name_key(name):
+    # Canonical DNS order: apex first, then by labels from the right
+    return () if name == "@" else tuple(reversed(name.split(".")))
+
+
+def type_key(rtype):
+    if rtype in TYPE_ORDER:
+        return (TYPE_ORDER.index(rtype), "")
+    return (len(TYPE_ORDER), rtype)
+
+
+def sort_records(records):
+    return sorted(records, key=lambda r: (name_key(r.name), type_key(r.type), r.rdata))
+
+
+def render_zone(zone, records):
+    """Canonical BIND text for the records of one zone."""
+    records = sort_records(records)
+    width = max([len(r.name) for r in records] + [1])
+    lines = [f"$ORIGIN {zone}.", f"$TTL {DEFAULT_TTL}"]
+    for r in records:
+        lines.append(
+            f"{r.name:<{width}} {r.ttl:>6} IN {r.type:<5} {format_rdata(r.type, r.rdata)}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+# ----------------- Zone file input -----------------
+
+
+def zone_tokens(text):
+    """
+    Yield lists of (token, quoted) per logical record line.
+
+    Handles ; comments, "quoted strings" and ( ... ) continuations. A line
+    that starts with whitespace gets an empty first token (same owner).
+    """
+    tokens = []
+    depth = 0
+    for raw in text.splitlines():
+        i, n = 0, len(raw)
+        if depth == 0 and raw[:1] in (" ", "\t") and raw.strip():
+            tokens.append(("", False))
+        while i < n:
+            c = raw[i]
+            if c in " \t":
+                i += 1
+            elif c == ";":
+                break
+            elif c == "(":
+                depth += 1
+                i += 1
+            elif c == ")":
+                depth -= 1
+                i += 1
+            elif c == '"':
+                j, buf = i + 1, []
+                while j < n and raw[j] != '"':
+                    if raw[j] == "\\" and j + 1 < n:
+                        j += 1
+                    buf.append(raw[j])
+                    j += 1
+                tokens.append(("".join(buf), True))
+                i = j + 1
+            else:
+                j = i
+                while j < n and raw[j] not in ' \t;()"':
+                    j += 1
+                tokens.append((raw[i:j], False))
+                i = j
+        if depth == 0 and tokens:
+            if any(t for t, _ in tokens):
+                yield tokens
+            tokens = []
+
+
+def load_zone(path, origin=DEFAULT_ORIGIN):
+    """Records from a BIND zone file (provider export)."""
+    records = []
+    zone = origin
+    default_ttl = DEFAULT_TTL
+    owner = "@"
+    with open(path, "r") as f:
+        text = f.read()
+    for number, tokens in enumerate(zone_tokens(text), 1):
+        words = [t for t, _ in tokens]
+        if words[0] == "$ORIGIN":
+            zone = words[1].lower().rstrip(".")
+            continue
+        if words[0] == "$TTL":
+            default_ttl = int(words[1])
+            continue
+        if words[0].startswith("$"):
+            continue
+        if words[0]:
+            owner = relative_name(words[0], zone)
+        rest = tokens[1:]
+        ttl = default_ttl
+        while rest and (rest[0][0].isdigit() or rest[0][0].upper() in ("IN", "CH")):
+            if rest[0][0].isdigit():
+                ttl = int(rest[0][0])
+            rest = rest[1:]
+        if not rest:
+            continue
+        rtype = rest[0][0].upper()
+        data = rest[1:]
+        if rtype in PROVIDER_TYPES or (rtype == "NS" and owner == "@"):
+            continue
+        try:
+            if rtype == "TXT":
+                rdata = "".join(t for t, _ in data)
+            elif rtype in ("MX", "SRV"):
+                # Priority first, then the rest; reuse the CSV normalizer
+                priority = data[0][0]
+                rdata = normalize_rdata(
+                    rtype, " ".join(t for t, _ in data[1:]), priority, zone
+                )
+            else:
+                rdata = normalize_rdata(rtype, " ".join(t for t, _ in data), "", zone)
+        except (ZoneError, ValueError, IndexError) as e:
+            raise ZoneError(f"{path}: record {number} ({owner} {rtype}): {e}")
+        records.append(Record(zone, owner, rtype, ttl, rdata, number))
+    return records
+
+
+# ----------------- Diff -----------------
+
+
+def diff_records(old, new):
+    """
+    Minimal change set between two record lists of one zone.
+
+    Returns (added, removed, ttl_changed); ttl_changed holds (old, new)
+    pairs for records whose data is unchanged but TTL differs.
+    """
+    old_by = {(r.name, r.type, r.rdata): r for r in old}
+    new_by = {(r.name, r.type, r.rdata): r for r in new}
+    added = sort_records(r for k, r in new_by.items() if k not in old_by)
+    removed = sort_records(r for k, r in old_by.items() if k not in new_by)
+    ttl_changed = [
+        (old_by[k], r)
+        for k, r in new_by.items()
+        if k in old_by and old_by[k].ttl != r.ttl
+    ]
+    ttl_changed.sort(key=lambda p: (name_key(p[1].name), type_key(p[1].type)))
+    return added, removed, ttl_changed
+
+
+def format_record(r):
+    return f"{r.name} {r.ttl} {r.type} {format_rdata(r.type, r.rdata)}"
+
+
+# ----------------- TLSA -----------------
+
+
+def _der_read(data, pos):
+    """(tag, content start, content end) of the DER element at `pos`."""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(data[pos : pos + n], "big")
+        pos += n
+    return tag, pos, pos + length
+
+
+def spki_from_pem(pem_text):
+    """DER SubjectPublicKeyInfo of the first certificate in a PEM string."""
+    m = re.search(
+        r"-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----",
+        pem_text,
+        re.DOTALL,
+    )
+    if not m:
+        raise ZoneError("no certificate found")
+    der = base64.b64decode("".join(m[1].split()))
+    _, start, _ = _der_read(der, 0)  # Certificate
+    _, pos, _ = _der_read(der, start)  # TBSCertificate
+    if der[pos] == 0xA0:  # [0] version
+        pos = _der_read(der, pos)[2]
+    # serialNumber, signature, issuer, validity, subject, then the SPKI
+    for _ in range(5):
+        pos = _der_read(der, pos)[2]
+    _, _, end = _der_read(der, pos)
+    return der[pos:end]
+
+
+def tlsa_rdata(cert_path):
+    """DANE-EE "3 1 1" data: SHA-256 over the certificate's public key."""
+    with open(cert_path, "r") as f:
+        spki = spki_from_pem(f.read())
+    return f"3 1 1 {hashlib.sha256(spki).hexdigest()}"
+
+
+# ----------------- Commands -----------------
+
+
+def load_checked(path, origin):
+    try:
+        records, errors = load_csv(path, origin)
+    except (OSError, ZoneError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    errors += validate(index_records(records))
+    return records, errors
+
+
+def report(errors):
+    for e in errors:
+        print(f"Error: {e}", file=sys.stderr)
+    if errors:
+        print(f"{len(errors)} problem(s) found", file=sys.stderr)
+        sys.exit(1)
+
+
+def cmd_check(args):
+    records, errors = load_checked(args.csv, args.origin)
+    report(errors)
+    zones = len({r.zone for r in records})
+    print(f"{len(records)} records in {zones} zone(s) OK")
+
+
+def cmd_compile(args):
+    records, errors = load_checked(args.csv, args.origin)
+    report(errors)
+    by_zone = defaultdict(list)
+    for r in records:
+        by_zone[r.zone].append(r)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for zone, zone_records in sorted(by_zone.items()):
+            path = os.path.join(args.output_dir, f"{zone}.zone")
+            with open(path, "w") as f:
+                f.write(render_zone(zone, zone_records))
+            print(f"Wrote {len(zone_records)} records to {path}", file=sys.stderr)
+    else:
+        sys.stdout.write(
+            "\n".join(render_zone(z, rs) for z, rs in sorted(by_zone.items()))
+        )
+
+
+def cmd_diff(args):
+    records, errors = load_checked(args.csv, args.origin)
+    report(errors)
+    try:
+        exported = load_zone(args.zone, args.origin)
+    except (OSError, ZoneError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    zone = exported[0].zone if exported else args.origin
+    wanted = [r for r in records if r.zone == zone]
+
+    added, removed, ttl_changed = diff_records(exported, wanted)
+    for r in removed:
+        print(f"- {format_record(r)}")
+    for r in added:
+        print(f"+ {format_record(r)}")
+    for old, new in ttl_changed:
+        print(f"~ {new.name} {new.type} TTL {old.ttl} -> {new.ttl}")
+    print(
+        f"{zone}: {len(added)} to add, {len(removed)} to delete, "
+        f"{len(ttl_changed)} TTL changes",
+        file=sys.stderr,
+    )
+    if args.exit_code and (added or removed or ttl_changed):
+        sys.exit(2)
+
+
+def cmd_tlsa(args):
+    try:
+        rdata = tlsa_rdata(args.cert)
+    except (OSError, ZoneError, IndexError, ValueError) as e:
+        print(f"Error: {args.cert}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.name:
+        # Ready to paste into dns-records.csv
+        print(f"{args.name},TLSA,{args.ttl},{rdata},")
+    else:
+        print(rdata)
+
+
+COMMANDS = ("compile", "check", "diff", "tlsa")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DNS zone compiler for the CSV")
+    parser.add_argument(
+        "--origin",
+        default=DEFAULT_ORIGIN,
+        help=f"Zone for rows without a Zone column (default: {DEFAULT_ORIGIN})",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_compile = subparsers.add_parser("compile", help="Emit a canonical BIND zone")
+    p_compile.add_argument("csv")
+    p_compile.add_argument(
+        "-o", "--output-dir", help="Write one <zone>.zone file per zone here"
+    )
+    p_compile.set_defaults(func=cmd_compile)
+
+    p_check = subparsers.add_parser("check", help="Validate the CSV only")
+    p_check.add_argument("csv")
+    p_check.set_defaults(func=cmd_check)
+
+    p_diff = subparsers.add_parser(
+        "diff", help="Changes needed to turn an exported zone into the CSV"
+    )
+    p_diff.add_argument("csv")
+    p_diff.add_argument("zone", help="BIND zone file exported from the provider")
+    p_diff.add_argument(
+        "--exit-code", action="store_true", help="Exit with 2 if there are changes"
+    )
+    p_diff.set_defaults(func=cmd_diff)
+
+    p_tlsa = subparsers.add_parser("tlsa", help="TLSA 3 1 1 data for a certificate")
+    p_tlsa.add_argument("cert", help="PEM certificate (e.g. .../cert.pem)")
+    p_tlsa.add_argument("--name", help="Print a CSV row for this owner name")
+    p_tlsa.add_argument("--ttl", type=int, default=DEFAULT_TTL)
+    p_tlsa.set_defaults(func=cmd_tlsa)
 
-            # Handle Priority for MX records
-            priority = ""
-            if r_type == "MX":
-                # If priority is in a separate column, grab it. Otherwise assume it's in content or default 10.
-                p = row.get("Priority", "10").strip()
-                priority = f"{p} "
+    # Old usage: csv_to_bind.py records.csv > zone.txt
+    argv = sys.argv[1:]
+    if argv and not argv[0].startswith("-") and argv[0] not in COMMANDS:
+        argv.insert(0, "compile")
+    args = parser.parse_args(argv)
+    args.func(args)
 
-            # Output in BIND format: name IN TTL TYPE [PRIORITY] CONTENT
-            # Cloudflare import is flexible, but standard BIND is safest.
-            print(f"{r_name} IN {r_ttl} {r_type} {priority}{r_content}")
 
-    except Exception as e:
-        print(f"; Error processing file: {e}")
+if __name__ == "__main__":
+    main()
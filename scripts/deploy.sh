@@ -16,80 +16,11 @@ is_text_file() {
 echo "Source: $REPO_ROOT"
 
 # Function to show diff
+# deploy_plan.py applies the same dev/prod/nightly and *.dev.conf mapping as the
+# install below, hashes both sides in one pass and only diffs changed files.
 show_diff() {
     local ENV="$1"
-    echo "Detected changes (diff) for ENV=$ENV:"
-    # We can't use simple diff -r because we need to exclude secrets.conf if encrypted
-    # So we loop through source files
-    # We loop through source files using find to include subdirectories
-    find "$NGINX_CONF_SRC" -name "*.conf" | while read -r FILE; do
-        BASENAME=$(basename "$FILE")
-        if [ "$BASENAME" = "secrets.conf" ] && ! is_text_file "$FILE"; then
-            echo "Skipping encrypted secrets.conf diff..."
-            continue
-        fi
-
-        # Filter based on directory structure (dev/ vs prod/)
-        if [[ "$FILE" == *"/dev/"* ]]; then
-            if [ "$ENV" != "dev" ]; then continue; fi
-        fi
-        if [[ "$FILE" == *"/prod/"* ]]; then
-            if [ "$ENV" != "prod" ]; then continue; fi
-        fi
-        if [[ "$FILE" == *"/nightly/"* ]]; then
-            if [ "$ENV" != "nightly" ]; then continue; fi
-        fi
-
-        # Logic to check against default.conf
-        TARGET_FILE="$DEST_CONF_DIR/$BASENAME"
-
-        # Generic handling for *.dev.conf and *.prod.conf
-        if [[ "$BASENAME" =~ ^(.*)\.(dev|prod)\.conf$ ]]; then
-            STEM="${BASH_REMATCH[1]}"
-            CONF_ENV="${BASH_REMATCH[2]}"
-
-            if [ "$CONF_ENV" == "$ENV" ]; then
-                TARGET_FILE="$DEST_CONF_DIR/$STEM.conf"
-            else
-                continue
-            fi
-        fi
-
-        if [ -f "$TARGET_FILE" ]; then
-            diff -u --color=always "$TARGET_FILE" "$FILE" || true
-        else
-            echo "New file: $BASENAME"
-            # Show content of new file as diff (dev null vs new)
-            # diff -u --color=always /dev/null "$FILE" || true
-        fi
-    done
-
-    # Diff gitweb.conf
-    if [ -f "$GITWEB_CONF_SRC" ]; then
-        diff -u --color=always /etc/gitweb.conf "$GITWEB_CONF_SRC" || true
-    fi
-
-    # Diff configurations recursively
-    echo "Checking configuration files..."
-    for DIR in "etc/systemd/system" "etc/continuwuity" "etc/conduwuit" "etc/matrix-conduit" "opt/stalwart/etc" "etc/matrix-synapse" "etc/fail2ban" "etc/letsencrypt" "etc/gitea" "var/lib/gitea/custom" "etc/unbound"; do
-        if [ -d "$REPO_ROOT/$DIR" ]; then
-            find "$REPO_ROOT/$DIR" -type f | while read -r FILE; do
-                REL_PATH="${FILE#$REPO_ROOT/$DIR/}"
-                TARGET="/$DIR/$REL_PATH"
-
-                if [ -f "$TARGET" ]; then
-                    # Silence output if no diff, only showing diff output if differences exist
-                    if ! diff -q "$TARGET" "$FILE" >/dev/null 2>&1; then
-                        echo "Diff for $TARGET:"
-                        diff -u --color=always "$TARGET" "$FILE" || true
-                    fi
-                else
-                    echo "New file: $TARGET"
-                    # diff -u --color=always /dev/null "$FILE" || true
-                fi
-            done
-        fi
-    done
+    python3 "$REPO_ROOT/scripts/deploy_plan.py" "$ENV"
 }
 
 if [ "$1" = "diff" ]; then
@@ -387,7 +318,12 @@ if sudo nginx -t; then
         sudo rm -rf /opt/vps-root/scripts
         sudo mkdir -p /opt/vps-root/scripts
         sudo cp "$REPO_ROOT/scripts/"*.sh /opt/vps-root/scripts/
+        # git_snapshot.py (run by the snapshot post-receive hook) and its imports
+        sudo cp "$REPO_ROOT/scripts/"*.py /opt/vps-root/scripts/
         sudo chmod +x /opt/vps-root/scripts/*.sh
+        # Static git pages (etc/nginx/snippets/git-snapshot.conf); written by
+        # the snapshot post-receive hook, which runs as the git user
+        sudo install -d -o git -g git -m 755 /var/www/git-snapshot
 
         # Enable and start associated timers and services
         sudo systemctl enable --now nutra-stats.timer || true
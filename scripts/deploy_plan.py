@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Compare staged config files with the installed ones and print a change plan.
+
+This is what `deploy.sh diff` (and every deploy) shows before installing.
+Sources are mapped to their targets with the same rules deploy.sh installs
+by:
+
+  - etc/nginx/conf.d/**/*.conf goes flat into /etc/nginx/conf.d, but files
+    under a dev/, prod/ or nightly/ directory only for that ENV
+  - <stem>.dev.conf / <stem>.prod.conf become <stem>.conf for their ENV and
+    are skipped otherwise
+  - etc/gitweb.conf -> /etc/gitweb.conf
+  - every file under CONFIG_DIRS -> the same path under /
+
+Files still encrypted by git-crypt are skipped. Both sides are hashed in a
+single pass, with digests cached by (path, mtime, size), so an unchanged
+tree costs a stat per file. Unified diffs are printed only for files whose
+content differs; new files and conf.d files the install will remove are
+listed in the plan.
+
+Usage:
+    python3 deploy_plan.py dev
+    python3 deploy_plan.py prod --no-diff
+"""
+
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+NGINX_CONF_SRC = REPO_ROOT / "etc/nginx/conf.d"
+GITWEB_CONF_SRC = REPO_ROOT / "etc/gitweb.conf"
+DEST_CONF_DIR = Path("/etc/nginx/conf.d")
+DEST_ROOT = Path("/")
+
+CONFIG_DIRS = [
+    "etc/systemd/system",
+    "etc/continuwuity",
+    "etc/conduwuit",
+    "etc/matrix-conduit",
+    "opt/stalwart/etc",
+    "etc/matrix-synapse",
+    "etc/fail2ban",
+    "etc/letsencrypt",
+    "etc/gitea",
+    "var/lib/gitea/custom",
+    "etc/unbound",
+]
+
+ENVS = ("dev", "prod", "nightly")
+ENV_CONF_RE = re.compile(r"^(.*)\.(dev|prod)\.conf$")
+GITCRYPT_MAGIC = b"\x00GITCRYPT\x00"
+
+DEFAULT_CACHE = os.environ.get(
+    "DEPLOY_HASH_CACHE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "nginx-ops",
+        "deploy_hashes.json",
+    ),
+)
+
+RED, GREEN, CYAN, BOLD, RESET = "\033[31m", "\033[32m", "\033[36m", "\033[1m", "\033[0m"
+
+
+# ----------------- Mapping -----------------
+
+
+def nginx_pairs(env, src_dir=NGINX_CONF_SRC, dest_dir=DEST_CONF_DIR):
+    """(source, target) for every nginx conf deploy.sh would install."""
+    pairs = []
+    for path in sorted(src_dir.rglob("*.conf")):
+        parts = path.relative_to(src_dir).parts[:-1]
+        if any(p in ENVS and p != env for p in parts):
+            continue
+        name = path.name
+        m = ENV_CONF_RE.match(name)
+        if m:
+            if m[2] != env:
+                continue
+            name = f"{m[1]}.conf"
+        pairs.append((path, dest_dir / name))
+    return pairs
+
+
+def config_pairs(repo_root=REPO_ROOT, dest_root=DEST_ROOT):
+    pairs = []
+    for rel in CONFIG_DIRS:
+        src_dir = repo_root / rel
+        if not src_dir.is_dir():
+            continue
+        for path in sorted(p for p in src_dir.rglob("*") if p.is_file()):
+            pairs.append((path, dest_root / rel / path.relative_to(src_dir)))
+    return pairs
+
+
+def plan_pairs(env):
+    pairs = nginx_pairs(env)
+    if GITWEB_CONF_SRC.is_file():
+        pairs.append((GITWEB_CONF_SRC, DEST_ROOT / "etc/gitweb.conf"))
+    return pairs + config_pairs()
+
+
+def removed_confs(pairs, dest_dir=DEST_CONF_DIR):
+    """Installed conf.d files the clean install deletes (secrets.conf is kept)."""
+    targets = {dst for _, dst in pairs}
+    try:
+        entries = sorted(dest_dir.iterdir())
+    except OSError:
+        return []
+    return [
+        p
+        for p in entries
+        if p.is_file()
+        and p.suffix in (".conf", ".disabled")
+        and p.name != "secrets.conf"
+        and p not in targets
+    ]
+
+
+# ----------------- Hashing -----------------
+
+
+class HashCache:
+    """Content digests keyed by (path, mtime, size)."""
+
+    def __init__(self, cache_file=DEFAULT_CACHE):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.hashed = 0
+        self._dirty = False
+        if cache_file:
+            try:
+                with open(cache_file, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def digest(self, path):
+        """
+        (digest, encrypted) for `path`; digest is None if it is unreadable.
+        """
+        key = str(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None, False
+        entry = self.entries.get(key)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2], entry[3]
+        h = hashlib.blake2b()
+        try:
+            with open(key, "rb") as f:
+                head = f.read(65536)
+                encrypted = head.startswith(GITCRYPT_MAGIC)
+                h.update(head)
+                for chunk in iter(lambda: f.read(65536), b""):
+                    h.update(chunk)
+        except OSError:
+            return None, False
+        digest = h.hexdigest()
+        self.entries[key] = [st.st_mtime_ns, st.st_size, digest, encrypted]
+        self.hashed += 1
+        self._dirty = True
+        return digest, encrypted
+
+    def save(self):
+        # Best effort; drop entries for files that no longer exist
+        if not self.cache_file or not self._dirty:
+            return
+        self.entries = {k: v for k, v in self.entries.items() if os.path.exists(k)}
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.cache_file)
+        except OSError:
+            pass
+
+
+# ----------------- Plan -----------------
+
+
+def build_plan(pairs, cache):
+    """
+    Classify pairs; returns {"changed", "new", "skipped", "unreadable"}
+    lists of (source, target) plus an "unchanged" count.
+    """
+    plan = {"changed": [], "new": [], "skipped": [], "unreadable": [], "unchanged": 0}
+    for src, dst in pairs:
+        src_digest, encrypted = cache.digest(src)
+        if encrypted:
+            plan["skipped"].append((src, dst))
+            continue
+        if not dst.exists():
+            plan["new"].append((src, dst))
+            continue
+        dst_digest, _ = cache.digest(dst)
+        if src_digest is None or dst_digest is None:
+            plan["unreadable"].append((src, dst))
+        elif src_digest != dst_digest:
+            plan["changed"].append((src, dst))
+        else:
+            plan["unchanged"] += 1
+    return plan
+
+
+DIFF_COLORS = [("---", BOLD), ("+++", BOLD), ("@@", CYAN), ("-", RED), ("+", GREEN)]
+
+
+def colorize(line):
+    for prefix, code in DIFF_COLORS:
+        if line.startswith(prefix):
+            return f"{code}{line[:-1]}{RESET}\n"
+    return line
+
+
+def unified_diff(src, dst, color):
+    def lines(path):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.readlines()
+
+    out = []
+    for line in difflib.unified_diff(lines(dst), lines(src), str(dst), str(src)):
+        missing_newline = not line.endswith("\n")
+        if missing_newline:
+            line += "\n"
+        out.append(colorize(line) if color else line)
+        if missing_newline:
+            out.append("\\ No newline at end of file\n")
+    return "".join(out)
+
+
+def print_plan(plan, removed, show_diff=True, color=False):
+    for src, _ in plan["skipped"]:
+        print(f"Skipping encrypted {src.relative_to(REPO_ROOT)}...")
+    for src, dst in plan["unreadable"]:
+        print(f"Cannot read {dst} (try sudo)")
+    for _, dst in plan["changed"]:
+        print(f"  M {dst}")
+    for _, dst in plan["new"]:
+        print(f"  A {dst}")
+    for dst in removed:
+        print(f"  D {dst}")
+    if show_diff:
+        for src, dst in plan["changed"]:
+            sys.stdout.write(unified_diff(src, dst, color))
+    print(
+        f"{len(plan['changed'])} changed, {len(plan['new'])} new, "
+        f"{len(removed)} removed, {plan['unchanged']} unchanged, "
+        f"{len(plan['skipped'])} skipped"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show what deploying the staged configs would change"
+    )
+    parser.add_argument("env", nargs="?", default="dev", choices=ENVS)
+    parser.add_argument(
+        "--no-diff", action="store_true", help="Only print the change plan"
+    )
+    parser.add_argument("--color", choices=["auto", "always", "never"], default="auto")
+    parser.add_argument(
+        "--cache", default=DEFAULT_CACHE, help="Hash cache file ('' to disable)"
+    )
+    args = parser.parse_args()
+
+    color = args.color == "always" or (args.color == "auto" and sys.stdout.isatty())
+    cache = HashCache(args.cache)
+    pairs = plan_pairs(args.env)
+
+    print(f"Detected changes (diff) for ENV={args.env}:")
+    plan = build_plan(pairs, cache)
+    print_plan(plan, removed_confs(pairs), not args.no_diff, color)
+    cache.save()
+
+
+if __name__ == "__main__":
+    main()
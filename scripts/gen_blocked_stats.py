@@ -1,19 +1,38 @@
 #!/usr/bin/env python3
+import argparse
+import html
+import json
 import re
 from datetime import datetime
 from pathlib import Path
 
+from asn_index import load_index
+from blocklist import blocks, parse_conf, rule_str
+
 # Paths relative to repo root
 REPO_ROOT = Path(__file__).parent.parent
 BLOCKED_CONF = REPO_ROOT / "etc/nginx/conf.d/blocked_ips.conf"
 OUTPUT_HTML = REPO_ROOT / "opt/my-website/static/blocked.html"
+# Paginated entries: page-N.html (no-JS) + page-N.ndjson (lazy-loaded by the
+# Svelte site via index.json)
+OUTPUT_DIR = REPO_ROOT / "opt/my-website/static/blocked"
+PAGE_SIZE = 1000
+# Rollups (per group / subnet / ASN / country) for the Svelte site
+OUTPUT_STATS_JSON = REPO_ROOT / "opt/my-website/src/lib/blocked_stats.json"
+
+# Subnet buckets reported in the rollups: (key, version, prefix length)
+ROLLUP_PREFIXES = [("v4_24", 4, 24), ("v4_16", 4, 16), ("v6_48", 6, 48)]
+# A /24 with at least this many rules is flagged as a collapse candidate
+COLLAPSE_THRESHOLD = 3
+# Rows kept per ranked table in the JSON
+ROLLUP_TOP = 100
 
-HTML_TEMPLATE = """<!DOCTYPE html>
+HTML_HEAD = """<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Nutratech | Blocked IPs</title>
+    <title>{title}</title>
     <style>
         :root {{
             --bg-color: #0f172a;
@@ -72,6 +91,8 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             justify-content: space-between;
         }}
         .ip-item:last-child {{ border-bottom: none; }}
+        .pager {{ margin: 1rem 0; color: #94a3b8; }}
+        .pager a {{ color: #93c5fd; margin-right: 0.75rem; }}
         .comment {{ color: #64748b; font-style: italic; }}
         footer {{
             margin-top: 3rem;
@@ -83,17 +104,34 @@ HTML_TEMPLATE = """<!DOCTYPE html>
 </head>
 <body>
     <h1>🛡️ Global Ban List</h1>
+"""
 
+SUMMARY_BODY = """
     <div class="stat-card">
         <div class="big-number">{count}</div>
         <div class="label">Total Blocked IP Addresses</div>
     </div>
 
-    <h2>Blocked Entries</h2>
+    <h2>Ban Groups</h2>
     <div class="ip-list">
-        {ip_list_html}
+{group_rows}
     </div>
 
+    <h2>Blocked Entries</h2>
+    <nav class="pager">{page_links}</nav>
+"""
+
+PAGE_START = """
+    <nav class="pager">{nav}</nav>
+    <h2>Blocked Entries {first}&ndash;{last} of {count}</h2>
+    <div class="ip-list">
+"""
+
+PAGE_END = """    </div>
+    <nav class="pager">{nav}</nav>
+"""
+
+HTML_FOOT = """
     <footer>
         <p>Generated on {generated_at} from Nginx configuration.</p>
         <p>Nutratech Infrastructure Protection</p>
@@ -102,71 +140,226 @@ HTML_TEMPLATE = """<!DOCTYPE html>
 </html>"""
 
 
-def parse_blocked_ips():
-    if not BLOCKED_CONF.exists():
-        print(f"Warning: {BLOCKED_CONF} not found.")
-        return []
-
-    entries = []
-    current_comment = ""
-
-    with open(BLOCKED_CONF, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-
-            # Capture comments that precede blocks
-            if line.startswith("#"):
-                current_comment = line.lstrip("# ").strip()
-                continue
-
-            # Parse deny lines
-            # Format: deny 1.2.3.4;
-            match = re.match(r"^deny\s+([\d\.]+);", line)
-            if match:
-                ip = match.group(1)
-                entries.append({"ip": ip, "comment": current_comment})
-                # Keep comment for next IP if it looks like a group header?
-                # Actually, typical format is:
-                # # Header
-                # deny x;
-                # deny y;
-                # So we keep the comment until a new blank line or new comment appears.
-
-                # However, usually there are blank lines between groups.
-                # Let's simple keep the last comment seen.
-            else:
-                # If weird line or end of block, maybe reset comment?
-                # For now, simple logic is fine.
-                pass
-
-    return entries
+def blocked_rules():
+    """Rules from BLOCKED_CONF that block (geo entries with value 0 allow)."""
+    return [rule for rule in parse_conf(BLOCKED_CONF) if blocks(rule)]
 
 
-def main():
-    entries = parse_blocked_ips()
-
-    ip_list_html = ""
-    for entry in entries:
-        comment_html = (
-            f'<span class="comment">{entry["comment"]}</span>'
-            if entry["comment"]
-            else ""
-        )
-        ip_list_html += (
-            f'<div class="ip-item"><span>{entry["ip"]}</span>{comment_html}</div>\n'
+def parse_blocked_ips(rules=None):
+    """Return [{"ip": ..., "comment": ...}] for every rule in BLOCKED_CONF."""
+    if rules is None:
+        rules = blocked_rules()
+    return [{"ip": rule_str(rule), "comment": rule.comment} for rule in rules]
+
+
+def _ranked(counter, top=ROLLUP_TOP, minimum=1):
+    items = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
+    return [[k, v] for k, v in items[:top] if v >= minimum]
+
+
+def compute_rollups(
+    rules, asn_index=None, country_index=None, collapse_threshold=COLLAPSE_THRESHOLD
+):
+    """
+    Count rules per comment group, per subnet bucket and (optionally) per
+    ASN/country, in a single pass over the rules.
+
+    Rules wider than a bucket (e.g. a /12 vs the /16 bucket) are not counted
+    in that bucket; they already cover it.
+    """
+    groups = {}
+    buckets = {key: {} for key, _, _ in ROLLUP_PREFIXES}
+    asns = {}
+    countries = {}
+    addresses = 0
+
+    for rule in rules:
+        net = rule.network
+        addresses += net.num_addresses
+
+        group = groups.setdefault(rule.comment, {"rules": 0, "addresses": 0})
+        group["rules"] += 1
+        group["addresses"] += net.num_addresses
+
+        for key, version, prefixlen in ROLLUP_PREFIXES:
+            if net.version == version and net.prefixlen >= prefixlen:
+                bucket = str(net.supernet(new_prefix=prefixlen))
+                buckets[key][bucket] = buckets[key].get(bucket, 0) + 1
+
+        if asn_index is not None:
+            label = asn_index.lookup(net.network_address) or "unknown"
+            asns[label] = asns.get(label, 0) + 1
+        if country_index is not None:
+            label = country_index.lookup(net.network_address) or "unknown"
+            countries[label] = countries.get(label, 0) + 1
+
+    rollups = {
+        "total_rules": len(rules),
+        "total_addresses": addresses,
+        "groups": groups,
+        "prefixes": {key: _ranked(counts) for key, counts in buckets.items()},
+        # Subnets worth replacing with a single CIDR rule
+        "collapse_candidates": _ranked(
+            buckets["v4_24"], top=None, minimum=collapse_threshold
         )
+        + _ranked(buckets["v6_48"], top=None, minimum=collapse_threshold),
+    }
+    if asn_index is not None:
+        rollups["asn"] = _ranked(asns)
+    if country_index is not None:
+        rollups["country"] = _ranked(countries)
+    return rollups
+
 
-    html = HTML_TEMPLATE.format(
-        count=len(entries), ip_list_html=ip_list_html, generated_at="Latest (Automated)"
+def page_name(number, ext):
+    return f"page-{number}.{ext}"
+
+
+def page_nav(number, pages):
+    summary = f"../{OUTPUT_HTML.name}"
+    links = [f'<a href="{summary}">Summary</a>']
+    if number > 1:
+        links.append(f'<a href="{page_name(number - 1, "html")}">&laquo; Prev</a>')
+    links.append(f"Page {number} of {pages}")
+    if number < pages:
+        links.append(f'<a href="{page_name(number + 1, "html")}">Next &raquo;</a>')
+    return " ".join(links)
+
+
+def entry_html(entry):
+    comment = entry["comment"]
+    comment_html = (
+        f'<span class="comment">{html.escape(comment)}</span>' if comment else ""
     )
+    return (
+        f'        <div class="ip-item"><span>{entry["ip"]}</span>'
+        f"{comment_html}</div>\n"
+    )
+
 
-    OUTPUT_HTML.parent.mkdir(parents=True, exist_ok=True)
+def write_page(number, pages, chunk, first, count, generated_at):
+    """Stream one HTML page and its NDJSON shard; returns the file names."""
+    nav = page_nav(number, pages)
+    html_name = page_name(number, "html")
+    with open(OUTPUT_DIR / html_name, "w") as f:
+        f.write(HTML_HEAD.format(title=f"Nutratech | Blocked IPs (page {number})"))
+        f.write(
+            PAGE_START.format(
+                nav=nav, first=first, last=first + len(chunk) - 1, count=count
+            )
+        )
+        f.writelines(entry_html(entry) for entry in chunk)
+        f.write(PAGE_END.format(nav=nav))
+        f.write(HTML_FOOT.format(generated_at=generated_at))
+
+    ndjson_name = page_name(number, "ndjson")
+    with open(OUTPUT_DIR / ndjson_name, "w") as f:
+        f.writelines(json.dumps(entry, separators=(",", ":")) + "\n" for entry in chunk)
+    return html_name, ndjson_name
+
+
+def remove_stale_pages(pages):
+    for path in OUTPUT_DIR.glob("page-*.*"):
+        number = path.stem.split("-", 1)[1]
+        if not number.isdigit() or int(number) > pages:
+            path.unlink()
+
+
+def write_summary(entries, groups, index, generated_at):
+    group_rows = "\n".join(
+        f'        <div class="ip-item"><span>{html.escape(name or "(no comment)")}'
+        f"</span><span>{count}</span></div>"
+        for name, count in groups.items()
+    )
+    page_links = " ".join(
+        f'<a href="{OUTPUT_DIR.name}/{page["html"]}">{number}</a>'
+        for number, page in enumerate(index["pages"], 1)
+    )
     with open(OUTPUT_HTML, "w") as f:
-        f.write(html)
+        f.write(HTML_HEAD.format(title="Nutratech | Blocked IPs"))
+        f.write(
+            SUMMARY_BODY.format(
+                count=len(entries), group_rows=group_rows, page_links=page_links
+            )
+        )
+        f.write(HTML_FOOT.format(generated_at=generated_at))
+
 
-    print(f"Generated blocked stats: {len(entries)} IPs -> {OUTPUT_HTML}")
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate the blocked IPs pages from blocked_ips.conf"
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=PAGE_SIZE, help="Entries per page"
+    )
+    parser.add_argument(
+        "--asn-db",
+        action="append",
+        help="Offline ASN database (MaxMind CSV, ip2asn TSV or .mmdb; repeatable)",
+    )
+    parser.add_argument(
+        "--country-db",
+        action="append",
+        help="Offline country database (same formats as --asn-db; repeatable)",
+    )
+    parser.add_argument(
+        "--collapse-threshold",
+        type=int,
+        default=COLLAPSE_THRESHOLD,
+        help="Rules per /24 (or /48) before suggesting a single CIDR",
+    )
+    args = parser.parse_args()
+
+    rules = blocked_rules()
+    entries = parse_blocked_ips(rules)
+    generated_at = "Latest (Automated)"
+
+    asn_index = load_index(*args.asn_db) if args.asn_db else None
+    country_index = load_index(*args.country_db) if args.country_db else None
+    rollups = compute_rollups(
+        rules, asn_index, country_index, collapse_threshold=args.collapse_threshold
+    )
+    groups = {name: g["rules"] for name, g in rollups["groups"].items()}
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    page_size = max(1, args.page_size)
+    pages = max(1, -(-len(entries) // page_size))
+    index = {
+        "count": len(entries),
+        "page_size": page_size,
+        "groups": groups,
+        "pages": [],
+    }
+    for number in range(1, pages + 1):
+        start = (number - 1) * page_size
+        chunk = entries[start : start + page_size]
+        html_name, ndjson_name = write_page(
+            number, pages, chunk, start + 1, len(entries), generated_at
+        )
+        index["pages"].append(
+            {"html": html_name, "ndjson": ndjson_name, "count": len(chunk)}
+        )
+    remove_stale_pages(pages)
+
+    with open(OUTPUT_DIR / "index.json", "w") as f:
+        json.dump(index, f, indent=2)
+        f.write("\n")
+
+    write_summary(entries, groups, index, generated_at)
+
+    print(
+        f"Generated blocked stats: {len(entries)} IPs, {pages} page(s) "
+        f"-> {OUTPUT_HTML} + {OUTPUT_DIR}/"
+    )
+
+    OUTPUT_STATS_JSON.parent.mkdir(parents=True, exist_ok=True)
+    with open(OUTPUT_STATS_JSON, "w") as f:
+        json.dump(rollups, f, indent=2)
+        f.write("\n")
+    print(
+        f"Generated rollups: {len(rollups['collapse_candidates'])} collapse "
+        f"candidate(s) -> {OUTPUT_STATS_JSON}"
+    )
 
     # Update .env with timestamp
     ENV_FILE = REPO_ROOT / "opt/my-website/.env"
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
+import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+from nginx_index import ConfigIndex, find_configs
+
 # Paths relative to repo root
 REPO_ROOT = Path(__file__).parent.parent
 ENV = os.environ.get("ENV", "dev")
@@ -62,45 +68,34 @@ HTML_TEMPLATE = """<!DOCTYPE html>
 </html>"""
 
 
-def parse_file(path, pattern, is_version=False):
-    if not path.exists():
+def parse_file(path, is_version=False, index=None):
+    index = index if index is not None else ConfigIndex(None)
+    model = index.get(path)
+    if model is None:
         print(f"Warning: Could not find config at {path}")
         return []
 
-    with open(path, "r") as f:
-        content = f.read()
-
     items = []
-    matches = pattern.findall(content)
-    for m in matches:
-        if is_version:
-            version_id, description = m
+    if is_version:
+        for v in model["versions"]:
+            version_id = v["id"]
             # Clean up version ID (e.g., '1' -> 'v1')
             if not version_id.startswith("v"):
                 vid = f"v{version_id}"
             else:
                 vid = version_id
-            items.append(
-                {"id": vid, "url": f"/{vid}", "description": description.strip()}
-            )
-        else:
-            name, url = m
-            items.append(
-                {"id": name.strip(), "url": url.strip(), "description": name.strip()}
-            )
+            items.append({"id": vid, "url": f"/{vid}", "description": v["description"]})
+    else:
+        for s in model["services"]:
+            items.append({"id": s["name"], "url": s["url"], "description": s["name"]})
     return items
 
 
-import argparse
-import sys
-
-
-def get_all_services(custom_config_paths=None):
-    # Regex to find "Version X: Description" lines
-    version_pattern = re.compile(r"^\s*#\s*Version\s+(\w+):\s*(.+)$", re.MULTILINE)
-    service_pattern = re.compile(r"^\s*#\s*Service:\s*(.+?)\s*\|\s*(.+)$", re.MULTILINE)
+def get_all_services(custom_config_paths=None, index=None):
+    # Configs are tokenized once and cached by (mtime, size); see nginx_index.py
+    index = index if index is not None else ConfigIndex()
 
-    services_git = parse_file(NGINX_CONF, version_pattern, is_version=True)
+    services_git = parse_file(NGINX_CONF, is_version=True, index=index)
 
     NGINX_CONF_DIR = REPO_ROOT / "etc/nginx/conf.d"
     conf_files = []
@@ -110,7 +105,7 @@ def get_all_services(custom_config_paths=None):
         for path_str in custom_config_paths:
             path = Path(path_str)
             if path.is_dir():
-                found = list(path.rglob("*.conf"))
+                found = find_configs(path)
                 print(f"Scanning directory: {path} ({len(found)} files)")
                 conf_files.extend(found)
             elif path.exists():
@@ -121,7 +116,7 @@ def get_all_services(custom_config_paths=None):
 
         # Deduplicate while preserving order? No need, list is fine.
     elif NGINX_CONF_DIR.exists():
-        conf_files = list(NGINX_CONF_DIR.rglob("*.conf"))
+        conf_files = find_configs(NGINX_CONF_DIR)
         print(f"Scanning {len(conf_files)} config files in {NGINX_CONF_DIR}...")
     else:
         print(f"Warning: Config directory not found at {NGINX_CONF_DIR}")
@@ -141,8 +136,10 @@ def get_all_services(custom_config_paths=None):
         if conf_file.name in ["git-http.conf", "git-http.dev.conf"]:
             continue
 
-        print(f"  Parsing {conf_file.name}...")
-        services_other.extend(parse_file(conf_file, service_pattern, is_version=False))
+        services_other.extend(parse_file(conf_file, index=index))
+
+    index.save()
+    print(f"Parsed {index.parsed} changed config files ({index.hits} cached)")
 
     # Sort services by ID for consistent output
     services_other.sort(key=lambda x: x["id"])
@@ -155,32 +152,80 @@ def generate_html(title, groups, intro_html=None):
     groups: list of tuples (header_name, services_list)
     intro_html: optional HTML string to insert before groups
     """
-    content_html = ""
+    parts = []
 
     if intro_html:
-        content_html += f'<div class="intro">{intro_html}</div>'
+        parts.append(f'<div class="intro">{intro_html}</div>')
 
     for header, services in groups:
         if header:
-            content_html += f'<h2 class="group-header">{header}</h2>'
+            parts.append(f'<h2 class="group-header">{header}</h2>')
 
         for s in services:
             # Use absolute URL if it starts with http, otherwise relative
             url = s["url"]
-            content_html += f"""
+            parts.append(f"""
         <div class="service">
             <h3><a href="{url}">{url}</a></h3>
             <div class="desc">{s['description']}</div>
-        </div>"""
+        </div>""")
 
     return HTML_TEMPLATE.format(
         title=title,
-        content=content_html,
+        content="".join(parts),
         build_time="static_build",
         service_count=sum(len(g[1]) for g in groups),
     )
 
 
+def file_digest(path):
+    """blake2b of the file at `path`, or None if it can't be read."""
+    h = hashlib.blake2b()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.digest()
+
+
+def write_if_changed(path, data):
+    """
+    Atomically replace `path` with `data` unless it already holds it.
+
+    Returns True if the file was written. Untouched files keep their mtime,
+    so make and rsync see nothing to do.
+    """
+    path = Path(path)
+    if file_digest(path) == hashlib.blake2b(data).digest():
+        return False
+    os.makedirs(path.parent, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        if path.exists():
+            os.chmod(tmp, path.stat().st_mode & 0o7777)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return True
+
+
+def write_outputs(outputs):
+    """
+    Write [(label, path, bytes)] concurrently; returns the number written.
+    """
+    with ThreadPoolExecutor(max_workers=len(outputs) or 1) as pool:
+        results = list(pool.map(lambda o: write_if_changed(o[1], o[2]), outputs))
+    for (label, path, _), written in zip(outputs, results):
+        state = "Generated" if written else "Unchanged"
+        print(f"{state} {label} at: {path}")
+    return sum(results)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Generate HTML services map from Nginx config"
@@ -222,21 +267,9 @@ def main():
 
     print(f"Generating Unified Service Map with {total_items} items...")
 
-    # Write to Homepage
-    with open(OUTPUT_HTML_HOME, "w") as f:
-        f.write(home_html)
-    print(f"Generated Homepage map at: {OUTPUT_HTML_HOME}")
-
-    # Write to Git Services (same content)
-    os.makedirs(OUTPUT_HTML.parent, exist_ok=True)
-    with open(OUTPUT_HTML, "w") as f:
-        f.write(home_html)
-    print(f"Generated Git map at: {OUTPUT_HTML}")
-
     # Output 3: JSON Data for Svelte App
     # We want to output this to opt/my-website/src/lib/services.json
     OUTPUT_JSON = REPO_ROOT / "opt/my-website/src/lib/services.json"
-    import json
 
     # Flatten groups for JSON
     json_data = {
@@ -246,21 +279,46 @@ def main():
         ],
     }
 
-    os.makedirs(OUTPUT_JSON.parent, exist_ok=True)
-    with open(OUTPUT_JSON, "w") as f:
-        json.dump(json_data, f, indent=2)
-        f.write("\n")
-    print(f"Generated JSON data at: {OUTPUT_JSON}")
+    # Keep the last service_probe.py results, so restaging unchanged configs
+    # leaves services.json byte-identical
+    try:
+        with open(OUTPUT_JSON, "r") as f:
+            previous = json.load(f)
+        statuses = {
+            s["url"]: s["status"]
+            for g in previous.get("groups", [])
+            for s in g.get("services", [])
+            if "status" in s
+        }
+    except (OSError, ValueError):
+        statuses = {}
+    for _, services in all_groups:
+        for s in services:
+            if s["url"] in statuses:
+                s["status"] = statuses[s["url"]]
+
+    # Render once; the homepage and the Git map share the same bytes
+    html_bytes = home_html.encode()
+    outputs = [
+        ("Homepage map", OUTPUT_HTML_HOME, html_bytes),
+        ("Git map", OUTPUT_HTML, html_bytes),
+        ("JSON data", OUTPUT_JSON, (json.dumps(json_data, indent=2) + "\n").encode()),
+    ]
+    changed = write_outputs(outputs)
 
     # Output 4: Update .env with timestamp
+    # Only when the content moved, so an idle stage leaves the website alone
     ENV_FILE = REPO_ROOT / "opt/my-website/.env"
-    build_time = datetime.now().isoformat()
-
     env_content = ""
     if ENV_FILE.exists():
         with open(ENV_FILE, "r") as f:
             env_content = f.read()
 
+    if not changed and "PUBLIC_BUILD_TIME=" in env_content:
+        print("Kept .env build time (no outputs changed)")
+        return
+
+    build_time = datetime.now().isoformat()
     # Regex to replace or append PUBLIC_BUILD_TIME
     if "PUBLIC_BUILD_TIME=" in env_content:
         env_content = re.sub(
@@ -274,8 +332,7 @@ def main():
             env_content += "\n"
         env_content += f"PUBLIC_BUILD_TIME={build_time}\n"
 
-    with open(ENV_FILE, "w") as f:
-        f.write(env_content)
+    write_if_changed(ENV_FILE, env_content.encode())
     print(f"Updated .env with PUBLIC_BUILD_TIME={build_time}")
 
 
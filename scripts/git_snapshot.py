@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Pre-render git browsing pages into a static directory nginx can serve.
+
+For every repo found by repo_discovery it writes, under klaus' own URL
+layout so nginx can try the file first and fall back to klaus:
+
+    <name>/index.html                          summary, branches, recent commits
+    <name>/tree/<branch>/<dir>/index.html      directory listing per branch
+    <name>/commit/<sha>/index.html             message, diffstat and patch, recent
+                                               only (commits whose patch is over
+                                               MAX_PATCH_BYTES are left to klaus)
+
+Each repo keeps a .snapshot.json manifest of the branch heads it was last
+rendered at. A run compares the current heads against it and only redoes
+what moved: for a branch that advanced, `git diff-tree` names the changed
+paths, and only their directories (and ancestors) are re-rendered; deleted
+branches and directories are removed. A run with no ref changes reads two
+small files per repo and exits. snapshot-post-receive.sh runs this for the
+pushed repo only.
+
+Serving (see etc/nginx/snippets/git-snapshot.conf):
+    location / { root /var/www/git-snapshot; try_files $uri/index.html @klaus; }
+
+Usage:
+    python3 git_snapshot.py                      # all repos, incremental
+    python3 git_snapshot.py --repo /srv/git/projects/cli.git
+    python3 git_snapshot.py --full
+"""
+
+import argparse
+import html
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from repo_discovery import discover
+
+GIT_ROOT = os.environ.get("KLAUS_REPOS_ROOT", "/srv/git")
+OUTPUT_DIR = os.environ.get("GIT_SNAPSHOT_DIR", "/var/www/git-snapshot")
+SITE_NAME = os.environ.get("KLAUS_SITE_NAME", "Git Repos")
+MANIFEST = ".snapshot.json"
+RECENT_COMMITS = 20
+# Bigger patches aren't snapshotted; klaus renders those commits itself
+MAX_PATCH_BYTES = int(os.environ.get("GIT_SNAPSHOT_MAX_PATCH", str(512 << 10)))
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+body {{ font-family: system-ui, sans-serif; max-width: 960px; margin: 2em auto;
+       padding: 0 1em; color: #222; }}
+a {{ color: #0366d6; text-decoration: none; }}
+table {{ border-collapse: collapse; width: 100%; }}
+td {{ padding: 2px 8px; border-bottom: 1px solid #eee; }}
+.muted {{ color: #777; }}
+pre {{ background: #f6f8fa; padding: 1em; overflow-x: auto; }}
+.add {{ color: #22863a; }}
+.del {{ color: #b31d28; }}
+.hunk {{ color: #6f42c1; }}
+</style>
+</head>
+<body>
+<p class="muted"><a href="/">{site}</a>{crumbs}</p>
+{body}
+<p class="muted">Static snapshot generated {generated}</p>
+</body>
+</html>
+"""
+
+
+def repo_name(path):
+    """klaus' name for a repo: its directory name without .git"""
+    name = os.path.basename(path.rstrip("/"))
+    return name[:-4] if name.endswith(".git") else name
+
+
+class Git:
+    def __init__(self, path):
+        self.path = path
+
+    def out(self, *args):
+        return subprocess.check_output(
+            ["git", "--git-dir", self.path, *args], stderr=subprocess.DEVNULL
+        ).decode("utf-8", "replace")
+
+    def out_capped(self, limit, *args):
+        """Like out(), but None once the output grows past `limit` bytes."""
+        proc = subprocess.Popen(
+            ["git", "--git-dir", self.path, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        data = proc.stdout.read(limit + 1)
+        if len(data) > limit:
+            proc.kill()
+            proc.wait()
+            return None
+        proc.stdout.close()
+        if proc.wait():
+            raise subprocess.CalledProcessError(proc.returncode, args)
+        return data.decode("utf-8", "replace")
+
+    def heads(self):
+        out = self.out(
+            "for-each-ref", "--format=%(refname:short)%00%(objectname)", "refs/heads"
+        )
+        return dict(line.split("\0") for line in out.splitlines() if line)
+
+    def default_branch(self):
+        try:
+            return self.out("symbolic-ref", "--short", "HEAD").strip()
+        except subprocess.CalledProcessError:
+            return ""
+
+    def log(self, rev, count):
+        out = self.out(
+            "log", f"-n{count}", "--format=%H%x00%an%x00%at%x00%s", rev, "--"
+        )
+        return [line.split("\0", 3) for line in out.splitlines() if line]
+
+    def ls_tree(self, rev, path):
+        """[(type, name, size)] of one directory, or None if it's gone."""
+        spec = f"{rev}:{path}" if path else f"{rev}:"
+        try:
+            out = self.out("ls-tree", "-z", "-l", spec)
+        except subprocess.CalledProcessError:
+            return None
+        entries = []
+        for item in out.split("\0"):
+            if not item:
+                continue
+            meta, name = item.split("\t", 1)
+            _, kind, _, size = meta.split(None, 3)
+            entries.append((kind, name, size.strip()))
+        # Directories first, like every git browser
+        return sorted(entries, key=lambda e: (e[0] != "tree", e[1]))
+
+    def all_dirs(self, rev):
+        out = self.out("ls-tree", "-r", "-d", "-z", "--name-only", rev)
+        return [""] + [d for d in out.split("\0") if d]
+
+    def changed_dirs(self, old, new):
+        """Directories (with ancestors) touched between two commits."""
+        out = self.out("diff-tree", "-r", "-z", "--name-only", old, new)
+        dirs = {""}
+        for path in out.split("\0"):
+            parent = os.path.dirname(path)
+            while parent and parent not in dirs:
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+        return sorted(dirs)
+
+
+# ----------------- Rendering -----------------
+
+
+def write_file(path, text):
+    """
+    Atomically replace `path`. The temp name is unique, so hooks for two
+    pushes running at once never publish each other's half-written file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        # mkstemp creates 0600; nginx has to read the pages
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_page(path, title, body, crumbs=()):
+    links = "".join(
+        f' / <a href="{html.escape(href)}">{html.escape(text)}</a>'
+        for text, href in crumbs
+    )
+    page = PAGE.format(
+        title=html.escape(title),
+        site=html.escape(SITE_NAME),
+        crumbs=links,
+        body=body,
+        generated=time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime()),
+    )
+    write_file(path, page)
+
+
+def commit_rows(name, commits):
+    rows = []
+    for sha, author, ts, subject in commits:
+        date = time.strftime("%Y-%m-%d", time.gmtime(int(ts)))
+        rows.append(
+            f'<tr><td><a href="/{name}/commit/{sha}/">{sha[:8]}</a></td>'
+            f"<td>{html.escape(subject)}</td><td class=muted>{html.escape(author)}"
+            f"</td><td class=muted>{date}</td></tr>"
+        )
+    return "<table>" + "".join(rows) + "</table>"
+
+
+def render_summary(out, name, git, heads, recent):
+    description = ""
+    try:
+        with open(os.path.join(git.path, "description")) as f:
+            description = f.read().strip()
+    except OSError:
+        pass
+    if description.startswith("Unnamed repository"):
+        description = ""
+
+    branches = "".join(
+        f'<tr><td><a href="/{name}/tree/{html.escape(b)}/">{html.escape(b)}</a></td>'
+        f'<td><a href="/{name}/commit/{sha}/">{sha[:8]}</a></td></tr>'
+        for b, sha in sorted(heads.items())
+    )
+    body = (
+        f"<h1>{html.escape(name)}</h1><p>{html.escape(description)}</p>"
+        f"<h2>Branches</h2><table>{branches}</table>"
+        f"<h2>Recent commits</h2>{commit_rows(name, recent)}"
+    )
+    write_page(os.path.join(out, "index.html"), name, body)
+
+
+def render_tree(out, name, git, branch, sha, path):
+    """Render one directory page; returns False (and removes it) if gone."""
+    target = os.path.join(out, "tree", branch, path)
+    entries = git.ls_tree(sha, path)
+    if entries is None:
+        shutil.rmtree(target, ignore_errors=True)
+        return False
+
+    base = f"/{name}/tree/{branch}/" + (f"{path}/" if path else "")
+    rows = []
+    if path:
+        rows.append(
+            f'<tr><td><a href="{html.escape(base)}../">..</a></td><td></td></tr>'
+        )
+    for kind, entry, size in entries:
+        if kind == "tree":
+            link = f'<a href="{html.escape(base + entry)}/">{html.escape(entry)}/</a>'
+        elif kind == "blob":
+            # Blobs go to klaus (or its response cache) on demand
+            href = f"/{name}/blob/{branch}/" + (f"{path}/" if path else "") + entry
+            link = f'<a href="{html.escape(href)}">{html.escape(entry)}</a>'
+        else:
+            link = html.escape(entry)
+        rows.append(f"<tr><td>{link}</td><td class=muted>{size}</td></tr>")
+    crumbs = [(name, f"/{name}/"), (branch, f"/{name}/tree/{branch}/")]
+    body = f"<h2>{html.escape(path or '/')}</h2><table>{''.join(rows)}</table>"
+    write_page(
+        os.path.join(target, "index.html"), f"{name}: {path or '/'}", body, crumbs
+    )
+    return True
+
+
+def patch_lines(patch):
+    """Escaped patch with +/- and hunk lines marked for colouring."""
+    lines = []
+    for line in patch.splitlines():
+        escaped = html.escape(line)
+        if line.startswith(("+++", "---", "diff ", "index ")):
+            lines.append(f"<b>{escaped}</b>")
+        elif line.startswith("+"):
+            lines.append(f'<span class="add">{escaped}</span>')
+        elif line.startswith("-"):
+            lines.append(f'<span class="del">{escaped}</span>')
+        elif line.startswith("@@"):
+            lines.append(f'<span class="hunk">{escaped}</span>')
+        else:
+            lines.append(escaped)
+    return "\n".join(lines)
+
+
+def render_commit(out, name, git, sha):
+    """
+    Render a commit page; returns False if its patch is too big, leaving
+    the URL to klaus.
+    """
+    target = os.path.join(out, "commit", sha)
+    show = git.out_capped(
+        MAX_PATCH_BYTES,
+        "show",
+        "--stat",
+        "--patch",
+        "--format=%H%n%an <%ae>%n%aD%n%n%B",
+        sha,
+    )
+    if show is None:
+        shutil.rmtree(target, ignore_errors=True)
+        return False
+    body = f"<h2>Commit {sha[:12]}</h2><pre>{patch_lines(show)}</pre>"
+    crumbs = [(name, f"/{name}/")]
+    write_page(os.path.join(target, "index.html"), f"{name}: {sha[:8]}", body, crumbs)
+    return True
+
+
+# ----------------- Snapshot -----------------
+
+
+def load_manifest(out):
+    try:
+        with open(os.path.join(out, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"heads": {}, "commits": []}
+
+
+def save_manifest(out, manifest):
+    write_file(os.path.join(out, MANIFEST), json.dumps(manifest))
+
+
+def snapshot_repo(path, output_dir, full=False):
+    """Bring one repo's pages up to date; returns the number of pages written."""
+    name = repo_name(path)
+    out = os.path.join(output_dir, name)
+    git = Git(path)
+    heads = git.heads()
+    manifest = {"heads": {}, "commits": []} if full else load_manifest(out)
+    old_heads = manifest["heads"]
+    if heads == old_heads and not full:
+        return 0
+
+    if full:
+        shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out, exist_ok=True)
+    pages = 0
+
+    for branch in set(old_heads) - set(heads):
+        shutil.rmtree(os.path.join(out, "tree", branch), ignore_errors=True)
+
+    for branch, sha in heads.items():
+        old = old_heads.get(branch)
+        if old == sha:
+            continue
+        try:
+            dirs = git.changed_dirs(old, sha) if old else git.all_dirs(sha)
+        except subprocess.CalledProcessError:
+            # Old head was garbage collected after a force push
+            shutil.rmtree(os.path.join(out, "tree", branch), ignore_errors=True)
+            dirs = git.all_dirs(sha)
+        for d in dirs:
+            pages += render_tree(out, name, git, branch, sha, d)
+
+    # Recent commits across all branches, newest first
+    recent = {}
+    for branch in heads:
+        for commit in git.log(branch, RECENT_COMMITS):
+            recent.setdefault(commit[0], commit)
+    recent = sorted(recent.values(), key=lambda c: int(c[2]), reverse=True)
+    recent = recent[:RECENT_COMMITS]
+    keep = {c[0] for c in recent} | set(heads.values())
+    for sha in keep - set(manifest["commits"]):
+        pages += render_commit(out, name, git, sha)
+    for sha in set(manifest["commits"]) - keep:
+        shutil.rmtree(os.path.join(out, "commit", sha), ignore_errors=True)
+
+    default = git.default_branch()
+    summary_log = git.log(default, RECENT_COMMITS) if default in heads else recent
+    render_summary(out, name, git, heads, summary_log)
+    pages += 1
+
+    save_manifest(out, {"heads": heads, "commits": sorted(keep)})
+    return pages
+
+
+def render_index(output_dir, repos):
+    rows = "".join(
+        f'<tr><td><a href="/{html.escape(repo_name(r))}/">'
+        f"{html.escape(repo_name(r))}</a></td></tr>"
+        for r in repos
+    )
+    write_page(
+        os.path.join(output_dir, "index.html"),
+        SITE_NAME,
+        f"<h1>{html.escape(SITE_NAME)}</h1><table>{rows}</table>",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render static git pages")
+    parser.add_argument("--root", default=GIT_ROOT, help="Repository root")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="Output directory")
+    parser.add_argument("--repo", help="Only this repo (e.g. from a post-receive hook)")
+    parser.add_argument(
+        "--full", action="store_true", help="Ignore manifests and re-render"
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.repo:
+        repos = [os.path.abspath(args.repo)]
+    else:
+        repos = discover(args.root)
+
+    total = 0
+    for path in repos:
+        try:
+            pages = snapshot_repo(path, args.output, args.full)
+        except subprocess.CalledProcessError as e:
+            print(f"Warning: skipping {path}: {e}", file=sys.stderr)
+            continue
+        if pages:
+            print(f"{repo_name(path)}: {pages} pages")
+        total += pages
+
+    # Cheap even from a hook: discovery is cached
+    render_index(args.output, discover(args.root))
+    elapsed = time.perf_counter() - started
+    print(f"Snapshot done: {total} pages for {len(repos)} repos in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,607 @@
+import cProfile
+import hashlib
+import json
 import os
+import re
+import resource
+import threading
+import time
+from collections import OrderedDict
 
 import klaus
 from klaus.contrib.wsgi import make_app
 
+from rate_table import DEFAULT_PATH as RATE_TABLE_PATH
+from rate_table import RateTable
+from repo_discovery import discover, scan, watch
+
 # Root directory for repositories
 REPO_ROOT = os.environ.get("KLAUS_REPOS_ROOT", "/srv/git")
 SITE_NAME = os.environ.get("KLAUS_SITE_NAME", "Git Repos")
+# Pick up repos added/removed by manage_repos.py without a restart
+WATCH_REPOS = os.environ.get("KLAUS_WATCH_REPOS", "1") == "1"
+# Response cache for full-SHA URLs; KLAUS_CACHE_MB=0 disables it
+CACHE_MB = int(os.environ.get("KLAUS_CACHE_MB", "64"))
+CACHE_DIR = os.environ.get("KLAUS_CACHE_DIR")
+CACHE_DISK_MB = int(os.environ.get("KLAUS_CACHE_DISK_MB", "512"))
+# Per-IP token buckets shared by all workers; KLAUS_RATE=0 disables them
+RATE = float(os.environ.get("KLAUS_RATE", "1"))
+BURST = float(os.environ.get("KLAUS_BURST", "60"))
+# Opt-in latency/size metrics at METRICS_PATH (loopback only), and cProfile
+# dumps of the next KLAUS_PROFILE requests into KLAUS_PROFILE_DIR
+METRICS = os.environ.get("KLAUS_METRICS", "0") == "1"
+METRICS_PATH = os.environ.get("KLAUS_METRICS_PATH", "/-/metrics")
+PROFILE_REQUESTS = int(os.environ.get("KLAUS_PROFILE", "0"))
+PROFILE_DIR = os.environ.get("KLAUS_PROFILE_DIR", "/tmp/klaus-profile")
 
 
 def find_git_repos(root_dir):
     """
-    Recursively find all git repositories (directories ending in .git)
+    Find all git repositories (directories ending in .git), without
+    descending into them; cached between worker starts.
+    """
+    return discover(root_dir)
+
+
+def repo_set_fingerprint(repos):
+    return hashlib.sha1("\n".join(sorted(repos)).encode()).hexdigest()[:12]
+
+
+class RepoRegistry:
+    """
+    WSGI app that serves the current repo set and hot-swaps on changes.
+
+    update() only queues the new list; a background thread builds the next
+    klaus app and then swaps it in with a single reference assignment.
+    Each request grabs the app once, so in-flight requests finish on the app
+    they started with while new ones get the new set. Bursts of updates
+    coalesce into one rebuild.
+
+    The builder thread (and the watcher on `watch_root`, if given) start on
+    the first request in each process rather than at import: threads don't
+    survive the fork when gunicorn preloads the app into its workers.
+    """
+
+    def __init__(self, repos, site_name=SITE_NAME, watch_root=None):
+        self.site_name = site_name
+        self.watch_root = watch_root
+        self.repos = list(repos)
+        self.app = make_app(self.repos, site_name)
+        self.generation = 1
+        self.fingerprint = repo_set_fingerprint(self.repos)
+        self._pending = None
+        self._wakeup = threading.Condition()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def __call__(self, environ, start_response):
+        if self._started_pid != os.getpid():
+            self.start()
+        return self.app(environ, start_response)
+
+    def start(self):
+        """Start this process's builder (and watcher) threads, once."""
+        pid = os.getpid()
+        with self._start_lock:
+            if self._started_pid == pid:
+                return
+            threading.Thread(target=self._builder, daemon=True).start()
+            if self.watch_root:
+                watch(self.watch_root, self.update)
+                # Catch up on changes made since the app was loaded; the
+                # watcher only reports what changes after it starts
+                self.update(scan(self.watch_root)[0])
+            self._started_pid = pid
+
+    def _after_fork(self):
+        # The parent's threads are gone and its locks may be held
+        self._wakeup = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._started_pid = None
+
+    def update(self, repos):
+        with self._wakeup:
+            self._pending = list(repos)
+            self._wakeup.notify()
+
+    def _builder(self):
+        while True:
+            with self._wakeup:
+                while self._pending is None:
+                    self._wakeup.wait()
+                repos, self._pending = self._pending, None
+            # A repo may vanish between discovery and the build
+            repos = [r for r in repos if os.path.isdir(r)]
+            if repos == self.repos:
+                continue
+            try:
+                app = make_app(repos, self.site_name)
+            except Exception as e:
+                print(f"Warning: rebuild failed, still serving old repo set: {e}")
+                continue
+            added = len(set(repos) - set(self.repos))
+            removed = len(set(self.repos) - set(repos))
+            self.repos, self.app = repos, app
+            self.fingerprint = repo_set_fingerprint(repos)
+            self.generation += 1
+            print(
+                f"Repositories changed (+{added} -{removed}), now {len(repos)}; "
+                f"serving generation {self.generation}"
+            )
+
+
+# Routes whose content is fixed once the revision is a full commit SHA.
+# Branch/tag names and abbreviated SHAs never match, nor do tarballs.
+IMMUTABLE_URL = re.compile(
+    r"^(?:/~[^/]+)?/[^/]+/(?:commit|blob|blame|raw|tree|submodule)/"
+    r"(?:[0-9a-f]{40}|[0-9a-f]{64})(?:[/.]|$)"
+)
+
+
+class ResponseCache:
+    """
+    WSGI middleware caching rendered pages for SHA-addressed URLs.
+
+    A memory LRU bounded by total body size sits in front of an optional
+    on-disk tier (one file per URL, pruned oldest-first). Cached responses
+    get a strong ETag and a year-long immutable Cache-Control so nginx and
+    browsers can cache them too; If-None-Match is answered with a 304.
+    Keys include the registry's repo set fingerprint, so after a repo is
+    renamed or removed its old URLs are rendered (and 404) afresh.
     """
-    repos = []
-    for root, dirs, files in os.walk(root_dir):
-        # Scan directories
-        for d in dirs:
-            if d.endswith(".git"):
-                full_path = os.path.join(root, d)
-                repos.append(full_path)
-    return sorted(repos)
+
+    MAX_ENTRY = 2 << 20
+    CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+    def __init__(self, app, max_bytes, disk_dir=None, disk_max_bytes=0, registry=None):
+        self.app = app
+        self.registry = registry
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_size = sum(
+                e.stat().st_size for e in os.scandir(disk_dir) if e.is_file()
+            )
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if environ.get("REQUEST_METHOD") not in ("GET", "HEAD") or (
+            not IMMUTABLE_URL.match(path)
+        ):
+            return self.app(environ, start_response)
+
+        key = "\0".join(
+            (
+                getattr(self.registry, "fingerprint", ""),
+                environ.get("SCRIPT_NAME", ""),
+                path,
+                environ.get("QUERY_STRING", ""),
+            )
+        )
+        entry = self._get(key)
+        if entry is not None:
+            self.hits += 1
+            return self._respond(environ, start_response, entry, "HIT")
+        if environ["REQUEST_METHOD"] == "HEAD":
+            # The app sends no body for HEAD; only a GET may fill the cache
+            return self.app(environ, start_response)
+
+        self.misses += 1
+        captured = []
+        chunks = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers]
+            # Data passed to write() comes before the returned iterable
+            return chunks.append
+
+        result = self.app(environ, capture)
+        size = sum(len(c) for c in chunks)
+        body_iter = iter(result)
+        for chunk in body_iter:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self.MAX_ENTRY:
+                # Too big to keep (large raw blobs); stream the rest through
+                start_response(*captured)
+                return _chain_close(chunks, body_iter, result)
+        if hasattr(result, "close"):
+            result.close()
+
+        status, headers = captured
+        body = b"".join(chunks)
+        if not status.startswith("200") or headers_get(headers, "Set-Cookie"):
+            start_response(status, headers)
+            return [body]
+
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        headers = [
+            (k, v)
+            for k, v in headers
+            if k.lower() not in ("etag", "cache-control", "expires")
+        ] + [("ETag", etag), ("Cache-Control", self.CACHE_CONTROL)]
+        entry = (status, headers, body)
+        self._put(key, entry)
+        return self._respond(environ, start_response, entry, "MISS")
+
+    def _respond(self, environ, start_response, entry, cache_state):
+        status, headers, body = entry
+        etag = headers_get(headers, "ETag")
+        if etag and etag in environ.get("HTTP_IF_NONE_MATCH", ""):
+            start_response(
+                "304 Not Modified",
+                [(k, v) for k, v in headers if k in ("ETag", "Cache-Control")],
+            )
+            return [b""]
+        start_response(status, headers + [("X-Cache", cache_state)])
+        return [b""] if environ["REQUEST_METHOD"] == "HEAD" else [body]
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._memory_put(key, entry)
+        return entry
+
+    def _put(self, key, entry):
+        self._memory_put(key, entry)
+        self._disk_put(key, entry)
+
+    def _memory_put(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._size += len(entry[2])
+            while self._size > self.max_bytes and self._entries:
+                _, old = self._entries.popitem(last=False)
+                self._size -= len(old[2])
+
+    # ----------------- Disk tier -----------------
+
+    def _disk_path(self, key):
+        name = hashlib.sha256(key.encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(self.disk_dir, name)
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return meta["status"], [tuple(h) for h in meta["headers"]], body
+
+    def _disk_put(self, key, entry):
+        if not self.disk_dir:
+            return
+        status, headers, body = entry
+        path = self._disk_path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(json.dumps({"status": status, "headers": headers}).encode())
+                f.write(b"\n")
+                f.write(body)
+                written = f.tell()
+            try:
+                # Another worker may have stored this key already
+                replaced = os.stat(path).st_size
+            except OSError:
+                replaced = 0
+            os.replace(tmp, path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_size += written - replaced
+            if self._disk_size <= self.disk_max_bytes:
+                return
+        self._disk_prune()
+
+    def _disk_prune(self):
+        files = []
+        for e in os.scandir(self.disk_dir):
+            if e.is_file():
+                st = e.stat()
+                files.append((st.st_atime, st.st_size, e.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        # Drop down to 90% so we don't prune on every write
+        target = self.disk_max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_size = total
+
+
+def _chain_close(head, rest, result):
+    try:
+        yield from head
+        yield from rest
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+# Up-front token cost per route type; what a page costs to render relative
+# to the repo list. Measured render time is charged on top (TIME_COST/s).
+ROUTE_COSTS = {
+    "static": 0,
+    "list": 1,
+    "summary": 1,
+    "raw": 1,
+    "blob": 2,
+    "commit": 2,
+    "submodule": 2,
+    "history": 4,
+    "blame": 10,
+    "tarball": 20,
+}
+TIME_COST = 10
+
+ROUTE = re.compile(
+    r"^(?:/~[^/]+)?/[^/]+/(blob|blame|raw|submodule|commit|tree|tarball)/"
+)
+LOOPBACK = ("127.0.0.1", "::1")
+
+
+def route_kind(path):
+    if path in ("/", "") or path.startswith("/robots.txt"):
+        return "list"
+    if path.startswith("/static/"):
+        return "static"
+    m = ROUTE.match(path)
+    if not m:
+        return "summary"
+    return "history" if m.group(1) == "tree" else m.group(1)
+
+
+def client_ip(environ):
+    addr = environ.get("REMOTE_ADDR", "")
+    # Behind the nginx proxy the real client comes in X-Real-IP
+    if addr in LOOPBACK:
+        return environ.get("HTTP_X_REAL_IP", addr)
+    return addr
+
+
+class RateLimit:
+    """
+    WSGI middleware charging each client by route cost and render time.
+
+    A request needs its route's cost in tokens up front, or gets a 429 with
+    a Retry-After. Once the response is fully sent, its wall time is charged
+    too (which can drive the bucket negative), so slow blames of big files
+    throttle a scraper much sooner than cheap summary pages do a reader.
+    Buckets live in a RateTable shared by every worker;
+    `python3 rate_table.py top` lists the heaviest clients.
+    """
+
+    def __init__(self, app, table):
+        self.app = app
+        self.table = table
+
+    def __call__(self, environ, start_response):
+        cost = ROUTE_COSTS[route_kind(environ.get("PATH_INFO", ""))]
+        if not cost:
+            return self.app(environ, start_response)
+        try:
+            ip = client_ip(environ)
+            allowed, tokens = self.table.charge(ip, cost)
+        except ValueError:
+            # Not an address (unix socket peer); nothing to key on
+            return self.app(environ, start_response)
+
+        if not allowed:
+            # charge() caps the cost at the burst; wait for that much
+            needed = min(cost, self.table.burst)
+            retry = max(1, int((needed - tokens) / self.table.rate + 0.999))
+            start_response(
+                "429 Too Many Requests",
+                [("Content-Type", "text/plain"), ("Retry-After", str(retry))],
+            )
+            return [b"Too many requests, slow down.\n"]
+
+        started = time.perf_counter()
+        result = self.app(environ, start_response)
+        return self._charge_when_done(result, ip, started)
+
+    def _charge_when_done(self, result, ip, started):
+        try:
+            yield from result
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            elapsed = time.perf_counter() - started
+            self.table.debit(ip, elapsed * TIME_COST)
+
+
+# Fixed histogram bucket bounds (Prometheus `le`), roughly log-spaced
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+SIZE_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Instrument:
+    """
+    WSGI middleware recording per-route latency, response size and peak RSS
+    growth, served in Prometheus text format at METRICS_PATH.
+
+    Latency covers the full response, body included. RSS growth is the
+    rise in the worker's peak RSS while serving, so only the requests that
+    push the high-water mark show up. Metrics are per worker process (the
+    `pid` label tells them apart). With profile_requests > 0, that many of
+    the next requests are run under cProfile and dumped to profile_dir.
+    """
+
+    def __init__(self, app, profile_requests=0, profile_dir=PROFILE_DIR):
+        self.app = app
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._profile_left = profile_requests
+        self.profile_dir = profile_dir
+        if profile_requests:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path == METRICS_PATH:
+            return self._serve_metrics(environ, start_response)
+
+        route = route_kind(path)
+        status_holder = []
+
+        def record_status(status, headers, exc_info=None):
+            status_holder.append(status.split(" ", 1)[0])
+            return start_response(status, headers, exc_info)
+
+        profiler = None
+        with self._lock:
+            if self._profile_left > 0:
+                self._profile_left -= 1
+                profiler = cProfile.Profile()
+        if profiler:
+            profiler.enable()
+
+        started = time.perf_counter()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = self.app(environ, record_status)
+        return self._observe(
+            result, route, status_holder, started, rss_before, profiler, path
+        )
+
+    def _observe(
+        self, result, route, status_holder, started, rss_before, profiler, path
+    ):
+        size = 0
+        try:
+            for chunk in result:
+                size += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            elapsed = time.perf_counter() - started
+            rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+            if profiler:
+                profiler.disable()
+                name = re.sub(r"[^A-Za-z0-9_.-]+", "_", path.strip("/"))[:80]
+                profiler.dump_stats(
+                    os.path.join(
+                        self.profile_dir, f"{self.pid}-{time.time():.0f}-{name}.prof"
+                    )
+                )
+            status = status_holder[0] if status_holder else "000"
+            with self._lock:
+                stats = self._routes.get((route, status))
+                if stats is None:
+                    stats = self._routes[(route, status)] = {
+                        "latency": Histogram(LATENCY_BUCKETS),
+                        "size": Histogram(SIZE_BUCKETS),
+                        "rss_kb": 0,
+                    }
+                stats["latency"].observe(elapsed)
+                stats["size"].observe(size)
+                stats["rss_kb"] += rss_growth
+
+    def _serve_metrics(self, environ, start_response):
+        # Loopback only, and not anything proxied in by nginx from outside
+        if environ.get("REMOTE_ADDR") not in LOOPBACK or environ.get("HTTP_X_REAL_IP"):
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found\n"]
+
+        # Prometheus wants each metric family's samples in one group
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = ["# TYPE klaus_request_seconds histogram"]
+            for (route, status), stats in routes:
+                labels = f'route="{route}",status="{status}",pid="{self.pid}"'
+                lines += stats["latency"].render("klaus_request_seconds", labels)
+            lines.append("# TYPE klaus_response_bytes histogram")
+            for (route, status), stats in routes:
+                labels = f'route="{route}",status="{status}",pid="{self.pid}"'
+                lines += stats["size"].render("klaus_response_bytes", labels)
+            lines.append("# TYPE klaus_peak_rss_growth_kilobytes_total counter")
+            for (route, status), stats in routes:
+                labels = f'route="{route}",status="{status}",pid="{self.pid}"'
+                lines.append(
+                    f"klaus_peak_rss_growth_kilobytes_total{{{labels}}} "
+                    f"{stats['rss_kb']}"
+                )
+        lines.append("# TYPE klaus_peak_rss_kilobytes gauge")
+        lines.append(
+            f'klaus_peak_rss_kilobytes{{pid="{self.pid}"}} '
+            f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}"
+        )
+        body = ("\n".join(lines) + "\n").encode()
+        start_response(
+            "200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")]
+        )
+        return [body]
+
+
+def headers_get(headers, name):
+    name = name.lower()
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return None
 
 
 # Discover repositories
@@ -31,7 +613,26 @@ else:
     print(f"Found {len(repositories)} repositories: {repositories}")
 
 # Create the WSGI application
-application = make_app(
-    repositories,
-    SITE_NAME,
+registry = RepoRegistry(
+    repositories, SITE_NAME, watch_root=REPO_ROOT if WATCH_REPOS else None
 )
+application = registry
+
+# Inside the cache, so cache hits are never charged
+if RATE > 0:
+    application = RateLimit(
+        application, RateTable(RATE_TABLE_PATH, rate=RATE, burst=BURST)
+    )
+
+if CACHE_MB > 0:
+    application = ResponseCache(
+        application,
+        CACHE_MB << 20,
+        disk_dir=CACHE_DIR,
+        disk_max_bytes=CACHE_DISK_MB << 20,
+        registry=registry,
+    )
+
+# Outermost, so cache hits and 429s are measured too
+if METRICS or PROFILE_REQUESTS:
+    application = Instrument(application, profile_requests=PROFILE_REQUESTS)
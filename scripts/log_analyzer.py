@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Streaming nginx access-log analyzer that proposes blocked_ips.conf entries.
+
+Reads combined-format logs (access.log, bad_bots.log, admin_access.log, plain
+or .gz, or stdin), runs every request through ONE compiled alternation of all
+detection patterns, and keeps per-IP sliding-window counters in a bounded LRU
+table. IPs that cross a rule's threshold and aren't already blocked are
+printed as `geo $bad_ip` entries under grouped comment headers, or merged
+into blocked_ips.conf with --apply.
+
+Usage:
+    python3 log_analyzer.py /var/log/nginx/access.log /var/log/nginx/bad_bots.log
+    python3 log_analyzer.py --follow /var/log/nginx/access.log
+    python3 log_analyzer.py --apply /var/log/nginx/access.log.1
+    python3 log_analyzer.py --checkpoint --apply /var/log/nginx/access.log
+"""
+
+import argparse
+import calendar
+import re
+import sys
+import time
+from collections import OrderedDict, deque, namedtuple
+from pathlib import Path
+
+from blocklist import BLOCKED_CONF, Blocklist
+from log_checkpoint import DEFAULT_STATE_FILE, LogCheckpoint
+from log_reader import CHUNK_SIZE, iter_fields, scan_chunks
+
+# name:      regex group name (must be a valid identifier)
+# header:    comment header the IP is filed under in blocked_ips.conf
+# pattern:   regex searched in the request line ("GET /path HTTP/1.1")
+# threshold: hits needed inside `window` seconds to flag the IP
+Detector = namedtuple("Detector", ["name", "header", "pattern", "threshold", "window"])
+
+# Mirrors etc/fail2ban/filter.d/nginx-git-scrapers.conf and the
+# $bad_request map in etc/nginx/conf.d/bad-behavior.conf
+DETECTORS = [
+    Detector("next_probe", "Spam Bots (Next.js Probes)", r"/_next/", 2, 600),
+    Detector("api_route", "API Route Probes (from logs)", r"/api/route", 2, 600),
+    Detector("sdk_probe", "SDK Probes (from logs)", r"/SDK/webLanguage", 1, 600),
+    Detector(
+        "project_list", "SDK Probes (from logs)", r"/v[12]\?.*=project_list", 1, 600
+    ),
+    Detector("boaform", "Router Exploits (from logs)", r"/boaform/", 1, 600),
+    Detector("dotenv", "Secret File Probes (from logs)", r"/\.env", 2, 600),
+    Detector("git_config", "Secret File Probes (from logs)", r"/\.git/config", 2, 600),
+    Detector(
+        "php_probe",
+        "Malicious PHP Probes (from logs)",
+        r"/(?:wp-config|config|shell|xmlrpc|wp-login)\.php",
+        2,
+        600,
+    ),
+    # Deep scraping of git objects: only flagged when it's sustained
+    Detector(
+        "git_scrape",
+        "Aggressive Git Scrapers (from logs)",
+        r"/(?:commit|blame|raw|tree|src/commit)/[0-9a-f]{7,40}",
+        30,
+        60,
+    ),
+]
+
+MONTHS = {
+    m.encode(): i
+    for i, m in enumerate(
+        ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
+        + ["Jul", "Aug", "Sep", "Oct", "Nov", "Dec"],
+        1,
+    )
+}
+
+DEFAULT_MAX_TRACKED = 200_000
+
+
+def build_matcher(detectors=DETECTORS):
+    """Compile all detector patterns into one alternation of named groups."""
+    return re.compile(
+        "|".join(f"(?P<{d.name}>{d.pattern})" for d in detectors).encode()
+    )
+
+
+class TimeParser:
+    """Parses `10/Oct/2025:13:55:36 +0000`, reusing the result per second."""
+
+    def __init__(self):
+        self._last_raw = None
+        self._last_ts = 0.0
+
+    @property
+    def last(self):
+        return self._last_ts
+
+    def __call__(self, raw):
+        if raw == self._last_raw:
+            return self._last_ts
+        try:
+            day, mon, rest = raw.split(b"/", 2)
+            year, hh, mm, ss_tz = rest.split(b":", 3)
+            ss, tz = ss_tz.split(b" ", 1)
+            ts = calendar.timegm(
+                (int(year), MONTHS[mon], int(day), int(hh), int(mm), int(ss))
+            )
+            sign = -1 if tz[:1] == b"+" else 1
+            ts += sign * (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60)
+        except (ValueError, KeyError, IndexError):
+            ts = self._last_ts
+        self._last_raw = raw
+        self._last_ts = ts
+        return ts
+
+
+def follow(path, interval=1.0):
+    """Yield newline-terminated chunks appended to `path` (like tail -f)."""
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        pending = b""
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                time.sleep(interval)
+                continue
+            data = pending + data
+            cut = data.rfind(b"\n")
+            if cut == -1:
+                pending = data
+                continue
+            yield data[: cut + 1]
+            pending = data[cut + 1 :]
+
+
+class SlidingWindowCounter:
+    """
+    Per-(ip, detector) hit timestamps, bounded in memory.
+
+    Each key keeps at most `threshold` timestamps (a deque with maxlen), which
+    is all that's needed to answer "were there >= threshold hits inside the
+    window". The key table is an LRU capped at `max_tracked`; the coldest
+    keys are evicted first.
+    """
+
+    def __init__(self, max_tracked=DEFAULT_MAX_TRACKED):
+        self.max_tracked = max_tracked
+        self._hits = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._hits)
+
+    def hit(self, key, ts, threshold, window):
+        """Record a hit; return True if `key` just crossed its threshold."""
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque(maxlen=threshold)
+            if len(self._hits) > self.max_tracked:
+                self._hits.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._hits.move_to_end(key)
+        hits.append(ts)
+        return len(hits) == threshold and ts - hits[0] <= window
+
+    def forget(self, key):
+        self._hits.pop(key, None)
+
+    def export(self, since):
+        """Keys with hits newer than `since`, as JSON-friendly lists."""
+        return [
+            [[key[0].decode(), key[1]], list(hits), hits.maxlen]
+            for key, hits in self._hits.items()
+            if hits and hits[-1] >= since
+        ]
+
+    def restore(self, rows):
+        for key, hits, maxlen in rows:
+            self._hits[(key[0].encode(), key[1])] = deque(hits, maxlen=maxlen)
+
+
+class Analyzer:
+    def __init__(
+        self, detectors=DETECTORS, blocklist=None, max_tracked=DEFAULT_MAX_TRACKED
+    ):
+        self.detectors = {d.name: d for d in detectors}
+        self.matcher = build_matcher(detectors)
+        self.blocklist = blocklist if blocklist is not None else Blocklist()
+        self.counter = SlidingWindowCounter(max_tracked)
+        # ip -> (detector, first_ts, last_ts, hits); insertion ordered
+        self.flagged = OrderedDict()
+        self.lines = 0
+        self.matched = 0
+        self.already_blocked = 0
+        self.parse_time = TimeParser()
+        self.last_ts = 0.0
+
+    def feed(self, records):
+        """Consume log_reader field tuples (addr, time, path, status, ua)."""
+        search = self.matcher.search
+        detectors = self.detectors
+        flagged = self.flagged
+        parse_time = self.parse_time
+        lines = 0
+        for ip, raw_ts, path, _, _ in records:
+            lines += 1
+            if path is None:
+                continue
+            m = search(path)
+            if not m:
+                continue
+            self.matched += 1
+            ts = parse_time(raw_ts)
+            if ip in flagged:
+                det, first, _, hits = flagged[ip]
+                flagged[ip] = (det, first, ts, hits + 1)
+                continue
+            det = detectors[m.lastgroup]
+            key = (ip, det.name)
+            if self.counter.hit(key, ts, det.threshold, det.window):
+                self.counter.forget(key)
+                if ip.decode() in self.blocklist:
+                    self.already_blocked += 1
+                    continue
+                flagged[ip] = (det, ts, ts, det.threshold)
+        self.lines += lines
+        self.last_ts = max(self.last_ts, parse_time.last)
+        return self
+
+    def export_state(self):
+        """Counters still inside the longest window, for the next run."""
+        longest = max(d.window for d in self.detectors.values())
+        return {"counters": self.counter.export(self.last_ts - longest)}
+
+    def restore_state(self, state):
+        self.counter.restore(state.get("counters", []))
+
+    def candidates(self):
+        """Flagged IPs grouped by comment header: [(header, [ip, ...]), ...]"""
+        grouped = OrderedDict()
+        for ip, (det, _, _, _) in self.flagged.items():
+            grouped.setdefault(det.header, []).append(ip.decode())
+        return list(grouped.items())
+
+
+def render_candidates(groups):
+    lines = []
+    for header, ips in groups:
+        lines.append(f"    # {header}")
+        lines.extend(f"    {ip} 1;" for ip in ips)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def merge_into_conf(text, groups):
+    """
+    Insert candidate IPs into the geo block of blocked_ips.conf content.
+
+    IPs are appended to the end of an existing group with the same header,
+    or added as a new group just before the closing brace. Content without
+    a closing brace (an empty or new file) gets a fresh geo block first.
+    """
+    lines = text.splitlines()
+    close = _closing_brace(lines)
+    if close is None:
+        if lines and lines[-1].strip():
+            lines.append("")
+        lines += ["geo $bad_ip {", "    default 0;", "}"]
+        close = len(lines) - 1
+
+    for header, ips in groups:
+        entries = [f"    {ip} 1;" for ip in ips]
+        start = next(
+            (
+                i
+                for i, line in enumerate(lines[:close])
+                if line.strip() == f"# {header}"
+            ),
+            None,
+        )
+        if start is None:
+            block = [""] if close and lines[close - 1].strip() else []
+            block += [f"    # {header}"] + entries
+            lines[close:close] = block
+        else:
+            # End of the group: last entry line before the next comment/brace
+            end = start + 1
+            for i in range(start + 1, close):
+                stripped = lines[i].strip()
+                if stripped.startswith("#"):
+                    break
+                if stripped:
+                    end = i + 1
+            lines[end:end] = entries
+        close = _closing_brace(lines)
+
+    return "\n".join(lines) + "\n"
+
+
+def _closing_brace(lines):
+    """Index of the last line that is just "}", or None."""
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i].strip() == "}":
+            return i
+    return None
+
+
+def print_summary(analyzer, elapsed):
+    rate = analyzer.lines / elapsed if elapsed else 0
+    print(
+        f"# Scanned {analyzer.lines} lines in {elapsed:.2f}s ({rate:,.0f} lines/s), "
+        f"{analyzer.matched} matched, {len(analyzer.flagged)} new candidates, "
+        f"{analyzer.already_blocked} already blocked, "
+        f"{len(analyzer.counter)} keys tracked ({analyzer.counter.evicted} evicted)",
+        file=sys.stderr,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find abusive IPs in nginx logs and propose blocklist entries"
+    )
+    parser.add_argument(
+        "logs", nargs="*", default=["-"], help="Log files (.gz ok); '-' for stdin"
+    )
+    parser.add_argument(
+        "--conf", default=str(BLOCKED_CONF), help="Path to blocked_ips.conf"
+    )
+    parser.add_argument(
+        "--follow", action="store_true", help="Keep reading the last file (tail -f)"
+    )
+    parser.add_argument(
+        "--apply", action="store_true", help="Write candidates into --conf"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        nargs="?",
+        const=DEFAULT_STATE_FILE,
+        metavar="STATE_FILE",
+        help=f"Resume from the last run's offsets (default: {DEFAULT_STATE_FILE})",
+    )
+    parser.add_argument(
+        "--max-tracked",
+        type=int,
+        default=DEFAULT_MAX_TRACKED,
+        help="Max (ip, rule) counters kept in memory",
+    )
+    args = parser.parse_args()
+
+    analyzer = Analyzer(
+        blocklist=Blocklist.from_file(args.conf), max_tracked=args.max_tracked
+    )
+
+    started = time.monotonic()
+    if args.checkpoint:
+        if args.follow or "-" in args.logs:
+            parser.error("--checkpoint needs log files and can't be used with --follow")
+        with LogCheckpoint(args.checkpoint) as cp:
+            analyzer.restore_state(cp.extra.get("analyzer", {}))
+            for path in args.logs:
+                analyzer.feed(scan_chunks(cp.read_chunks(path)))
+            cp.extra["analyzer"] = analyzer.export_state()
+    else:
+        try:
+            for path in args.logs:
+                analyzer.feed(iter_fields(path))
+            if args.follow:
+                path = args.logs[-1]
+                print(f"# Following {path} (Ctrl+C to stop)...", file=sys.stderr)
+                analyzer.feed(scan_chunks(follow(path)))
+        except KeyboardInterrupt:
+            pass
+    print_summary(analyzer, time.monotonic() - started)
+
+    groups = analyzer.candidates()
+    if not groups:
+        return
+
+    if args.apply:
+        conf = Path(args.conf)
+        conf.write_text(merge_into_conf(conf.read_text(), groups))
+        print(f"Added {len(analyzer.flagged)} IPs to {conf}")
+    else:
+        print(render_candidates(groups))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Incremental log reading with persisted checkpoints.
+
+For every log path the checkpoint file stores the inode/device, the byte
+offset of the last complete line consumed and a hash of that line. The next
+run resumes from that offset, and handles logrotate:
+
+  * same inode, hash matches        -> continue from the offset
+  * inode changed (file rotated)    -> finish the old file from its offset
+                                       (found as <log>.1, or <log>.1.gz when
+                                       already compressed), then read the new
+                                       file from the start
+  * same inode, shorter or hash     -> file was truncated/rewritten
+    mismatch                           (copytruncate), start from 0
+
+Only complete lines are consumed; a partially written last line is left for
+the next run. State is written atomically, and only when the caller commits,
+so a crash mid-run re-reads the same lines instead of skipping them.
+
+Usage:
+    with LogCheckpoint(STATE_FILE) as cp:
+        for line in cp.read("/var/log/nginx/access.log"):
+            ...
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+DEFAULT_STATE_FILE = os.path.expanduser("~/.nginx-ops/log_checkpoints.json")
+
+READ_SIZE = 1 << 20
+
+
+def line_hash(line):
+    return hashlib.sha1(line).hexdigest()
+
+
+def _rotated_candidates(path):
+    """Where logrotate moves `path`: delaycompress (.1) first, then .1.gz"""
+    return [Path(f"{path}.1"), Path(f"{path}.1.gz")]
+
+
+def _open_binary(path):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+class LogCheckpoint:
+    def __init__(self, state_file=DEFAULT_STATE_FILE):
+        self.state_file = Path(state_file)
+        self.state = {}
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, "r") as f:
+                    self.state = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                print(
+                    f"Warning: {self.state_file} is unreadable. Starting fresh.",
+                    file=sys.stderr,
+                )
+        self._pending = {}
+        # Free-form data callers want persisted next to the offsets
+        self.extra = self.state.pop("_extra", {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None or exc_type is KeyboardInterrupt:
+            self.commit()
+        return False
+
+    # ----------------- Reading -----------------
+
+    def read(self, path):
+        """Yield complete new lines (bytes, including the newline) of `path`."""
+        for chunk in self.read_chunks(path):
+            yield from chunk.splitlines(keepends=True)
+
+    def read_chunks(self, path):
+        """Yield newline-terminated chunks of new data (see log_reader.scan)."""
+        path = Path(path)
+        key = str(path)
+        saved = self.state.get(key)
+
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            print(f"Warning: {path} not found.", file=sys.stderr)
+            return
+
+        start = 0
+        if saved:
+            if saved["inode"] == st.st_ino and saved["dev"] == st.st_dev:
+                if saved["offset"] <= st.st_size and self._verify(path, saved):
+                    start = saved["offset"]
+                else:
+                    print(
+                        f"Note: {path} was truncated or rewritten, starting over.",
+                        file=sys.stderr,
+                    )
+            else:
+                rotated = self._find_rotated(path, saved)
+                if rotated:
+                    print(
+                        f"Note: {path} was rotated, finishing {rotated.name} first.",
+                        file=sys.stderr,
+                    )
+                    yield from self._read_from(rotated, saved["offset"], None)
+                else:
+                    print(
+                        f"Note: {path} was rotated and the old file is gone.",
+                        file=sys.stderr,
+                    )
+
+        yield from self._read_from(path, start, (key, st))
+
+    def _read_from(self, path, offset, record):
+        """Yield complete-line chunks from `offset`; track progress if `record`."""
+        with _open_binary(path) as f:
+            _skip(f, offset)
+            pending = b""
+            last_line = b""
+            while True:
+                chunk = f.read(READ_SIZE)
+                if not chunk:
+                    break
+                chunk = pending + chunk
+                end = chunk.rfind(b"\n")
+                if end == -1:
+                    pending = chunk
+                    continue
+                pending = chunk[end + 1 :]
+                complete = chunk[: end + 1]
+                yield complete
+                offset += len(complete)
+                last_line = complete[complete.rfind(b"\n", 0, -1) + 1 :]
+                if record:
+                    self._mark(record, offset, last_line)
+            if record and not last_line:
+                # Nothing new; keep (or create) the record for this inode
+                self._mark(record, offset, None)
+
+    def _mark(self, record, offset, last_line):
+        key, st = record
+        prev = self._pending.get(key) or self.state.get(key) or {}
+        same_file = prev.get("inode") == st.st_ino and prev.get("dev") == st.st_dev
+        if last_line is None:
+            if same_file and prev.get("offset") == offset:
+                self._pending[key] = prev
+                return
+            # Starting over on a new/rewritten file with no complete line yet
+            last_hash, last_len = "", 0
+        else:
+            last_hash, last_len = line_hash(last_line), len(last_line)
+        self._pending[key] = {
+            "inode": st.st_ino,
+            "dev": st.st_dev,
+            "offset": offset,
+            "line_hash": last_hash,
+            "line_len": last_len,
+        }
+
+    # ----------------- Verification -----------------
+
+    def _verify(self, path, saved):
+        """Check the line ending at the saved offset still hashes the same."""
+        length = saved.get("line_len", 0)
+        if not length:
+            return saved["offset"] == 0
+        with _open_binary(path) as f:
+            _skip(f, saved["offset"] - length)
+            return line_hash(f.read(length)) == saved["line_hash"]
+
+    def _find_rotated(self, path, saved):
+        for candidate in _rotated_candidates(path):
+            try:
+                st = os.stat(candidate)
+            except FileNotFoundError:
+                continue
+            if candidate.suffix == ".gz":
+                # Compression creates a new inode; trust the line hash instead
+                if self._verify(candidate, saved):
+                    return candidate
+            elif st.st_ino == saved["inode"] and st.st_dev == saved["dev"]:
+                return candidate
+        return None
+
+    # ----------------- Persistence -----------------
+
+    def commit(self):
+        self.state.update(self._pending)
+        self._pending = {}
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(dict(self.state, _extra=self.extra), f, indent=2)
+            f.write("\n")
+        os.replace(tmp, self.state_file)
+
+
+def _skip(f, count):
+    """Advance `f` by `count` bytes; seek when possible, read through gzip."""
+    if count <= 0:
+        return
+    if isinstance(f, gzip.GzipFile):
+        while count > 0:
+            data = f.read(min(count, READ_SIZE))
+            if not data:
+                break
+            count -= len(data)
+    else:
+        f.seek(count)
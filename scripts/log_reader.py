@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Fast reader for nginx combined-format logs.
+
+Logs are read in large newline-aligned chunks and each chunk is scanned with
+one compiled bytes regex; only the fields the tooling needs are copied out
+as small bytes objects (no per-line str decoding, no per-line dicts). Plain
+files, gzip-rotated logs and pipes all go through the same scanner, so
+memory stays bounded by the chunk size.
+
+Plain files can instead be mmap'd and scanned in place (use_mmap=True).
+That saves the chunk copies, but mapped pages count towards RSS while a
+window is being scanned, so its peak RSS is higher than streaming; it is
+opt-in for that reason.
+
+Each record is a plain tuple of bytes:
+    (remote_addr, time_local, path, status, user_agent)
+`path` is None for malformed request lines (TLS garbage, "-", ...).
+
+Usage:
+    for addr, ts, path, status, ua in iter_fields("/var/log/nginx/access.log"):
+        ...
+
+    python3 log_reader.py bench /var/log/nginx/access.log
+    python3 log_reader.py bench --lines 2000000   # synthetic log
+"""
+
+import argparse
+import gzip
+import json
+import mmap
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+# $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent
+# "$http_referer" "$http_user_agent"
+# nginx escapes '"' inside variables as \x22, so [^"\n] is safe here.
+FIELDS = re.compile(
+    rb'^(\S+) \S+ \S+ \[([^\]\n]*)\] "(?:\S+ (\S+)[^"\n]*|[^"\n]*)" (\d{3}) \S+'
+    rb'(?: "[^"\n]*" "([^"\n]*)")?[^\n]*$',
+    re.MULTILINE,
+)
+
+# Peak RSS grows with the chunk (read buffer plus the line-aligned copy);
+# past ~256 KiB bigger chunks stop paying for themselves in throughput
+CHUNK_SIZE = 256 << 10
+
+# mmap'd pages count towards RSS until dropped; scan in windows and release
+# each one behind us so a multi-GB log doesn't look like a multi-GB process.
+WINDOW_SIZE = 16 << 20
+
+# The naive baseline the benchmark compares against
+NAIVE = re.compile(
+    r'^(\S+) \S+ \S+ \[([^\]]*)\] "([^"]*)" (\d{3}) (\S+) "([^"]*)" "([^"]*)"'
+)
+
+BENCH_MODES = ("naive", "stream", "mmap")
+BenchResult = namedtuple("BenchResult", ["mode", "lines", "seconds", "peak_rss_kb"])
+
+
+def scan(buf, start=0, end=None):
+    """Yield field tuples for every complete line in buf[start:end]."""
+    if end is None:
+        end = len(buf)
+    for m in FIELDS.finditer(buf, start, end):
+        yield m.groups()
+
+
+def iter_chunks(f, chunk_size=CHUNK_SIZE, limit=None):
+    """
+    Yield newline-terminated chunks from a binary stream, reading at most
+    `limit` bytes if given.
+    """
+    pending = b""
+    while limit is None or limit > 0:
+        data = f.read(chunk_size if limit is None else min(chunk_size, limit))
+        if not data:
+            break
+        if limit is not None:
+            limit -= len(data)
+        cut = data.rfind(b"\n")
+        if cut == -1:
+            pending += data
+            continue
+        yield pending + data[: cut + 1]
+        pending = data[cut + 1 :]
+    if pending:
+        # A final line without a trailing newline (e.g. truncated .gz)
+        yield pending + b"\n"
+
+
+def scan_chunks(chunks):
+    for chunk in chunks:
+        yield from scan(chunk)
+
+
+def iter_fields(path, start=0, end=None, use_mmap=False):
+    """
+    Yield field tuples from a log file.
+
+    start/end are byte offsets (plain files only) and must fall on line
+    boundaries. use_mmap scans plain files in place instead of streaming.
+    """
+    path = str(path)
+    if path == "-":
+        yield from scan_chunks(iter_chunks(sys.stdin.buffer))
+        return
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from scan_chunks(iter_chunks(f))
+        return
+
+    with open(path, "rb") as f:
+        if not use_mmap:
+            f.seek(start)
+            limit = None if end is None else end - start
+            yield from scan_chunks(iter_chunks(f, limit=limit))
+            return
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from _scan_windows(mm, start, size if end is None else end)
+
+
+def _scan_windows(mm, start, end):
+    can_advise = hasattr(mm, "madvise")
+    if can_advise:
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    pos = start
+    while pos < end:
+        stop = min(pos + WINDOW_SIZE, end)
+        if stop < end:
+            newline = mm.find(b"\n", stop, end)
+            stop = end if newline == -1 else newline + 1
+        yield from scan(mm, pos, stop)
+        if can_advise:
+            page_start = pos - pos % mmap.PAGESIZE
+            mm.madvise(mmap.MADV_DONTNEED, page_start, stop - page_start)
+        pos = stop
+
+
+# ----------------- Benchmark -----------------
+
+
+def _run_naive(path):
+    lines = 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            m = NAIVE.match(line)
+            if not m:
+                continue
+            ip, ts, request, status, _, _, ua = m.groups()
+            parts = request.split(" ")
+            record = {
+                "ip": ip,
+                "time": ts,
+                "status": int(status),
+                "path": parts[1] if len(parts) > 1 else None,
+                "ua": ua,
+            }
+            if record:
+                lines += 1
+    return lines
+
+
+def _run_reader(path, use_mmap):
+    lines = 0
+    for _ in iter_fields(path, use_mmap=use_mmap):
+        lines += 1
+    return lines
+
+
+def _bench_child(mode, path):
+    started = time.perf_counter()
+    if mode == "naive":
+        lines = _run_naive(path)
+    else:
+        lines = _run_reader(path, use_mmap=mode == "mmap")
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(BenchResult(mode, lines, elapsed, peak)._asdict()))
+
+
+def write_synthetic_log(path, lines):
+    """Write `lines` plausible combined-format lines to `path`."""
+    agents = [
+        "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0",
+        "Mozilla/5.0 (compatible; GPTBot/1.0; +https://openai.com/gptbot)",
+        "git/2.43.0",
+    ]
+    paths = [
+        "/",
+        "/v2/projects/cli.git",
+        "/gamesguru/ffpass/commit/0b1c2d3e4f5a6b7c8d9e0f1a2b3c4d5e6f7a8b9c",
+        "/_next/static/chunks/main.js",
+        "/.env",
+    ]
+    with open(path, "w") as f:
+        for i in range(lines):
+            ip = f"203.0.{(i >> 8) & 255}.{i & 255}"
+            f.write(
+                f"{ip} - - [16/Oct/2026:10:{(i // 60) % 60:02d}:{i % 60:02d} +0000] "
+                f'"GET {paths[i % len(paths)]} HTTP/1.1" {200 + (i % 3) * 100} '
+                f'{i % 9000} "-" "{agents[i % len(agents)]}"\n'
+            )
+
+
+def cmd_bench(args):
+    path = args.log
+    tmp = None
+    if not path:
+        tmp = tempfile.NamedTemporaryFile(suffix=".log", delete=False)
+        tmp.close()
+        path = tmp.name
+        print(f"Generating {args.lines:,} synthetic lines in {path}...")
+        write_synthetic_log(path, args.lines)
+
+    size_mb = os.path.getsize(path) / (1 << 20)
+    print(f"Benchmarking {path} ({size_mb:.1f} MB)\n")
+    print(f"{'mode':<8} {'lines':>12} {'seconds':>9} {'lines/s':>12} {'peak RSS':>10}")
+    try:
+        for mode in BENCH_MODES:
+            out = subprocess.check_output(
+                [sys.executable, __file__, "_bench_child", mode, path],
+                universal_newlines=True,
+            )
+            r = BenchResult(**json.loads(out))
+            rate = r.lines / r.seconds if r.seconds else 0
+            print(
+                f"{r.mode:<8} {r.lines:>12,} {r.seconds:>9.2f} {rate:>12,.0f} "
+                f"{r.peak_rss_kb / 1024:>8.1f}MB"
+            )
+    finally:
+        if tmp:
+            os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast nginx log reader")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_bench = subparsers.add_parser(
+        "bench", help="Compare against a naive `for line in open()` loop"
+    )
+    p_bench.add_argument("log", nargs="?", help="Log file (default: synthetic)")
+    p_bench.add_argument(
+        "--lines", type=int, default=1_000_000, help="Synthetic log size"
+    )
+
+    p_child = subparsers.add_parser("_bench_child")
+    p_child.add_argument("mode", choices=BENCH_MODES)
+    p_child.add_argument("log")
+
+    args = parser.parse_args()
+    if args.command == "_bench_child":
+        _bench_child(args.mode, args.log)
+    else:
+        cmd_bench(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Per-IP / per-path / per-status aggregates over nginx logs, optionally
+spread across cores.
+
+With --jobs N, every plain log is split into newline-aligned byte ranges and
+the ranges are handed to a ProcessPoolExecutor; each worker scans its range
+with log_reader and returns partial Counters that are merged here. Gzip
+logs can't be split, so each one is a single task. The merged result is
+identical to the single-process run.
+
+Usage:
+    python3 log_stats.py /var/log/nginx/access.log /var/log/nginx/bad_bots.log
+    python3 log_stats.py --jobs 4 --json /var/log/nginx/access.log
+    python3 log_stats.py --bench /var/log/nginx/access.log
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from log_reader import iter_fields
+
+# Ranges smaller than this aren't worth a process hand-off
+MIN_RANGE_SIZE = 8 << 20
+
+
+class Aggregate:
+    def __init__(self):
+        self.lines = 0
+        self.ips = Counter()
+        self.paths = Counter()
+        self.statuses = Counter()
+
+    def add_fields(self, records):
+        ips, paths, statuses = self.ips, self.paths, self.statuses
+        lines = 0
+        for ip, _, path, status, _ in records:
+            lines += 1
+            ips[ip] += 1
+            statuses[status] += 1
+            if path is not None:
+                paths[path] += 1
+        self.lines += lines
+        return self
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.ips.update(other.ips)
+        self.paths.update(other.paths)
+        self.statuses.update(other.statuses)
+        return self
+
+    def to_dict(self, top=None):
+        def ranked(counter):
+            # Ties broken by key so the output is deterministic
+            items = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
+            if top:
+                items = items[:top]
+            return [[k.decode("utf-8", "replace"), v] for k, v in items]
+
+        return {
+            "lines": self.lines,
+            "unique_ips": len(self.ips),
+            "unique_paths": len(self.paths),
+            "statuses": {k.decode(): v for k, v in sorted(self.statuses.items())},
+            "top_ips": ranked(self.ips),
+            "top_paths": ranked(self.paths),
+        }
+
+
+def split_ranges(path, parts):
+    """Split a plain file into <= `parts` byte ranges ending on newlines."""
+    size = os.path.getsize(path)
+    if parts <= 1 or size < 2 * MIN_RANGE_SIZE:
+        return [(0, size)]
+    parts = min(parts, size // MIN_RANGE_SIZE)
+    step = size // parts
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, parts):
+            f.seek(i * step)
+            f.readline()
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def make_tasks(paths, jobs):
+    tasks = []
+    for path in paths:
+        if str(path).endswith(".gz"):
+            tasks.append((path, 0, None))
+        else:
+            # A few ranges per worker evens out uneven line densities
+            tasks.extend((path, s, e) for s, e in split_ranges(path, jobs * 4))
+    return tasks
+
+
+def _crunch(task):
+    path, start, end = task
+    return Aggregate().add_fields(iter_fields(path, start, end))
+
+
+def crunch(paths, jobs=1):
+    """Aggregate all `paths`, using `jobs` processes when > 1."""
+    total = Aggregate()
+    if jobs <= 1:
+        for path in paths:
+            total.add_fields(iter_fields(path))
+        return total
+
+    tasks = make_tasks(paths, jobs)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for part in pool.map(_crunch, tasks):
+            total.merge(part)
+    return total
+
+
+def print_report(result, top):
+    data = result.to_dict(top)
+    print(
+        f"{data['lines']:,} lines, {data['unique_ips']:,} IPs, "
+        f"{data['unique_paths']:,} paths"
+    )
+    print("\nStatus codes:")
+    for status, count in data["statuses"].items():
+        print(f"  {status}  {count:>10,}")
+    print(f"\nTop {top} IPs:")
+    for ip, count in data["top_ips"]:
+        print(f"  {count:>10,}  {ip}")
+    print(f"\nTop {top} paths:")
+    for path, count in data["top_paths"]:
+        print(f"  {count:>10,}  {path}")
+
+
+def cmd_bench(paths, max_jobs):
+    size_mb = sum(os.path.getsize(p) for p in paths) / (1 << 20)
+    print(f"Benchmarking {len(paths)} file(s), {size_mb:.1f} MB\n")
+    print(f"{'jobs':>4} {'seconds':>9} {'lines/s':>12} {'speedup':>8}  identical")
+
+    baseline = None
+    base_time = None
+    jobs = 1
+    while True:
+        started = time.perf_counter()
+        result = crunch(paths, jobs)
+        elapsed = time.perf_counter() - started
+        data = result.to_dict()
+        if baseline is None:
+            baseline, base_time = data, elapsed
+        rate = result.lines / elapsed if elapsed else 0
+        print(
+            f"{jobs:>4} {elapsed:>9.2f} {rate:>12,.0f} {base_time / elapsed:>7.2f}x"
+            f"  {'yes' if data == baseline else 'NO'}"
+        )
+        if jobs >= max_jobs:
+            break
+        jobs = min(jobs * 2, max_jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate nginx log statistics")
+    parser.add_argument("logs", nargs="+", help="Log files (.gz ok)")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help=f"Worker processes (this machine has {os.cpu_count()} cores)",
+    )
+    parser.add_argument("--top", type=int, default=20, help="Rows per table")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    parser.add_argument(
+        "--bench",
+        action="store_true",
+        help="Time 1, 2, 4 ... --jobs processes (default: all cores)",
+    )
+    args = parser.parse_args()
+
+    missing = [p for p in args.logs if not os.path.exists(p)]
+    if missing:
+        print(f"Error: not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    if args.bench:
+        max_jobs = args.jobs if args.jobs > 1 else os.cpu_count() or 1
+        cmd_bench(args.logs, max_jobs)
+        return
+
+    result = crunch(args.logs, args.jobs)
+    if args.json:
+        print(json.dumps(result.to_dict(args.top), indent=2))
+    else:
+        print_report(result, args.top)
+
+
+if __name__ == "__main__":
+    main()
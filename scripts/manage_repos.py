@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 import argparse
+import csv
+import hashlib
 import json
 import os
 import shlex
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from remote_session import Batch, BatchError, open_session, parse_targets
+from repo_store import DEFAULT_DB as REPO_DB
+from repo_store import RepoStore
 
 try:
     import argcomplete
@@ -17,44 +25,37 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 REPO_JSON = os.path.join(SCRIPT_DIR, "repos.json")
 REPO_CSV = os.path.join(SCRIPT_DIR, "repo_metadata.csv")
 GIT_ROOT = "/srv/git"
+# Per-target fingerprints from the last sync, one file per target so
+# parallel syncs (--remote a,b sync) never rewrite each other's cursor
+SYNC_CURSOR_DIR = os.path.expanduser("~/.nginx-ops/sync_cursors")
 
 
-def load_repos():
-    if os.path.exists(REPO_JSON):
-        with open(REPO_JSON, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                print(f"Warning: {REPO_JSON} is invalid JSON. Returning empty.")
-                return {}
-    return {}
+def open_store():
+    """
+    The metadata store (see repo_store.py); repos.json is imported into it
+    when it changed since the last run and exported back after writes.
+    """
+    return RepoStore(REPO_DB, json_path=REPO_JSON)
 
 
-def save_repos(data):
-    with open(REPO_JSON, "w") as f:
-        json.dump(data, f, indent=2)
-        f.write("\n")
+# `remote` below is a remote_session session (one multiplexed ssh connection
+# per run), or None to work on the local filesystem.
 
 
-def remote_exists(remote, path):
-    if remote:
-        cmd = ["ssh", remote, f"test -e {shlex.quote(path)}"]
-        return subprocess.call(cmd) == 0
-    else:
-        return os.path.exists(path)
+def git_root(remote):
+    return remote.git_root if remote else GIT_ROOT
 
 
-def remote_isdir(remote, path):
+def remote_exists(remote, path):
     if remote:
-        cmd = ["ssh", remote, f"test -d {shlex.quote(path)}"]
-        return subprocess.call(cmd) == 0
+        return remote.call(f"test -e {shlex.quote(path)}") == 0
     else:
-        return os.path.isdir(path)
+        return os.path.exists(path)
 
 
 def remote_makedirs(remote, path):
     if remote:
-        subprocess.check_call(["ssh", remote, f"mkdir -p {shlex.quote(path)}"])
+        remote.check_call(f"mkdir -p {shlex.quote(path)}")
     else:
         os.makedirs(path, exist_ok=True)
 
@@ -62,25 +63,11 @@ def remote_makedirs(remote, path):
 def remote_run(remote, cmd_list, check=True):
     if remote:
         cmd_str = " ".join(shlex.quote(c) for c in cmd_list)
-        subprocess.check_call(["ssh", remote, cmd_str])
+        remote.run(cmd_str, check=check)
     else:
         subprocess.run(cmd_list, check=check)
 
 
-def remote_write(remote, path, content):
-    if remote:
-        # Use simple cat redirection
-        p = subprocess.Popen(
-            ["ssh", remote, f"cat > {shlex.quote(path)}"], stdin=subprocess.PIPE
-        )
-        p.communicate(input=content.encode("utf-8"))
-        if p.returncode != 0:
-            raise subprocess.CalledProcessError(p.returncode, "remote write")
-    else:
-        with open(path, "w") as f:
-            f.write(content)
-
-
 def normalize_repo_path(name):
     """Ensures path ends in .git and usually has a projects/ prefix if simplistic."""
     # Logic: If it has slashes, trust the user. If not, prepend projects/.
@@ -102,7 +89,6 @@ def get_current_dir_name():
 
 def cmd_add_clone(args, remote):
     url = args.url
-    data = load_repos()
 
     # Determine repo name
     if args.name:
@@ -113,70 +99,43 @@ def cmd_add_clone(args, remote):
             repo_name = repo_name[:-4]
 
     repo_rel_path = normalize_repo_path(repo_name)
-    full_path = os.path.join(GIT_ROOT, repo_rel_path)
+    full_path = os.path.join(git_root(remote), repo_rel_path)
 
     print(f"Adding Clone: {url}")
     print(f"Target: {full_path} (Remote: {remote if remote else 'Local'})")
 
-    # Create parent dir
-    parent_dir = os.path.dirname(full_path)
-    if not remote_exists(remote, parent_dir):
-        remote_makedirs(remote, parent_dir)
-
-    # Clone
-    if not remote_exists(remote, full_path):
-        print(f"Cloning into {full_path}...")
-        remote_run(remote, ["git", "clone", "--mirror", url, full_path])
-    else:
-        print("Repository already exists. Updating metadata...")
+    # One round trip: parent dir, clone (skipped if it exists), metadata
+    batch = Batch(remote)
+    queue_clone(batch, url, full_path)
 
     # Configure
     configure_repo(
-        remote,
+        batch,
         repo_rel_path,
         full_path,
         args.desc,
         args.owner,
         origin_url=url,
-        data=data,
     )
 
 
 def cmd_init(args, remote):
-    data = load_repos()
-
     name = args.name
     if not name:
         # Try to infer from current directory
         name = get_current_dir_name()
 
     repo_rel_path = normalize_repo_path(name)
-    full_path = os.path.join(GIT_ROOT, repo_rel_path)
+    full_path = os.path.join(git_root(remote), repo_rel_path)
 
     print(f"Initializing empty repo: {repo_rel_path}")
     print(f"Target: {full_path} (Remote: {remote if remote else 'Local'})")
 
-    # Mkdir
-    remote_makedirs(remote, full_path)
-
-    # Git Init
-    remote_run(remote, ["git", "-C", full_path, "init", "--bare"])
+    batch = Batch(remote)
+    queue_init(batch, full_path)
 
-    # Daemon ok
-    # We can use remote_run with touch, or remote_write.
-    # touch is simpler.
-    remote_run(remote, ["touch", os.path.join(full_path, "git-daemon-export-ok")])
-
-    # Safe Directory
-    # We need to run this globally or on the system level, but running it locally for the user often works
-    # if the user accessing it is the one running this.
-    # However, 'git config --global' on remote affects the remote user (git).
-    remote_run(
-        remote, ["git", "config", "--global", "--add", "safe.directory", full_path]
-    )
-
-    # Configure
-    configure_repo(remote, repo_rel_path, full_path, args.desc, args.owner, data=data)
+    # Configure (runs the whole batch)
+    configure_repo(batch, repo_rel_path, full_path, args.desc, args.owner)
 
     # Auto Remote (Local side)
     if args.auto_remote:
@@ -201,13 +160,11 @@ def cmd_init(args, remote):
 
 
 def cmd_rename(args, remote):
-    data = load_repos()
-
     old_rel = normalize_repo_path(args.old)
     new_rel = normalize_repo_path(args.new)
 
-    old_full = os.path.join(GIT_ROOT, old_rel)
-    new_full = os.path.join(GIT_ROOT, new_rel)
+    old_full = os.path.join(git_root(remote), old_rel)
+    new_full = os.path.join(git_root(remote), new_rel)
 
     print(f"Renaming {old_rel} -> {new_rel}")
 
@@ -225,10 +182,10 @@ def cmd_rename(args, remote):
     # Move
     remote_run(remote, ["mv", old_full, new_full])
 
-    # Update Json
-    if old_rel in data:
-        data[new_rel] = data.pop(old_rel)
-        save_repos(data)
+    # Update metadata
+    store = open_store()
+    if store.rename(old_rel, new_rel):
+        store.export()
         print("Updated local repos.json")
     else:
         print(f"Warning: {old_rel} was not found in repos.json. No metadata moved.")
@@ -242,99 +199,177 @@ def cmd_rename(args, remote):
 
 
 def cmd_update(args, remote):
-    data = load_repos()
-
     target = args.name
     if target:
         # Update/configure single
         repo_rel_path = normalize_repo_path(target)
-        full_path = os.path.join(GIT_ROOT, repo_rel_path)
+        full_path = os.path.join(git_root(remote), repo_rel_path)
 
-        if not remote_exists(remote, full_path):
-            print(f"Warning: {repo_rel_path} does not exist on remote. Skipping.")
-            return
+        batch = Batch(remote)
+        batch.require(f"{repo_rel_path} exists", full_path)
 
         configure_repo(
-            remote,
+            batch,
             repo_rel_path,
             full_path,
             args.desc,
             args.owner,
             origin_url=args.origin,
-            data=data,
         )
     else:
         print("Error: Name required.")
 
 
 def repo_completer(prefix, parsed_args, **kwargs):
-    # Load repos for completion
-    data = load_repos()
-    return [k for k in data.keys() if k.startswith(prefix)]
+    # Prefix range scan on the store's primary key. repos.json is not read
+    # per Tab; it is only imported when the store has never been filled.
+    store = RepoStore(REPO_DB)
+    if not len(store):
+        store.close()
+        store = open_store()
+    return store.paths(prefix)
+
+
+# Runs on the target. Reads {"root", "seen"} on stdin, where `seen` maps
+# repo -> fingerprint from the last sync, and prints only what changed:
+#   {"changed": {repo: {..., "fp": fingerprint}}, "touched": {repo: fp},
+#    "gone": [repo, ...], "scanned": n}
+# The walk stops at *.git directories (never descends into objects/refs) and
+# config is parsed directly rather than forking `git config` per repo.
+SYNC_SCRIPT = r"""
+import hashlib, json, os, sys
+
+req = json.load(sys.stdin)
+root = req["root"]
+seen = req["seen"]
+META_FILES = ("config", "description")
+
+
+def stat_key(repo):
+    key = []
+    for name in META_FILES:
+        try:
+            st = os.stat(os.path.join(repo, name))
+            key.append([st.st_mtime_ns, st.st_size])
+        except OSError:
+            key.append(None)
+    return key
 
 
-def cmd_sync(args, remote):
-    if not remote:
-        print("Error: --remote is required for sync (or set VPS_REMOTE env var)")
-        sys.exit(1)
+def read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return b""
+
+
+def parse_config(text):
+    values = {}
+    section = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("["):
+            head = line[1:line.index("]")] if "]" in line else line[1:]
+            name, _, sub = head.partition(" ")
+            section = name.lower()
+            if sub:
+                section += "." + sub.strip().strip('"')
+            continue
+        key, _, value = line.partition("=")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+        values.setdefault(section + "." + key.strip().lower(), value)
+    return values
+
+
+changed, touched, found = {}, {}, set()
+for dirpath, dirnames, _ in os.walk(root):
+    repos = [d for d in dirnames if d.endswith(".git")]
+    dirnames[:] = [d for d in dirnames if not d.endswith(".git")]
+    for d in repos:
+        full_path = os.path.join(dirpath, d)
+        rel_path = os.path.relpath(full_path, root)
+        found.add(rel_path)
+        key = stat_key(full_path)
+        prev = seen.get(rel_path)
+        if prev and prev["stat"] == key:
+            continue
+
+        config = read(os.path.join(full_path, "config"))
+        desc_raw = read(os.path.join(full_path, "description"))
+        digest = hashlib.sha1(config + b"\0" + desc_raw).hexdigest()
+        fp = {"stat": key, "hash": digest}
+        if prev and prev["hash"] == digest:
+            touched[rel_path] = fp
+            continue
+
+        desc = desc_raw.decode("utf-8", "replace").strip()
+        if "Unnamed repository" in desc:
+            desc = ""
+        values = parse_config(config.decode("utf-8", "replace"))
+        origin = values.get("remote.origin.url", "")
+        changed[rel_path] = {
+            "description": desc,
+            "owner": values.get("gitweb.owner", ""),
+            "remotes": {"origin": origin} if origin else {},
+            "fp": fp,
+        }
+
+gone = sorted(set(seen) - found)
+print(json.dumps({
+    "changed": changed, "touched": touched, "gone": gone, "scanned": len(found)
+}))
+"""
 
-    print(f"Scanning {remote}:{GIT_ROOT}...")
 
-    # Remote python script to gather all metadata in one go
-    remote_script = f"""
-import os, json, subprocess
+def sync_cursor_path(key):
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SYNC_CURSOR_DIR, f"{name}.json")
 
-root = "{GIT_ROOT}"
-results = {{}}
 
-for dirpath, dirnames, filenames in os.walk(root):
-    for d in dirnames:
-        if d.endswith('.git'):
-            full_path = os.path.join(dirpath, d)
-            rel_path = os.path.relpath(full_path, root)
+def load_sync_cursor(key):
+    try:
+        with open(sync_cursor_path(key), "r") as f:
+            cursor = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return cursor.get("seen", {}) if cursor.get("key") == key else {}
 
-            # Get description
-            desc = ""
-            desc_file = os.path.join(full_path, 'description')
-            if os.path.exists(desc_file):
-                try:
-                    with open(desc_file, 'r') as f:
-                        desc = f.read().strip()
-                        if "Unnamed repository" in desc: desc = ""
-                except: pass
-
-            # Get owner/origin via git config
-            owner = ""
-            origin = ""
-            try:
-                # We use git config to read keys.
-                # Note: 'git config' might fail if safe.directory issues, but usually fine for reading files directly if we parse?
-                # Safer to use git command.
-                # Only run if directory seems valid.
-                cmd = ['git', 'config', '--file', os.path.join(full_path, 'config'), '--list']
-                out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL, universal_newlines=True)
-                for line in out.splitlines():
-                    if line.startswith('gitweb.owner='):
-                        owner = line.split('=', 1)[1]
-                    if line.startswith('remote.origin.url='):
-                        origin = line.split('=', 1)[1]
-            except:
-                pass
-
-            results[rel_path] = {{
-                'description': desc,
-                'owner': owner,
-                'remotes': {{'origin': origin}} if origin else {{}}
-            }}
-
-print(json.dumps(results))
-"""
 
-    # Run the script remotely via SSH
-    cmd = ["ssh", remote, "python3", "-c", shlex.quote(remote_script)]
+def save_sync_cursor(key, seen):
+    path = sync_cursor_path(key)
+    os.makedirs(SYNC_CURSOR_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"key": key, "seen": seen}, f)
+    os.replace(tmp, path)
+
 
+def cmd_sync(args, remote):
+    if not remote:
+        print("Error: --remote is required for sync (or set VPS_REMOTE env var)")
+        sys.exit(1)
+
+    root = git_root(remote)
+    cursor_key = f"{remote}:{root}"
+    store = open_store()
+    seen = {} if args.full else load_sync_cursor(cursor_key)
+    # Anything missing from repos.json is re-fetched even if unchanged remotely
+    seen = {rel: fp for rel, fp in seen.items() if rel in store}
+    mode = "incremental" if seen else "full"
+    print(f"Scanning {remote}:{root} ({mode})...")
+
+    # One round trip; the cursor goes over stdin so only changes come back
+    request = json.dumps({"root": root, "seen": seen}).encode("utf-8")
+    output = ""
     try:
-        output = subprocess.check_output(cmd, universal_newlines=True)
+        output = remote.check_output(
+            f"python3 -c {shlex.quote(SYNC_SCRIPT)}", input=request
+        )
         remote_data = json.loads(output)
     except subprocess.CalledProcessError as e:
         print(f"Error executing remote fetch: {e}")
@@ -345,133 +380,344 @@ print(json.dumps(results))
         return
 
     # Update local data
-    data = load_repos()
     updated_count = 0
     new_count = 0
 
-    for rel_path, info in remote_data.items():
-        if rel_path not in data:
-            data[rel_path] = {}
-            new_count += 1
-            print(f"  [NEW] Found {rel_path}")
+    # One transaction for the whole import
+    with store.transaction():
+        for rel_path, info in remote_data["changed"].items():
+            seen[rel_path] = info.pop("fp")
+            entry = store.get(rel_path)
+            if entry is None:
+                entry = {}
+                new_count += 1
+                print(f"  [NEW] Found {rel_path}")
+            else:
+                updated_count += 1
+                print(f"  [CHANGED] {rel_path}")
+
+            entry["description"] = info["description"]
+            entry["owner"] = info["owner"]
+            if info.get("remotes"):
+                entry.setdefault("remotes", {}).update(info["remotes"])
+            store.put(rel_path, entry)
+
+    seen.update(remote_data["touched"])
+    for rel_path in remote_data["gone"]:
+        seen.pop(rel_path, None)
+        print(f"  [GONE] {rel_path} (left in repos.json)")
+
+    if new_count or updated_count:
+        store.export()
+    save_sync_cursor(cursor_key, seen)
+    print(
+        f"\nSync complete. Scanned {remote_data['scanned']}, added {new_count}, "
+        f"updated {updated_count}. (Single SSH connection used)"
+    )
+
+
+def load_manifest(path):
+    """Read repos.json-style JSON or a repo_path,owner,description[,origin] CSV."""
+    if path.endswith(".csv"):
+        manifest = {}
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            reader.fieldnames = [name.strip() for name in reader.fieldnames]
+            for row in reader:
+                rel = (row.get("repo_path") or "").strip()
+                if not rel:
+                    continue
+                entry = {
+                    "owner": (row.get("owner") or "").strip(),
+                    "description": (row.get("description") or "").strip(),
+                }
+                origin = (row.get("origin") or row.get("url") or "").strip()
+                if origin:
+                    entry["remotes"] = {"origin": origin}
+                manifest[rel] = entry
+        return manifest
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def plan_apply(remote, manifest):
+    """
+    Decide clone/init/configure per repo, checking which exist in one trip.
+
+    Returns [(repo_rel_path, action, entry)].
+    """
+    root = git_root(remote)
+    probe = Batch(remote)
+    for rel in manifest:
+        probe.require(rel, os.path.join(root, normalize_repo_path(rel)), check=False)
+    existing = {r["name"] for r in probe.execute(verbose=False) if r["rc"] == 0}
+
+    plan = []
+    for rel, entry in manifest.items():
+        origin = (entry.get("remotes") or {}).get("origin")
+        if rel in existing:
+            action = "configure"
+        elif origin:
+            action = "clone"
         else:
-            updated_count += 1
+            action = "init"
+        plan.append((normalize_repo_path(rel), action, entry))
+    return plan
+
+
+def apply_one(remote, repo_rel_path, action, entry):
+    """Run one repo's steps as a single batch; returns the step results."""
+    full_path = os.path.join(git_root(remote), repo_rel_path)
+    origin = (entry.get("remotes") or {}).get("origin")
+    batch = Batch(remote)
+    if action == "clone":
+        queue_clone(batch, origin, full_path)
+    elif action == "init":
+        queue_init(batch, full_path)
+    queue_configure(
+        batch, full_path, entry.get("description"), entry.get("owner"), origin
+    )
+    return batch.execute(verbose=False)
+
+
+def cmd_apply(args, remote):
+    if not os.path.exists(args.manifest):
+        print(f"Error: manifest {args.manifest} not found.")
+        sys.exit(1)
+    manifest = load_manifest(args.manifest)
+    if not manifest:
+        print("Nothing to apply.")
+        return
+
+    print(f"Planning {len(manifest)} repos on {remote if remote else 'Local'}...")
+    plan = plan_apply(remote, manifest)
+    counts = {}
+    for _, action, _ in plan:
+        counts[action] = counts.get(action, 0) + 1
+    print(", ".join(f"{n} to {action}" for action, n in sorted(counts.items())))
+
+    if args.dry_run:
+        for rel, action, _ in plan:
+            print(f"  {action:<9} {rel}")
+        return
 
-        data[rel_path]["description"] = info["description"]
-        data[rel_path]["owner"] = info["owner"]
-        if info.get("remotes"):
-            if "remotes" not in data[rel_path]:
-                data[rel_path]["remotes"] = {}
-            data[rel_path]["remotes"].update(info["remotes"])
+    store = open_store()
+    failures = []
+    done = 0
+    # Clones dominate; --jobs bounds concurrent git processes on the VPS (and
+    # must stay under sshd's MaxSessions, 10 by default, per connection).
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {
+            pool.submit(apply_one, remote, rel, action, entry): (rel, action, entry)
+            for rel, action, entry in plan
+        }
+        for future in as_completed(futures):
+            rel, action, entry = futures[future]
+            done += 1
+            prefix = f"[{done:>{len(str(len(plan)))}}/{len(plan)}] {rel}"
+            try:
+                future.result()
+            except BatchError as e:
+                failed = [r for r in e.results if r["status"] == "failed"][0]
+                detail = failed["stderr"].strip().splitlines()
+                print(f"{prefix}: FAILED at {failed['name']}")
+                for line in detail[-3:]:
+                    print(f"      {line}")
+                failures.append(rel)
+                continue
+            except Exception as e:
+                print(f"{prefix}: FAILED ({e})")
+                failures.append(rel)
+                continue
+            print(f"{prefix}: {action} ok")
+            origin = (entry.get("remotes") or {}).get("origin")
+            store.upsert(rel, entry.get("description"), entry.get("owner"), origin)
 
-    save_repos(data)
+    # One export for the whole run, however many repos were applied
+    store.export()
     print(
-        f"\nSync complete. Added {new_count}, Scanned {updated_count}. (Single SSH connection used)"
+        f"\nApplied {len(plan) - len(failures)}/{len(plan)} repos"
+        + (
+            f", {len(failures)} failed: {', '.join(sorted(failures))}"
+            if failures
+            else ""
+        )
     )
+    if failures:
+        sys.exit(1)
 
 
 def cmd_list(args, remote):
-    data = migrate_csv_if_needed()
-    print(json.dumps(data, indent=2))
+    store = migrate_csv_if_needed()
+    print(json.dumps(store.all(args.owner, args.host), indent=2))
 
 
 # ----------------- Helpers -----------------
 
 
-def configure_repo(
-    remote, repo_rel_path, full_path, description, owner, origin_url=None, data=None
-):
-    if data is None:
-        data = {}
+def queue_init(batch, full_path):
+    # Mkdir
+    batch.makedirs("mkdir", full_path)
+
+    # Git Init
+    batch.run("git init --bare", ["git", "-C", full_path, "init", "--bare"])
+
+    # Daemon ok
+    batch.write(
+        "git-daemon-export-ok", os.path.join(full_path, "git-daemon-export-ok"), ""
+    )
+
+    # Safe Directory
+    # We need to run this globally or on the system level, but running it locally for the user often works
+    # if the user accessing it is the one running this.
+    # However, 'git config --global' on remote affects the remote user (git).
+    batch.run(
+        "safe.directory",
+        ["git", "config", "--global", "--add", "safe.directory", full_path],
+    )
 
+
+def queue_clone(batch, url, full_path):
+    batch.makedirs("create parent dir", os.path.dirname(full_path))
+    batch.run(
+        f"clone {url}",
+        ["git", "clone", "--mirror", url, full_path],
+        unless=full_path,
+    )
+
+
+def queue_configure(batch, full_path, description, owner, origin_url=None):
+    """Queue the metadata writes for one repo; returns what will be set."""
     msg_parts = []
+    config_path = os.path.join(full_path, "config")
 
     # Description
     if description:
         desc_path = os.path.join(full_path, "description")
-        remote_write(remote, desc_path, description + "\n")
+        batch.write("description", desc_path, description + "\n")
         msg_parts.append("description")
 
     # Owner
     if owner:
-        config_path = os.path.join(full_path, "config")
-        remote_run(
-            remote, ["git", "config", "--file", config_path, "gitweb.owner", owner]
+        batch.run(
+            "gitweb.owner",
+            ["git", "config", "--file", config_path, "gitweb.owner", owner],
         )
         msg_parts.append("owner")
 
-    # JSON Metadata
-    if repo_rel_path not in data:
-        data[repo_rel_path] = {}
+    if origin_url:
+        # Bare repos only have an origin when mirrored; setting it is best effort
+        batch.run(
+            "remote.origin.url",
+            ["git", "config", "--file", config_path, "remote.origin.url", origin_url],
+            check=False,
+        )
+        msg_parts.append("origin")
 
-    if description:
-        data[repo_rel_path]["description"] = description
-    if owner:
-        data[repo_rel_path]["owner"] = owner
+    return msg_parts
 
-    if origin_url:
-        if "remotes" not in data[repo_rel_path]:
-            data[repo_rel_path]["remotes"] = {}
-        data[repo_rel_path]["remotes"]["origin"] = origin_url
 
-        # Also update on remote if possible
-        try:
-            config_path = os.path.join(full_path, "config")
-            # check if remote exists
-            # It's hard to know if 'origin' exists in the config without checking,
-            # but we can just try setting it.
-            # If it doesn't exist, we might need to add it? Bare repos don't usually have remotes unless mirrored.
-            # Let's try setting.
-            remote_run(
-                remote,
-                [
-                    "git",
-                    "config",
-                    "--file",
-                    config_path,
-                    "remote.origin.url",
-                    origin_url,
-                ],
-                check=False,
-            )
-            # Also ensure fetch is set? (Optional, usually implied or not needed for just tracking URL)
-        except Exception:
-            pass
+def configure_repo(
+    batch, repo_rel_path, full_path, description, owner, origin_url=None
+):
+    """Queue the metadata steps, run `batch` in one round trip, save JSON."""
+    msg_parts = queue_configure(batch, full_path, description, owner, origin_url)
 
-    # Always save!
-    save_repos(data)
+    try:
+        batch.execute()
+    except BatchError as e:
+        print(f"Error: {e}. repos.json left unchanged.")
+        sys.exit(1)
+
+    store = open_store()
+    store.upsert(repo_rel_path, description, owner, origin_url)
+    store.export()
     print(f"Configuration updated ({', '.join(msg_parts)}) and saved to repos.json")
 
 
 def migrate_csv_if_needed():
-    """Migrate data from CSV to JSON if JSON is empty/missing and CSV exists."""
-    data = load_repos()
-    if data:
-        return data
-
-    if not os.path.exists(REPO_CSV):
-        return data
+    """Migrate data from CSV into the store if it is empty and CSV exists."""
+    store = open_store()
+    if len(store) or not os.path.exists(REPO_CSV):
+        return store
 
     print(f"Migrating existing metadata from {REPO_CSV} to {REPO_JSON}...")
     with open(REPO_CSV, "r") as f:
         reader = csv.DictReader(f)
         reader.fieldnames = [name.strip() for name in reader.fieldnames]
 
-        for row in reader:
-            path = row.get("repo_path", "").strip()
-            if not path:
-                continue
-
-            if path not in data:
-                data[path] = {
-                    "owner": row.get("owner", "").strip(),
-                    "description": row.get("description", "").strip(),
-                    "remotes": {},
-                }
+        with store.transaction():
+            for row in reader:
+                path = row.get("repo_path", "").strip()
+                if not path or path in store:
+                    continue
+
+                store.put(
+                    path,
+                    {
+                        "owner": row.get("owner", "").strip(),
+                        "description": row.get("description", "").strip(),
+                        "remotes": {},
+                    },
+                )
 
     # We skip the complex remote scanning for now to keep it fast
-    save_repos(data)
-    return data
+    store.export()
+    return store
+
+
+# ----------------- Fan-out -----------------
+
+
+def _argv_without_remote(argv):
+    out = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--remote":
+            skip = True
+        elif not arg.startswith("--remote="):
+            out.append(arg)
+    return out
+
+
+def fan_out(targets, argv):
+    """
+    Re-run this command once per target, all in parallel.
+
+    Each child gets its own multiplexed connection; output lines are
+    prefixed with the target. Returns the worst exit code.
+    """
+    lock = threading.Lock()
+    width = max(len(t) for t in targets)
+
+    def relay(target, proc):
+        for line in proc.stdout:
+            with lock:
+                print(f"[{target:<{width}}] {line}", end="", flush=True)
+
+    procs = []
+    for target in targets:
+        proc = subprocess.Popen(
+            [sys.executable, __file__, "--remote", target, *argv],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        thread = threading.Thread(target=relay, args=(target, proc))
+        thread.start()
+        procs.append((target, proc, thread))
+
+    worst = 0
+    for target, proc, thread in procs:
+        thread.join()
+        code = proc.wait()
+        if code:
+            print(f"[{target:<{width}}] exited with status {code}")
+        worst = max(worst, code)
+    return worst
 
 
 # ----------------- Main -----------------
@@ -483,7 +729,9 @@ def main():
     )
     parser.add_argument(
         "--remote",
-        help="SSH remote (e.g. gg@dev.nutra.tk) or blank for local (env: VPS_REMOTE)",
+        help="SSH remote (e.g. gg@dev.nutra.tk), env name (dev, prod, nightly), "
+        "sh:<dir> for a local stand-in, or blank for local. Comma-separate to "
+        "run on several targets in parallel (env: VPS_REMOTE)",
         default=os.environ.get("VPS_REMOTE"),
     )
 
@@ -526,8 +774,28 @@ def main():
     p_up.add_argument("--origin", help="Update upstream origin URL")
     p_up.set_defaults(func=cmd_update)
 
+    # APPLY
+    p_apply = subparsers.add_parser(
+        "apply", help="Create/clone/configure every repo in a manifest"
+    )
+    p_apply.add_argument(
+        "manifest",
+        nargs="?",
+        default=REPO_JSON,
+        help="repos.json-style JSON or repo_path,owner,description[,origin] CSV",
+    )
+    p_apply.add_argument(
+        "-j", "--jobs", type=int, default=4, help="Repos processed concurrently"
+    )
+    p_apply.add_argument(
+        "--dry-run", action="store_true", help="Only print the planned actions"
+    )
+    p_apply.set_defaults(func=cmd_apply)
+
     # LIST
     p_list = subparsers.add_parser("list", help="List tracked repositories")
+    p_list.add_argument("--owner", help="Only repos with this owner")
+    p_list.add_argument("--host", help="Only repos mirrored from this host")
     p_list.set_defaults(func=cmd_list)
 
     # MIGRATE
@@ -538,6 +806,9 @@ def main():
     p_sync = subparsers.add_parser(
         "sync", help="Sync/Import remote repositories to local JSON"
     )
+    p_sync.add_argument(
+        "--full", action="store_true", help="Ignore the stored cursor and rescan"
+    )
     p_sync.set_defaults(func=cmd_sync)
 
     if argcomplete:
@@ -546,12 +817,26 @@ def main():
     args = parser.parse_args()
 
     # Migration check before any command?
-    # Or just let them run. load_repos handles empty json nicely.
+    # Or just let them run. open_store handles a missing repos.json nicely.
 
-    if hasattr(args, "func"):
-        args.func(args, args.remote)
-    else:
+    if not hasattr(args, "func"):
         parser.print_help()
+        return
+
+    if not args.remote:
+        args.func(args, None)
+        return
+
+    try:
+        targets = parse_targets(args.remote)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if len(targets) > 1:
+        sys.exit(fan_out(targets, _argv_without_remote(sys.argv[1:])))
+
+    with open_session(targets[0]) as remote:
+        args.func(args, remote)
 
 
 if __name__ == "__main__":
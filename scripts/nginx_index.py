@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Parse nginx configs once into a small structured model, cached on disk.
+
+Each file is tokenized (words, quoted strings, `{`, `}`, `;`, comments) and
+folded into:
+
+    {
+        "servers": [{"line", "end", "server_name", "listen", "locations"}],
+        "services": [{"line", "name", "url"}],    # "# Service: Name | URL"
+        "versions": [{"line", "id", "description"}],  # "# Version X: ..."
+    }
+
+Annotations are only recognised on comment-only lines, like the regexes
+gen_services_map used before. Models are stored in a JSON index keyed by
+path together with the file's mtime and size, so a later run only re-reads
+the files that changed.
+
+Usage:
+    index = ConfigIndex()
+    model = index.get("etc/nginx/conf.d/dev/matrix.conf")
+    index.save()
+
+    python3 nginx_index.py etc/nginx/conf.d
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+DEFAULT_INDEX = os.environ.get(
+    "NGINX_INDEX_FILE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "nginx-ops",
+        "nginx_index.json",
+    ),
+)
+
+# Bump when the model shape changes so stale caches are ignored
+MODEL_VERSION = 1
+
+VERSION_RE = re.compile(r"^#\s*Version\s+(\w+):\s*(.+)$")
+SERVICE_RE = re.compile(r"^#\s*Service:\s*(.+?)\s*\|\s*(.+)$")
+
+
+# ----------------- Tokenizer -----------------
+
+
+def tokenize(text):
+    """
+    Yield (kind, value, line, own_line) tuples.
+
+    kind is one of "word", "{", "}", ";" or "comment". own_line is True for
+    comments with nothing but whitespace before them on their line.
+    """
+    i, n, line = 0, len(text), 1
+    line_has_token = False
+    while i < n:
+        c = text[i]
+        if c == "\n":
+            line += 1
+            line_has_token = False
+            i += 1
+        elif c in " \t\r":
+            i += 1
+        elif c == "#":
+            end = text.find("\n", i)
+            end = n if end < 0 else end
+            yield "comment", text[i:end].rstrip(), line, not line_has_token
+            i = end
+        elif c in "{};":
+            yield c, c, line, False
+            line_has_token = True
+            i += 1
+        elif c in "\"'":
+            start_line = line
+            j = i + 1
+            buf = []
+            while j < n and text[j] != c:
+                if text[j] == "\\" and j + 1 < n:
+                    j += 1
+                if text[j] == "\n":
+                    line += 1
+                buf.append(text[j])
+                j += 1
+            yield "word", "".join(buf), start_line, False
+            line_has_token = True
+            i = j + 1
+        else:
+            j = i
+            while j < n and text[j] not in " \t\r\n;{}\"'":
+                # ${var} is part of the word, not a block
+                if text[j] == "$" and j + 1 < n and text[j + 1] == "{":
+                    close = text.find("}", j)
+                    j = n if close < 0 else close
+                j += 1
+            yield "word", text[i:j], line, False
+            line_has_token = True
+            i = j
+
+
+# ----------------- Model -----------------
+
+
+def parse(text):
+    """Build the model for one config file's text."""
+    servers = []
+    services = []
+    versions = []
+    # Open blocks: (directive args, server dict or None)
+    stack = []
+    words = []
+    words_line = None
+
+    def enclosing_server():
+        for _, server in reversed(stack):
+            if server is not None:
+                return server
+        return None
+
+    for kind, value, line, own_line in tokenize(text):
+        if kind == "comment":
+            if not own_line:
+                continue
+            m = SERVICE_RE.match(value)
+            if m:
+                services.append({"line": line, "name": m[1], "url": m[2].strip()})
+                continue
+            m = VERSION_RE.match(value)
+            if m:
+                versions.append({"line": line, "id": m[1], "description": m[2].strip()})
+        elif kind == "word":
+            if not words:
+                words_line = line
+            words.append(value)
+        elif kind == ";":
+            server = enclosing_server()
+            if server is not None and words and words[0] in ("server_name", "listen"):
+                server[words[0]].append(" ".join(words[1:]))
+            words = []
+        elif kind == "{":
+            server = None
+            if words and words[0] == "server":
+                server = {
+                    "line": words_line,
+                    "end": None,
+                    "server_name": [],
+                    "listen": [],
+                    "locations": [],
+                }
+                servers.append(server)
+            elif words and words[0] == "location":
+                parent = enclosing_server()
+                if parent is not None:
+                    parent["locations"].append(" ".join(words[1:]))
+            stack.append((words, server))
+            words = []
+        elif kind == "}":
+            # Tolerate unbalanced files; nginx -t is the real validator
+            if stack:
+                _, server = stack.pop()
+                if server is not None:
+                    server["end"] = line
+            words = []
+
+    for server in servers:
+        names = []
+        for entry in server["server_name"]:
+            names.extend(entry.split())
+        server["server_name"] = names
+    return {"servers": servers, "services": services, "versions": versions}
+
+
+def parse_path(path):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return parse(f.read())
+
+
+# ----------------- Cached index -----------------
+
+
+class ConfigIndex:
+    """
+    Models for config files, re-parsed only when (mtime, size) changes.
+
+    index_file=None (or "") keeps everything in memory.
+    """
+
+    def __init__(self, index_file=DEFAULT_INDEX):
+        self.index_file = index_file
+        self.entries = {}
+        self.parsed = 0
+        self.hits = 0
+        self._dirty = False
+        if index_file:
+            try:
+                with open(index_file, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == MODEL_VERSION:
+                    self.entries = data["files"]
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def get(self, path):
+        """Model for `path`, or None if it does not exist."""
+        key = str(Path(path).resolve())
+        try:
+            st = os.stat(key)
+        except OSError:
+            if self.entries.pop(key, None) is not None:
+                self._dirty = True
+            return None
+        entry = self.entries.get(key)
+        if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            self.hits += 1
+            return entry["model"]
+        model = parse_path(key)
+        self.entries[key] = {
+            "mtime": st.st_mtime_ns,
+            "size": st.st_size,
+            "model": model,
+        }
+        self.parsed += 1
+        self._dirty = True
+        return model
+
+    def save(self):
+        # Best effort, like the repo index: the cache dir may not be writable
+        if not self.index_file or not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            tmp = f"{self.index_file}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"version": MODEL_VERSION, "files": self.entries}, f)
+            os.replace(tmp, self.index_file)
+            self._dirty = False
+        except OSError:
+            pass
+
+
+def find_configs(path):
+    """*.conf files under a directory (sorted), or the path itself."""
+    path = Path(path)
+    if path.is_dir():
+        return sorted(path.rglob("*.conf"))
+    return [path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the parsed nginx config model")
+    parser.add_argument("paths", nargs="+", help="Config files or directories")
+    parser.add_argument(
+        "--index", default=DEFAULT_INDEX, help="Index file ('' to disable)"
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = ConfigIndex(args.index)
+    for path in args.paths:
+        for conf in find_configs(path):
+            model = index.get(conf)
+            if model is None:
+                print(f"Warning: Could not find config at {conf}")
+                continue
+            print(f"{conf}:")
+            for server in model["servers"]:
+                names = " ".join(server["server_name"]) or "_"
+                print(f"  server {names} (lines {server['line']}-{server['end']})")
+                for listen in server["listen"]:
+                    print(f"    listen {listen}")
+                for location in server["locations"]:
+                    print(f"    location {location}")
+            for s in model["services"]:
+                print(f"  service {s['name']} -> {s['url']} (line {s['line']})")
+            for v in model["versions"]:
+                print(f"  version {v['id']}: {v['description']} (line {v['line']})")
+    index.save()
+    elapsed = (time.perf_counter() - started) * 1000
+    print(
+        f"{index.parsed} parsed, {index.hits} cached in {elapsed:.1f} ms",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
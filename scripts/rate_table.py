@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Per-IP token buckets in a small mmap'd table shared by all WSGI workers.
+
+The table is a fixed array of 48-byte slots in a file (on /dev/shm when
+available, so it never touches disk), addressed by a hash of the client
+address with short linear probing. When every probed slot is taken, the
+one idle the longest is recycled. All updates happen under an flock on the
+file, which costs a few microseconds per request. Each process takes it
+through a descriptor of its own (workers forked from a preloaded app would
+otherwise share one and not exclude each other), and threads within a
+process also take a thread lock, since flock does not tell them apart.
+
+Each slot keeps the bucket (tokens, last refill) plus lifetime accounting
+(total cost, requests, throttled requests), which is what the `top` view
+ranks by.
+
+Usage:
+    table = RateTable(DEFAULT_PATH, rate=1.0, burst=60)
+    allowed, tokens = table.charge("203.0.113.7", cost=10)
+
+    python3 rate_table.py top
+    python3 rate_table.py top --by throttled -n 50
+"""
+
+import argparse
+import fcntl
+import ipaddress
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+_SHM = "/dev/shm"
+DEFAULT_PATH = os.environ.get(
+    "KLAUS_RATE_TABLE",
+    os.path.join(_SHM if os.path.isdir(_SHM) else tempfile.gettempdir(), "klaus-rate"),
+)
+DEFAULT_SLOTS = 4096
+PROBE = 16
+
+MAGIC = b"KRATE001"
+HEADER = struct.Struct("<8sI4x")
+# key (IPv6 or v4-mapped), tokens, last refill, total cost, requests, throttled
+SLOT = struct.Struct("<16sdddII")
+
+Usage = namedtuple(
+    "Usage", ["ip", "tokens", "last_seen", "cost", "requests", "throttled"]
+)
+
+
+def _key(ip):
+    addr = ipaddress.ip_address(ip)
+    if addr.version == 4:
+        addr = ipaddress.IPv6Address(f"::ffff:{addr}")
+    return addr.packed
+
+
+def _ip(key):
+    addr = ipaddress.IPv6Address(key)
+    return str(addr.ipv4_mapped or addr)
+
+
+class RateTable:
+    def __init__(self, path=DEFAULT_PATH, rate=1.0, burst=60.0, slots=DEFAULT_SLOTS):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock_fd = self._fd
+        self._thread_lock = threading.Lock()
+        self._pid = os.getpid()
+        with self._locked():
+            head = os.pread(self._fd, HEADER.size, 0)
+            if len(head) == HEADER.size and head.startswith(MAGIC):
+                # Attach to the existing table, whatever size it was made with
+                slots = HEADER.unpack(head)[1]
+            else:
+                os.ftruncate(self._fd, HEADER.size + slots * SLOT.size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, slots), 0)
+        self.slots = slots
+        size = HEADER.size + slots * SLOT.size
+        self._mm = mmap.mmap(self._fd, size)
+
+    def close(self):
+        self._mm.close()
+        if self._lock_fd != self._fd:
+            os.close(self._lock_fd)
+        os.close(self._fd)
+
+    def _locked(self):
+        if self._pid != os.getpid():
+            # Forked since the table was opened: the inherited descriptor
+            # shares its open file description (and so its flock) with the
+            # parent and every sibling, so take one of our own
+            self._lock_fd = os.open(self.path, os.O_RDWR)
+            self._thread_lock = threading.Lock()
+            self._pid = os.getpid()
+        return _FileLock(self._lock_fd, self._thread_lock)
+
+    def _offset(self, i):
+        return HEADER.size + i * SLOT.size
+
+    def _find(self, key, now):
+        """Slot index for `key`, claiming (and resetting) one if needed."""
+        start = zlib.crc32(key) % self.slots
+        victim, victim_seen = None, None
+        for n in range(PROBE):
+            i = (start + n) % self.slots
+            slot_key, _, seen, _, _, _ = SLOT.unpack_from(self._mm, self._offset(i))
+            if slot_key == key:
+                return i
+            if seen == 0:
+                victim = i
+                break
+            if victim is None or seen < victim_seen:
+                victim, victim_seen = i, seen
+        SLOT.pack_into(self._mm, self._offset(victim), key, self.burst, now, 0, 0, 0)
+        return victim
+
+    def charge(self, ip, cost, now=None):
+        """
+        Take `cost` tokens from `ip`'s bucket if it has them.
+
+        Returns (allowed, tokens left). A refused request costs nothing but
+        is counted as throttled. A cost above the burst is capped at it: the
+        bucket never holds more, so the request could otherwise never pass.
+        """
+        now = now or time.time()
+        cost = min(cost, self.burst)
+        key = _key(ip)
+        with self._locked():
+            i = self._find(key, now)
+            off = self._offset(i)
+            _, tokens, seen, total, requests, throttled = SLOT.unpack_from(
+                self._mm, off
+            )
+            tokens = min(self.burst, tokens + (now - seen) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+                total += cost
+                requests += 1
+            else:
+                throttled += 1
+            SLOT.pack_into(self._mm, off, key, tokens, now, total, requests, throttled)
+        return allowed, tokens
+
+    def debit(self, ip, cost, now=None):
+        """Charge `cost` after the fact (measured work); may go negative."""
+        now = now or time.time()
+        key = _key(ip)
+        with self._locked():
+            i = self._find(key, now)
+            off = self._offset(i)
+            _, tokens, seen, total, requests, throttled = SLOT.unpack_from(
+                self._mm, off
+            )
+            tokens = min(self.burst, tokens + (now - seen) * self.rate) - cost
+            SLOT.pack_into(
+                self._mm, off, key, tokens, now, total + cost, requests, throttled
+            )
+
+    def usage(self):
+        rows = []
+        for i in range(self.slots):
+            key, tokens, seen, total, requests, throttled = SLOT.unpack_from(
+                self._mm, self._offset(i)
+            )
+            if seen:
+                rows.append(Usage(_ip(key), tokens, seen, total, requests, throttled))
+        return rows
+
+    def top(self, n=20, by="cost"):
+        return sorted(self.usage(), key=lambda u: getattr(u, by), reverse=True)[:n]
+
+
+class _FileLock:
+    def __init__(self, fd, thread_lock):
+        self.fd = fd
+        self.thread_lock = thread_lock
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+        return False
+
+
+def cmd_top(args):
+    if not os.path.exists(args.table):
+        print(f"No rate table at {args.table} (is klaus running?)")
+        return
+    table = RateTable(args.table)
+    rows = table.top(args.n, args.by)
+    now = time.time()
+    print(
+        f"{'ip':<40} {'cost':>10} {'requests':>9} {'throttled':>9} "
+        f"{'tokens':>7} {'idle':>7}"
+    )
+    for u in rows:
+        print(
+            f"{u.ip:<40} {u.cost:>10.1f} {u.requests:>9} {u.throttled:>9} "
+            f"{u.tokens:>7.1f} {now - u.last_seen:>6.0f}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the klaus rate table")
+    parser.add_argument("--table", default=DEFAULT_PATH, help="Table file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_top = subparsers.add_parser("top", help="Show the heaviest clients")
+    p_top.add_argument("-n", type=int, default=20, help="Rows to show")
+    p_top.add_argument(
+        "--by",
+        choices=["cost", "requests", "throttled"],
+        default="cost",
+        help="Sort key",
+    )
+    p_top.set_defaults(func=cmd_top)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
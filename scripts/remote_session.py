@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Reusable remote shell sessions for the repo management scripts.
+
+Every ssh invocation made through an SSHSession shares one multiplexed
+connection (OpenSSH ControlMaster/ControlPersist), so only the first call of
+a run pays for the TCP + key exchange + auth handshake; later calls open a
+channel on the existing socket.
+
+ShellSession runs the same command strings through a local `sh -c` instead.
+It stands in for a host when testing: `sh:/tmp/fake-vps` uses /tmp/fake-vps
+as that target's git root.
+
+Targets can be given as `user@host`, as `sh:<git root>`, or by environment
+name (dev, prod, nightly), which resolves like the Makefile does:
+$VPS_USER@$VPS_HOST_<ENV>.
+
+A Batch collects several operations and ships them as one script over a
+single exec (the same trick manage_repos' sync uses), getting back the
+status of every step as JSON.
+
+Usage:
+    with open_session("gg@dev.nutra.tk") as remote:
+        if remote.call("test -d /srv/git") == 0:
+            print(remote.check_output("ls /srv/git"))
+
+        batch = Batch(remote)
+        batch.makedirs("mkdir", "/srv/git/projects/x.git")
+        batch.run("init", ["git", "-C", "/srv/git/projects/x.git", "init", "--bare"])
+        batch.execute()
+"""
+
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+GIT_ROOT = "/srv/git"
+
+# %C is a hash of (local host, remote host, port, user); keeps the socket path
+# well under the ~104 byte unix socket limit.
+CONTROL_PATH = os.path.expanduser("~/.ssh/cm-nginx-ops-%C")
+CONTROL_PERSIST = "60s"
+
+ENV_NAMES = ("dev", "prod", "nightly")
+
+
+class SSHSession:
+    def __init__(self, target, persist=CONTROL_PERSIST):
+        self.target = target
+        self.git_root = GIT_ROOT
+        self.options = [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={CONTROL_PATH}",
+            "-o",
+            f"ControlPersist={persist}",
+        ]
+        self.calls = 0
+
+    def __str__(self):
+        return self.target
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def argv(self, command):
+        """The local argv that runs shell `command` on the target."""
+        return ["ssh", *self.options, self.target, command]
+
+    def run(self, command, input=None, check=True, capture=False):
+        """Run `command` remotely; returns a CompletedProcess."""
+        self.calls += 1
+        return subprocess.run(
+            self.argv(command),
+            input=input,
+            check=check,
+            stdout=subprocess.PIPE if capture else None,
+        )
+
+    def call(self, command):
+        return self.run(command, check=False).returncode
+
+    def check_call(self, command):
+        self.run(command)
+
+    def check_output(self, command, input=None):
+        out = self.run(command, input=input, capture=True).stdout
+        return out.decode("utf-8", "replace")
+
+    def close(self):
+        """Shut down the master connection this run opened."""
+        if not self.calls:
+            return
+        # Talks to the local control socket only; no-op if it's already gone
+        subprocess.call(
+            ["ssh", *self.options, "-O", "exit", self.target],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
+class ShellSession(SSHSession):
+    """Runs commands through a local `sh -c`; stands in for a remote host."""
+
+    def __init__(self, target):
+        super().__init__(target)
+        root = target.split(":", 1)[1]
+        if root:
+            self.git_root = os.path.abspath(root)
+
+    def argv(self, command):
+        return ["sh", "-c", command]
+
+    def close(self):
+        pass
+
+
+def resolve_target(name):
+    """Expand an environment name (dev/prod/nightly) into user@host."""
+    if name not in ENV_NAMES:
+        return name
+    host = os.environ.get(f"VPS_HOST_{name.upper()}")
+    if not host:
+        raise ValueError(f"VPS_HOST_{name.upper()} is not set (see .env)")
+    return f"{os.environ.get('VPS_USER', 'gg')}@{host}"
+
+
+def parse_targets(spec):
+    """Split a comma-separated --remote value into resolved targets."""
+    return [resolve_target(t.strip()) for t in spec.split(",") if t.strip()]
+
+
+def open_session(target):
+    if target.startswith("sh:"):
+        return ShellSession(target)
+    return SSHSession(target)
+
+
+# ----------------- Batches -----------------
+
+# Runs on the target with the step list on stdin; prints one JSON result
+# list. Once a checked step fails, the rest are reported as "not run".
+BATCH_RUNNER = r"""
+import json, os, subprocess, sys
+
+results = []
+failed = False
+for step in json.load(sys.stdin):
+    res = {"name": step["name"], "status": "ok", "rc": 0, "stderr": ""}
+    results.append(res)
+    if failed:
+        res["status"] = "not run"
+        continue
+    if step.get("unless") and os.path.exists(step["unless"]):
+        res["status"] = "skipped"
+        continue
+    try:
+        if "require" in step:
+            if not os.path.exists(step["require"]):
+                res.update(rc=1, stderr=step["require"] + " does not exist")
+        elif "mkdir" in step:
+            os.makedirs(step["mkdir"], exist_ok=True)
+        elif "write" in step:
+            with open(step["write"], "w") as f:
+                f.write(step["content"])
+        else:
+            p = subprocess.run(
+                step["argv"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            res.update(rc=p.returncode, stderr=p.stderr[-2000:])
+    except OSError as e:
+        res.update(rc=1, stderr=str(e))
+    if res["rc"]:
+        if step.get("check", True):
+            res["status"] = "failed"
+            failed = True
+        else:
+            res["status"] = "ignored"
+
+print(json.dumps(results))
+"""
+
+
+class BatchError(RuntimeError):
+    def __init__(self, results):
+        failed = [r for r in results if r["status"] == "failed"]
+        super().__init__(f"step '{failed[0]['name']}' failed" if failed else "")
+        self.results = results
+
+
+class Batch:
+    """
+    Operations queued for one target and executed in a single round trip.
+
+    `remote` is a session from open_session(), or None for the local
+    machine (same runner, via the current interpreter).
+    """
+
+    def __init__(self, remote):
+        self.remote = remote
+        self.steps = []
+
+    def __len__(self):
+        return len(self.steps)
+
+    def run(self, name, argv, check=True, unless=None):
+        """Queue a command; `unless` skips it when that path already exists."""
+        self._add(name, argv=list(argv), check=check, unless=unless)
+
+    def makedirs(self, name, path, unless=None):
+        self._add(name, mkdir=path, unless=unless)
+
+    def write(self, name, path, content):
+        self._add(name, write=path, content=content)
+
+    def require(self, name, path, check=True):
+        """Stop the batch here unless `path` exists (just report if not check)."""
+        self._add(name, require=path, check=check)
+
+    def _add(self, name, **step):
+        step = {k: v for k, v in step.items() if v is not None}
+        step["name"] = name
+        self.steps.append(step)
+
+    def execute(self, verbose=True):
+        """Run every queued step; return the per-step results."""
+        if not self.steps:
+            return []
+        payload = json.dumps(self.steps).encode("utf-8")
+        if self.remote is None:
+            out = subprocess.run(
+                [sys.executable, "-c", BATCH_RUNNER],
+                input=payload,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout.decode("utf-8")
+        else:
+            out = self.remote.check_output(
+                f"python3 -c {shlex.quote(BATCH_RUNNER)}", input=payload
+            )
+        self.steps = []
+        results = json.loads(out)
+
+        if verbose:
+            for r in results:
+                print(f"  {r['status']:<8} {r['name']}")
+                if r["status"] in ("failed", "ignored") and r["stderr"].strip():
+                    for line in r["stderr"].strip().splitlines()[-5:]:
+                        print(f"           {line}")
+        if any(r["status"] == "failed" for r in results):
+            raise BatchError(results)
+        return results
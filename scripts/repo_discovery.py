@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Find bare git repositories under a root, quickly and incrementally.
+
+The walk uses os.scandir and stops at every `*.git` directory, so it never
+descends into objects/ or refs/; its cost scales with the number of
+directories *between* repos, not with their contents. The result is cached
+in a small JSON index together with the mtime of every directory walked.
+Adding, removing or renaming a repo changes its parent directory's mtime,
+so a later call only has to stat those directories to know the cached list
+is still valid.
+
+watch() calls back when the set of repos changes: through inotify if the
+optional `inotify_simple` package is installed, otherwise by polling the
+same directory mtimes.
+
+Usage:
+    repos = discover("/srv/git")
+
+    python3 repo_discovery.py /srv/git
+    python3 repo_discovery.py --watch /srv/git
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+DEFAULT_INDEX = os.environ.get(
+    "REPO_INDEX_FILE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "nginx-ops",
+        "repo_index.json",
+    ),
+)
+
+POLL_INTERVAL = 5.0
+
+
+def scan(root):
+    """
+    Walk `root` without entering *.git directories or symlinked ones.
+
+    Returns (sorted repo paths, {walked dir: mtime_ns}).
+    """
+    repos = []
+    dirs = {}
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            dirs[path] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                for entry in it:
+                    # Like os.walk: symlinked repos are listed, but symlinked
+                    # directories are never descended into (so no loops)
+                    if entry.name.endswith(".git"):
+                        if entry.is_dir():
+                            repos.append(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+        except OSError:
+            # Vanished or unreadable mid-walk; the mtime check catches it later
+            continue
+    return sorted(repos), dirs
+
+
+def _still_valid(index):
+    for path, mtime in index["dirs"].items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _load_index(index_file, root):
+    try:
+        with open(index_file, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("root") != root:
+        return None
+    return index
+
+
+def _save_index(index_file, index):
+    # Best effort: a service user may not have a writable cache dir
+    try:
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        tmp = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, index_file)
+    except OSError:
+        pass
+
+
+def discover(root, index_file=DEFAULT_INDEX):
+    """Return the sorted repo paths under `root`, from the index when valid."""
+    root = os.path.abspath(root)
+    index = _load_index(index_file, root) if index_file else None
+    if index and _still_valid(index):
+        return index["repos"]
+
+    repos, dirs = scan(root)
+    if index_file:
+        _save_index(index_file, {"root": root, "repos": repos, "dirs": dirs})
+    return repos
+
+
+# ----------------- Watching -----------------
+
+
+def _watch_inotify(root, on_change, stop):
+    flags = inotify_simple.flags
+    mask = (
+        flags.CREATE
+        | flags.DELETE
+        | flags.MOVED_FROM
+        | flags.MOVED_TO
+        | flags.DELETE_SELF
+        | flags.ONLYDIR
+    )
+    repos = None
+    with inotify_simple.INotify() as inotify:
+        while not stop.is_set():
+            # Re-arm on the current directory set; repo dirs are not watched,
+            # so pushes (which only touch objects/refs) never wake us up.
+            current, dirs = scan(root)
+            watches = []
+            for d in dirs:
+                try:
+                    watches.append(inotify.add_watch(d, mask))
+                except OSError:
+                    pass
+            # Anything created between the scan and add_watch shows up here
+            current, _ = scan(root)
+            if repos is not None and current != repos:
+                on_change(current)
+            repos = current
+            while not stop.is_set():
+                events = inotify.read(timeout=1000)
+                if events:
+                    # Let a burst (mkdir + git init) settle before rescanning
+                    time.sleep(0.2)
+                    inotify.read(timeout=0)
+                    break
+            for wd in watches:
+                try:
+                    inotify.rm_watch(wd)
+                except OSError:
+                    pass
+
+
+def _watch_poll(root, on_change, stop, interval):
+    repos, dirs = scan(root)
+    while not stop.wait(interval):
+        if _still_valid({"dirs": dirs}):
+            continue
+        current, dirs = scan(root)
+        if current != repos:
+            repos = current
+            on_change(current)
+
+
+def watch(root, on_change, interval=POLL_INTERVAL):
+    """
+    Call on_change(repos) from a daemon thread whenever the repo set changes.
+
+    Returns a threading.Event; set it to stop watching.
+    """
+    root = os.path.abspath(root)
+    stop = threading.Event()
+    if inotify_simple is not None:
+        target, args = _watch_inotify, (root, on_change, stop)
+    else:
+        target, args = _watch_poll, (root, on_change, stop, interval)
+    threading.Thread(target=target, args=args, daemon=True).start()
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List bare git repos under a root")
+    parser.add_argument("root", nargs="?", default="/srv/git")
+    parser.add_argument(
+        "--index", default=DEFAULT_INDEX, help="Index file ('' to disable)"
+    )
+    parser.add_argument(
+        "--watch", action="store_true", help="Keep running and print changes"
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    repos = discover(args.root, args.index)
+    elapsed = (time.perf_counter() - started) * 1000
+    for repo in repos:
+        print(repo)
+    print(f"{len(repos)} repositories in {elapsed:.1f} ms", file=sys.stderr)
+
+    if args.watch:
+        mode = "inotify" if inotify_simple else f"polling every {POLL_INTERVAL:g}s"
+        print(f"Watching {args.root} ({mode})...", file=sys.stderr)
+
+        def report(current):
+            added = sorted(set(current) - set(repos))
+            removed = sorted(set(repos) - set(current))
+            for repo in added:
+                print(f"+ {repo}", flush=True)
+            for repo in removed:
+                print(f"- {repo}", flush=True)
+            repos[:] = current
+
+        watch(args.root, report)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+SQLite store for the repository metadata manage_repos tracks.
+
+repos.json stays the format that lives in git; the store is the working
+copy. Each entry is kept as its JSON document plus indexed columns for the
+repo path, owner and origin host, so lookups, prefix completion and
+filtered listings never parse the whole file. The database runs in WAL mode
+so parallel manage_repos runs (--remote a,b) don't block each other's
+readers, and writes are grouped into transactions.
+
+The JSON is re-imported automatically when it no longer matches the digest
+recorded at the last import/export (e.g. after a git pull), and export()
+rewrites it only when the content actually changed.
+
+Usage:
+    store = RepoStore(DEFAULT_DB, json_path="scripts/repos.json")
+    with store.transaction():
+        store.upsert("projects/x.git", owner="Shane", origin="https://...")
+    store.export()
+
+    python3 repo_store.py stats
+    python3 repo_store.py list --owner Shane
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+DEFAULT_DB = os.environ.get("REPO_DB", os.path.expanduser("~/.nginx-ops/repos.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    path TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    owner TEXT,
+    origin_host TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS repos_owner ON repos (owner);
+CREATE INDEX IF NOT EXISTS repos_origin_host ON repos (origin_host);
+CREATE INDEX IF NOT EXISTS repos_seq ON repos (seq);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def origin_host(entry):
+    """Host part of the entry's origin remote (scp-style URLs included)."""
+    url = (entry.get("remotes") or {}).get("origin")
+    if not url:
+        return None
+    if "://" not in url and ":" in url:
+        # git@github.com:owner/repo.git
+        return url.split(":", 1)[0].rsplit("@", 1)[-1].lower()
+    return (urlsplit(url).hostname or "").lower() or None
+
+
+def render_json(data):
+    return json.dumps(data, indent=2) + "\n"
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class RepoStore:
+    def __init__(self, path=DEFAULT_DB, json_path=None):
+        self.path = path
+        self.json_path = json_path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # isolation_level=None: transactions are managed explicitly below
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self._depth = 0
+        if json_path:
+            self.refresh()
+
+    def close(self):
+        self.db.close()
+
+    # ----------------- Transactions -----------------
+
+    @contextmanager
+    def transaction(self):
+        """Group writes; nested uses join the outermost transaction."""
+        if self._depth == 0:
+            self.db.execute("BEGIN IMMEDIATE")
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self.db.execute("ROLLBACK")
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self.db.execute("COMMIT")
+
+    def _meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    # ----------------- Reads -----------------
+
+    def __contains__(self, path):
+        return (
+            self.db.execute("SELECT 1 FROM repos WHERE path = ?", (path,)).fetchone()
+            is not None
+        )
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM repos").fetchone()[0]
+
+    def get(self, path):
+        row = self.db.execute(
+            "SELECT doc FROM repos WHERE path = ?", (path,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def paths(self, prefix=""):
+        """Repo paths starting with `prefix`, via a range scan on the key."""
+        if not prefix:
+            rows = self.db.execute("SELECT path FROM repos ORDER BY path")
+        else:
+            # Every string with this prefix sorts in [prefix, prefix + U+10FFFF)
+            rows = self.db.execute(
+                "SELECT path FROM repos WHERE path >= ? AND path < ? ORDER BY path",
+                (prefix, prefix + "\U0010ffff"),
+            )
+        return [r[0] for r in rows]
+
+    def all(self, owner=None, host=None):
+        """{path: entry} in repos.json order, optionally filtered."""
+        query = "SELECT path, doc FROM repos"
+        clauses, params = [], []
+        if owner is not None:
+            clauses.append("owner = ?")
+            params.append(owner)
+        if host is not None:
+            clauses.append("origin_host = ?")
+            params.append(host.lower())
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY seq"
+        return {path: json.loads(doc) for path, doc in self.db.execute(query, params)}
+
+    # ----------------- Writes -----------------
+
+    def put(self, path, entry):
+        """Insert or replace one entry; new paths go to the end of the export."""
+        with self.transaction():
+            self.db.execute(
+                "INSERT INTO repos (path, seq, owner, origin_host, doc) VALUES "
+                "(?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM repos), ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET owner = excluded.owner, "
+                "origin_host = excluded.origin_host, doc = excluded.doc",
+                (path, entry.get("owner"), origin_host(entry), json.dumps(entry)),
+            )
+
+    def upsert(self, path, description=None, owner=None, origin=None, remotes=None):
+        """
+        Merge metadata into `path`'s entry, creating it if needed.
+
+        Only the fields given are touched; `remotes` is merged key by key.
+        Returns True if the entry was new.
+        """
+        with self.transaction():
+            entry = self.get(path)
+            created = entry is None
+            if created:
+                entry = {}
+            if description:
+                entry["description"] = description
+            if owner:
+                entry["owner"] = owner
+            if origin:
+                remotes = dict(remotes or {}, origin=origin)
+            if remotes:
+                entry.setdefault("remotes", {}).update(remotes)
+            self.put(path, entry)
+        return created
+
+    def rename(self, old, new):
+        """Move `old`'s entry to `new`, keeping its place; False if missing."""
+        with self.transaction():
+            if new in self:
+                raise ValueError(f"{new} is already tracked")
+            cur = self.db.execute(
+                "UPDATE repos SET path = ? WHERE path = ?", (new, old)
+            )
+            return cur.rowcount == 1
+
+    def delete(self, path):
+        with self.transaction():
+            self.db.execute("DELETE FROM repos WHERE path = ?", (path,))
+
+    # ----------------- repos.json -----------------
+
+    def import_data(self, data, digest=None):
+        """Replace the whole store with a repos.json-style dict."""
+        with self.transaction():
+            self.db.execute("DELETE FROM repos")
+            self.db.executemany(
+                "INSERT INTO repos (path, seq, owner, origin_host, doc) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    (path, seq, e.get("owner"), origin_host(e), json.dumps(e))
+                    for seq, (path, e) in enumerate(data.items(), 1)
+                ),
+            )
+            if digest:
+                self._set_meta("json_digest", digest)
+
+    def refresh(self):
+        """Re-import the JSON if it changed since the last import/export."""
+        try:
+            with open(self.json_path, "r") as f:
+                text = f.read()
+        except OSError:
+            return False
+        digest = _digest(text)
+        if digest == self._meta("json_digest"):
+            return False
+        try:
+            data = json.loads(text)
+        except ValueError:
+            print(f"Warning: {self.json_path} is invalid JSON; not importing it.")
+            return False
+        self.import_data(data, digest)
+        return True
+
+    def export(self):
+        """Write the JSON if its content differs; returns True if written."""
+        text = render_json(self.all())
+        digest = _digest(text)
+        if digest == self._meta("json_digest") and os.path.exists(self.json_path):
+            return False
+        # Written via rename: with several --remote targets, each target's run
+        # exports and a reader must never see a half-written file.
+        tmp = f"{self.json_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.json_path)
+        with self.transaction():
+            self._set_meta("json_digest", digest)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the repo metadata store")
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLite database")
+    parser.add_argument("--json", help="repos.json to refresh from first")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_list = subparsers.add_parser("list", help="Print entries as JSON")
+    p_list.add_argument("--owner", help="Only repos with this owner")
+    p_list.add_argument("--host", help="Only repos whose origin is on this host")
+    subparsers.add_parser("stats", help="Counts per owner and origin host")
+    args = parser.parse_args()
+
+    store = RepoStore(args.db, json_path=args.json)
+    if args.command == "list":
+        print(json.dumps(store.all(args.owner, args.host), indent=2))
+    else:
+        print(f"{len(store)} repos in {args.db}")
+        for column in ("owner", "origin_host"):
+            rows = store.db.execute(
+                f"SELECT COALESCE({column}, '-'), COUNT(*) FROM repos "
+                f"GROUP BY {column} ORDER BY COUNT(*) DESC"
+            )
+            print(f"\nby {column}:")
+            for value, count in rows:
+                print(f"  {count:>5}  {value}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Probe every service listed in services.json concurrently and record status.
+
+gen_services_map.py writes the service list; this adds a "status" object to
+each entry and writes the file back:
+
+    "status": {
+        "up": true, "code": 200, "error": null,
+        "latency_ms": {"p50": 41.2, "p95": 58.0, "max": 58.0},
+        "tls_expires": "2027-01-03T12:00:00+00:00", "tls_days_left": 79,
+        "checked_at": "2026-10-16T12:00:00+00:00"
+    }
+
+Probes are plain HTTP/1.1 HEAD requests on asyncio streams. Connections are
+pooled per (scheme, host, port) and kept alive between samples, a global
+semaphore caps total concurrency and a per-host one keeps a single box
+from being hammered. Any response below 500 counts as up; redirects are not
+followed.
+
+Usage:
+    python3 service_probe.py
+    python3 service_probe.py --samples 5 --timeout 3 --per-host 2
+"""
+
+import argparse
+import asyncio
+import json
+import ssl
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from gen_services_map import REPO_ROOT, write_if_changed
+
+DEFAULT_JSON = REPO_ROOT / "opt/my-website/src/lib/services.json"
+USER_AGENT = "nginx-ops-probe/1"
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class ConnectionPool:
+    """Idle keep-alive connections per (scheme, host, port)."""
+
+    def __init__(self, ssl_context):
+        self.ssl_context = ssl_context
+        self.idle = {}
+
+    async def acquire(self, scheme, host, port, timeout):
+        """Returns (reader, writer, reused)."""
+        idle = self.idle.get((scheme, host, port))
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        tls = self.ssl_context if scheme == "https" else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port, ssl=tls, server_hostname=host if tls else None
+            ),
+            timeout,
+        )
+        return reader, writer, False
+
+    def release(self, scheme, host, port, reader, writer):
+        self.idle.setdefault((scheme, host, port), []).append((reader, writer))
+
+    async def close(self):
+        for conns in self.idle.values():
+            for _, writer in conns:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ssl.SSLError):
+                    pass
+        self.idle.clear()
+
+
+def tls_expiry(writer):
+    ssl_object = writer.get_extra_info("ssl_object")
+    if ssl_object is None:
+        return None
+    cert = ssl_object.getpeercert()
+    if not cert or "notAfter" not in cert:
+        return None
+    return ssl.cert_time_to_seconds(cert["notAfter"])
+
+
+async def request(pool, url, timeout):
+    """
+    One HEAD request. Returns (status code, latency seconds, TLS expiry).
+
+    A pooled connection the server has since dropped is retried once on a
+    fresh one.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme or "http"
+    host = parts.hostname
+    port = parts.port or (443 if scheme == "https" else 80)
+    target = parts.path or "/"
+    if parts.query:
+        target += f"?{parts.query}"
+    host_header = host if parts.port is None else f"{host}:{port}"
+    payload = (
+        f"HEAD {target} HTTP/1.1\r\nHost: {host_header}\r\n"
+        f"User-Agent: {USER_AGENT}\r\nConnection: keep-alive\r\n\r\n"
+    ).encode()
+
+    for attempt in range(2):
+        started = time.perf_counter()
+        reader, writer, reused = await pool.acquire(scheme, host, port, timeout)
+        try:
+            writer.write(payload)
+            await writer.drain()
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            if reused and attempt == 0:
+                continue
+            raise
+        except BaseException:
+            writer.close()
+            raise
+        latency = time.perf_counter() - started
+
+        lines = head.decode("latin-1").split("\r\n")
+        code = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        expires = tls_expiry(writer)
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            pool.release(scheme, host, port, reader, writer)
+        return code, latency, expires
+
+
+async def probe(pool, url, samples, timeout, limit, host_limit):
+    latencies = []
+    code = expires = error = None
+    # Samples run back to back so they reuse the same pooled connection
+    async with limit, host_limit:
+        for _ in range(samples):
+            try:
+                code, latency, expires = await request(pool, url, timeout)
+            except asyncio.TimeoutError:
+                error = f"timeout after {timeout:g}s"
+                break
+            except (OSError, ssl.SSLError, ValueError, IndexError) as e:
+                error = str(e) or type(e).__name__
+                break
+            latencies.append(latency * 1000)
+
+    now = datetime.now(timezone.utc)
+    status = {
+        "up": error is None and code is not None and code < 500,
+        "code": code,
+        "error": error,
+        "latency_ms": None,
+        "tls_expires": None,
+        "tls_days_left": None,
+        "checked_at": now.isoformat(timespec="seconds"),
+    }
+    if latencies:
+        status["latency_ms"] = {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "max": round(max(latencies), 1),
+        }
+    if expires is not None:
+        status["tls_expires"] = datetime.fromtimestamp(
+            expires, timezone.utc
+        ).isoformat()
+        status["tls_days_left"] = int((expires - now.timestamp()) // 86400)
+    return status
+
+
+async def probe_all(
+    urls, samples=3, timeout=5.0, concurrency=32, per_host=4, verify=True
+):
+    """Probe `urls` concurrently; returns {url: status}."""
+    ctx = ssl.create_default_context()
+    if not verify:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    pool = ConnectionPool(ctx)
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = {}
+    for url in urls:
+        host_limits.setdefault(urlsplit(url).hostname, asyncio.Semaphore(per_host))
+
+    # Each URL holds one host slot for all its samples, so a host with more
+    # URLs than slots is worked through per_host at a time.
+    unique = list(dict.fromkeys(urls))
+    try:
+        results = await asyncio.gather(
+            *(
+                probe(
+                    pool,
+                    url,
+                    samples,
+                    timeout,
+                    limit,
+                    host_limits[urlsplit(url).hostname],
+                )
+                for url in unique
+            )
+        )
+    finally:
+        await pool.close()
+    return dict(zip(unique, results))
+
+
+def probe_json(path, **options):
+    """
+    Probe every service in the services.json at `path` and write each
+    result into its entry's "status" (other fields are kept). Returns the
+    list of service entries. `options` are passed to probe_all().
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    services = [s for group in data["groups"] for s in group["services"]]
+    results = asyncio.run(probe_all([s["url"] for s in services], **options))
+    for s in services:
+        s["status"] = results[s["url"]]
+    write_if_changed(path, (json.dumps(data, indent=2) + "\n").encode())
+    return services
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Probe the services in services.json and record their status"
+    )
+    parser.add_argument(
+        "--json", type=Path, default=DEFAULT_JSON, help="services.json to update"
+    )
+    parser.add_argument(
+        "--samples", type=int, default=3, help="Requests per service (default: 3)"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=5.0, help="Per-request timeout in seconds"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="Max probes in flight"
+    )
+    parser.add_argument(
+        "--per-host", type=int, default=4, help="Max probes in flight per host"
+    )
+    parser.add_argument(
+        "--insecure", action="store_true", help="Don't verify TLS certificates"
+    )
+    args = parser.parse_args()
+
+    if not args.json.exists():
+        print(f"Error: {args.json} not found (run gen_services_map.py first)")
+        sys.exit(1)
+    started = time.perf_counter()
+    services = probe_json(
+        args.json,
+        samples=args.samples,
+        timeout=args.timeout,
+        concurrency=args.concurrency,
+        per_host=args.per_host,
+        verify=not args.insecure,
+    )
+    elapsed = time.perf_counter() - started
+
+    down = 0
+    for s in services:
+        st = s["status"]
+        if st["up"]:
+            p50 = st["latency_ms"]["p50"]
+            tls = (
+                f", TLS {st['tls_days_left']}d"
+                if st["tls_days_left"] is not None
+                else ""
+            )
+            print(f"  UP   {s['url']} ({st['code']}, p50 {p50} ms{tls})")
+        else:
+            down += 1
+            print(f"  DOWN {s['url']} ({st['error'] or st['code']})")
+
+    probed = len({s["url"] for s in services})
+    print(
+        f"Probed {probed} services in {elapsed:.2f}s: "
+        f"{len(services) - down} up, {down} down"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+#!/bin/bash
+# post-receive hook: refresh the static snapshot pages of the pushed repo.
+# Install into a bare repo as hooks/post-receive (or call it from one).
+# git_snapshot.py works out which refs and paths moved from its manifest.
+
+SNAPSHOT_SCRIPT="${SNAPSHOT_SCRIPT:-/opt/vps-root/scripts/git_snapshot.py}"
+
+# Drain stdin (oldrev newrev refname); git expects hooks to read it
+cat >/dev/null
+
+REPO_DIR=$(cd "${GIT_DIR:-.}" && pwd)
+unset GIT_DIR
+
+# Don't hold up the push; pages follow a moment later
+nohup python3 "$SNAPSHOT_SCRIPT" --repo "$REPO_DIR" >/dev/null 2>&1 &
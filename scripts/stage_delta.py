@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Stage files on a VPS by sending only what changed since the last stage.
+
+The staging dir on the remote keeps a manifest (.stage-manifest.json) of
+{path: [digest, size, mode]} for the state it was last staged to; symlinks
+are recorded as {path: ["symlink", target]} and staged as symlinks, like
+the tar the Makefile used to send. A run
+reads that manifest, compares it with the local files, and streams one
+archive holding just the new and changed files plus the list of paths to
+delete. The remote side applies it, checks the digests of everything it
+wrote and the sizes of everything else against the new manifest, and only
+then saves that manifest. If the check fails, the manifest is dropped and
+the stage is redone in full.
+
+Two ssh round trips (over one multiplexed connection, see remote_session)
+regardless of how big the tree is.
+
+Usage:
+    python3 stage_delta.py gg@dev.nutra.tk etc/nginx/conf.d/*.conf scripts/*.py
+    python3 stage_delta.py --full dev etc/fail2ban
+    python3 stage_delta.py --dest /tmp/staging sh: etc/unbound
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import shlex
+import sys
+import tarfile
+import time
+from pathlib import Path
+
+from remote_session import open_session, resolve_target
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_DEST = "~/.nginx-ops/staging"
+MANIFEST_NAME = ".stage-manifest.json"
+
+# Runs on the target: argv[1] is the staging dir; stdin is one JSON header
+# line ({"delete": [...], "manifest": {...}, "full": bool}) followed by a
+# tar.gz stream of the files to write. Prints a JSON result.
+APPLY_SCRIPT = r"""
+import hashlib, json, os, shutil, sys, tarfile
+
+dest = os.path.abspath(os.path.expanduser(sys.argv[1]))
+manifest_path = os.path.join(dest, ".stage-manifest.json")
+stdin = sys.stdin.buffer
+header = json.loads(stdin.readline())
+
+def safe(name):
+    path = os.path.normpath(os.path.join(dest, name))
+    if not path.startswith(dest + os.sep):
+        raise ValueError("refusing path outside staging dir: " + name)
+    return path
+
+def digest(path):
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+if header["full"] and os.path.isdir(dest):
+    shutil.rmtree(dest)
+os.makedirs(dest, exist_ok=True)
+# Drop the old manifest first: an interrupted apply must not look staged
+if os.path.exists(manifest_path):
+    os.remove(manifest_path)
+
+for name in header["delete"]:
+    path = safe(name)
+    if os.path.lexists(path):
+        os.remove(path)
+    parent = os.path.dirname(path)
+    while parent != dest and os.path.isdir(parent) and not os.listdir(parent):
+        os.rmdir(parent)
+        parent = os.path.dirname(parent)
+
+written = []
+with tarfile.open(fileobj=stdin, mode="r|gz") as tar:
+    for member in tar:
+        if not (member.isfile() or member.issym()):
+            continue
+        path = safe(member.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".stage-tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        if member.issym():
+            os.symlink(member.linkname, tmp)
+        else:
+            with open(tmp, "wb") as out:
+                shutil.copyfileobj(tar.extractfile(member), out)
+            os.chmod(tmp, member.mode & 0o777)
+        os.replace(tmp, path)
+        written.append(member.name)
+
+bad = []
+for name, entry in header["manifest"].items():
+    path = safe(name)
+    try:
+        if entry[0] == "symlink":
+            if not os.path.islink(path) or os.readlink(path) != entry[1]:
+                bad.append(name)
+            continue
+        want, size, mode = entry
+        if os.path.islink(path) or os.path.getsize(path) != size:
+            bad.append(name)
+        elif name in written and digest(path) != want:
+            bad.append(name)
+    except OSError:
+        bad.append(name)
+
+if not bad:
+    tmp = manifest_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(header["manifest"], f)
+    os.replace(tmp, manifest_path)
+print(json.dumps({"written": len(written), "deleted": len(header["delete"]), "bad": bad}))
+"""
+
+
+def file_digest(path):
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def repo_relative(path, root=REPO_ROOT):
+    """
+    `path` relative to the repo, without following a symlink at the leaf
+    (etc/systemd/system has links into /lib/systemd/system).
+    """
+    path = Path(os.path.abspath(path))
+    return (path.parent.resolve() / path.name).relative_to(root.resolve())
+
+
+def expand(paths, root=REPO_ROOT):
+    """
+    Repo-relative paths for files, symlinks and directories (recursively).
+    Symlinks are kept as links whether or not their target exists here.
+    """
+    files = []
+    for arg in paths:
+        path = Path(arg)
+        if path.is_symlink():
+            files.append(path)
+        elif path.is_dir():
+            files.extend(p for p in path.rglob("*") if p.is_symlink() or p.is_file())
+        elif path.is_file():
+            files.append(path)
+        else:
+            print(f"Warning: {arg} not found, skipping", file=sys.stderr)
+    rels = set()
+    for p in files:
+        try:
+            rels.add(repo_relative(p, root).as_posix())
+        except ValueError:
+            print(f"Warning: {p} is outside {root}, skipping", file=sys.stderr)
+    return sorted(rels)
+
+
+def local_manifest(rels, root=REPO_ROOT):
+    manifest = {}
+    for rel in rels:
+        path = root / rel
+        if path.is_symlink():
+            manifest[rel] = ["symlink", os.readlink(path)]
+            continue
+        st = path.stat()
+        manifest[rel] = [file_digest(path), st.st_size, st.st_mode & 0o777]
+    return manifest
+
+
+def fetch_manifest(remote, dest):
+    quoted = dest if dest.startswith("~/") else shlex.quote(dest)
+    out = remote.check_output(f"cat {quoted}/{MANIFEST_NAME} 2>/dev/null || true")
+    try:
+        return json.loads(out) if out.strip() else {}
+    except ValueError:
+        return {}
+
+
+def delta(local, remote):
+    """(paths to send, paths to delete)."""
+    send = [rel for rel, entry in local.items() if remote.get(rel) != entry]
+    delete = sorted(set(remote) - set(local))
+    return send, delete
+
+
+def build_payload(manifest, send, delete, full, root=REPO_ROOT):
+    header = {"delete": delete, "manifest": manifest, "full": full}
+    buf = io.BytesIO()
+    buf.write(json.dumps(header).encode() + b"\n")
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for rel in send:
+            info = tarfile.TarInfo(rel)
+            info.mtime = int(time.time())
+            if manifest[rel][0] == "symlink":
+                info.type = tarfile.SYMTYPE
+                info.linkname = manifest[rel][1]
+                info.mode = 0o777
+                tar.addfile(info)
+                continue
+            info.size = manifest[rel][1]
+            info.mode = manifest[rel][2]
+            with open(root / rel, "rb") as f:
+                tar.addfile(info, f)
+    return buf.getvalue()
+
+
+def apply(remote, dest, payload):
+    quoted = dest if dest.startswith("~/") else shlex.quote(dest)
+    out = remote.check_output(
+        f"python3 -c {shlex.quote(APPLY_SCRIPT)} {quoted}", input=payload
+    )
+    return json.loads(out)
+
+
+def stage(remote, paths, dest=DEFAULT_DEST, full=False):
+    """Bring `dest` on `remote` in line with `paths`; returns True on success."""
+    started = time.perf_counter()
+    manifest = local_manifest(expand(paths))
+    previous = {} if full else fetch_manifest(remote, dest)
+    if not previous:
+        full = True
+    send, delete = delta(manifest, previous)
+    if full:
+        send, delete = sorted(manifest), []
+
+    payload = build_payload(manifest, send, delete, full)
+    result = apply(remote, dest, payload)
+    elapsed = time.perf_counter() - started
+    mode = "full" if full else "delta"
+    print(
+        f"Staged {len(manifest)} files on {remote} ({mode}): "
+        f"{result['written']} sent, {result['deleted']} deleted, "
+        f"{len(payload) / 1024:.1f} KiB in {elapsed:.2f}s"
+    )
+    if result["bad"]:
+        print(f"Verification failed for: {', '.join(result['bad'][:10])}")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stage changed files on a remote host against its manifest"
+    )
+    parser.add_argument("target", help="user@host, dev/prod/nightly or sh:")
+    parser.add_argument("paths", nargs="+", help="Files or directories to stage")
+    parser.add_argument(
+        "--dest", default=DEFAULT_DEST, help=f"Staging dir (default: {DEFAULT_DEST})"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Wipe the staging dir and send all"
+    )
+    args = parser.parse_args()
+
+    with open_session(resolve_target(args.target)) as remote:
+        if stage(remote, args.paths, args.dest, args.full):
+            return
+        # Staging dir drifted from its manifest; start over from scratch
+        print("Retrying with a full stage...")
+        if not stage(remote, args.paths, args.dest, full=True):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
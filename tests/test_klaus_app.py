@@ -0,0 +1,145 @@
+"""
+Hot-swapping of the klaus repo set (scripts/klaus_app.py RepoRegistry).
+
+Needs git and klaus; run with `python3 -m pytest tests`.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+sys.path.insert(0, SCRIPTS)
+
+try:
+    import klaus  # noqa: F401
+    from werkzeug.test import Client
+except ImportError:
+    klaus = None
+
+# klaus_app discovers repos and builds its app at import; point it at an
+# empty root with the optional middleware off
+_EMPTY_ROOT = tempfile.mkdtemp()
+os.environ.update(
+    KLAUS_REPOS_ROOT=_EMPTY_ROOT,
+    KLAUS_WATCH_REPOS="0",
+    KLAUS_RATE="0",
+    KLAUS_CACHE_MB="0",
+    REPO_INDEX_FILE="",
+)
+
+if klaus is not None:
+    import klaus_app
+    from repo_discovery import scan
+
+
+def make_repo(root, name):
+    """A bare repo with one commit, so klaus lists and serves it."""
+    work = tempfile.mkdtemp()
+    git = ["git", "-c", "user.name=t", "-c", "user.email=t@example.com"]
+    subprocess.run(git + ["init", "-q", work], check=True)
+    with open(os.path.join(work, "README"), "w") as f:
+        f.write(name + "\n")
+    subprocess.run(git + ["-C", work, "add", "README"], check=True)
+    subprocess.run(git + ["-C", work, "commit", "-qm", "init"], check=True)
+    path = os.path.join(root, name + ".git")
+    subprocess.run(["git", "clone", "-q", "--bare", work, path], check=True)
+    shutil.rmtree(work)
+    return path
+
+
+def wait_for(predicate, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@unittest.skipUnless(klaus and shutil.which("git"), "needs klaus and git")
+class RepoRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        make_repo(self.root, "alpha")
+        make_repo(self.root, "beta")
+        self.registry = klaus_app.RepoRegistry(scan(self.root)[0], "Test")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def status(self, path):
+        return Client(self.registry).get(path).status_code
+
+    def test_additions_and_removals_without_downtime(self):
+        self.assertEqual(self.status("/alpha/"), 200)
+        self.assertEqual(self.status("/gamma/"), 404)
+
+        # Hammer the index and a repo that stays throughout the swaps
+        failures = []
+        stop = threading.Event()
+
+        def hammer():
+            client = Client(self.registry)
+            while not stop.is_set():
+                for path in ("/", "/alpha/"):
+                    code = client.get(path).status_code
+                    if code != 200:
+                        failures.append((path, code))
+
+        threads = [threading.Thread(target=hammer) for _ in range(4)]
+        for t in threads:
+            t.start()
+        try:
+            make_repo(self.root, "gamma")
+            self.registry.update(scan(self.root)[0])
+            self.assertTrue(wait_for(lambda: self.registry.generation == 2))
+            self.assertEqual(self.status("/gamma/"), 200)
+
+            shutil.rmtree(os.path.join(self.root, "beta.git"))
+            self.registry.update(scan(self.root)[0])
+            self.assertTrue(wait_for(lambda: self.registry.generation == 3))
+            self.assertEqual(self.status("/beta/"), 404)
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+        self.assertEqual(failures, [])
+
+    def test_unchanged_set_keeps_the_app(self):
+        self.status("/")
+        app = self.registry.app
+        self.registry.update(scan(self.root)[0])
+        time.sleep(0.3)
+        self.assertIs(self.registry.app, app)
+        self.assertEqual(self.registry.generation, 1)
+
+    def test_threads_start_in_forked_workers(self):
+        # gunicorn --preload: the app is built before the fork, and the
+        # worker must still pick up changes
+        registry = klaus_app.RepoRegistry(
+            scan(self.root)[0], "Test", watch_root=self.root
+        )
+        pid = os.fork()
+        if pid == 0:
+            ok = False
+            try:
+                client = Client(registry)
+                make_repo(self.root, "delta")
+                # The first request starts the builder, which catches up
+                # on repos added since the app was loaded
+                client.get("/")
+                ok = wait_for(lambda: client.get("/delta/").status_code == 200)
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
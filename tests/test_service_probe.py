@@ -0,0 +1,182 @@
+"""
+scripts/service_probe.py against a local stand-in HTTP server.
+
+Run with `python3 -m pytest tests`.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+sys.path.insert(0, SCRIPTS)
+
+import service_probe  # noqa: E402
+
+
+class StandIn(ThreadingHTTPServer):
+    """Records requests, peak concurrency and client connections."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.requests = []
+        self.connections = set()
+
+    def reset(self):
+        with self.lock:
+            self.active = self.peak = 0
+            self.requests = []
+            self.connections = set()
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so the probe's connection pool gets exercised
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            server.requests.append(self.path)
+            server.connections.add((self.path, self.client_address))
+        try:
+            parts = urlsplit(self.path)
+            query = parse_qs(parts.query)
+            time.sleep(float(query.get("delay", ["0"])[0]))
+            code = int(query.get("code", ["200"])[0])
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class ServiceProbeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandIn()
+        cls.port = cls.server.server_address[1]
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.reset()
+
+    def url(self, path, host="127.0.0.1"):
+        return f"http://{host}:{self.port}{path}"
+
+    def probe(self, urls, **options):
+        return asyncio.run(service_probe.probe_all(urls, **options))
+
+    def test_up_down_and_samples(self):
+        ok, error = self.url("/ok"), self.url("/broken?code=503")
+        results = self.probe([ok, error, self.url("/missing?code=404")], samples=3)
+        self.assertTrue(results[ok]["up"])
+        self.assertEqual(results[ok]["code"], 200)
+        self.assertFalse(results[error]["up"])
+        self.assertEqual(results[error]["code"], 503)
+        # Anything below 500 counts as up
+        self.assertTrue(results[self.url("/missing?code=404")]["up"])
+        self.assertEqual(self.server.requests.count("/ok"), 3)
+        # All samples of one URL go over one pooled connection
+        ok_conns = {c for path, c in self.server.connections if path == "/ok"}
+        self.assertEqual(len(ok_conns), 1)
+
+    def test_per_host_cap(self):
+        urls = [self.url(f"/slow{i}?delay=0.2") for i in range(6)]
+        started = time.perf_counter()
+        self.probe(urls, samples=1, per_host=2, concurrency=32)
+        elapsed = time.perf_counter() - started
+        self.assertEqual(self.server.peak, 2)
+        # 6 URLs, 2 at a time, 0.2 s each
+        self.assertGreaterEqual(elapsed, 0.55)
+
+    def test_global_cap(self):
+        # Two host names for the same server, so only the global cap binds
+        urls = [self.url(f"/a{i}?delay=0.2") for i in range(4)]
+        urls += [self.url(f"/b{i}?delay=0.2", host="localhost") for i in range(4)]
+        self.probe(urls, samples=1, per_host=4, concurrency=3)
+        self.assertEqual(self.server.peak, 3)
+
+    def test_timeout(self):
+        slow = self.url("/hang?delay=2")
+        started = time.perf_counter()
+        status = self.probe([slow], samples=3, timeout=0.3)[slow]
+        self.assertLess(time.perf_counter() - started, 1.5)
+        self.assertFalse(status["up"])
+        self.assertEqual(status["error"], "timeout after 0.3s")
+        self.assertIsNone(status["latency_ms"])
+
+    def test_latency_percentiles(self):
+        url = self.url("/timed?delay=0.05")
+        status = self.probe([url], samples=5)[url]
+        latency = status["latency_ms"]
+        self.assertGreaterEqual(latency["p50"], 50)
+        self.assertLessEqual(latency["p50"], latency["p95"])
+        self.assertLessEqual(latency["p95"], latency["max"])
+        self.assertEqual(self.server.requests.count("/timed?delay=0.05"), 5)
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3, 10, 9, 8, 7, 6]
+        self.assertEqual(service_probe.percentile(values, 50), 5)
+        self.assertEqual(service_probe.percentile(values, 95), 10)
+        self.assertEqual(service_probe.percentile([42], 95), 42)
+
+    def test_merge_into_services_json(self):
+        ok, down = self.url("/ok"), self.url("/down?code=500")
+        data = {
+            "generated": "test",
+            "groups": [
+                {
+                    "name": "Dev",
+                    "services": [
+                        {"name": "Ok", "url": ok, "extra": 1},
+                        {"name": "Down", "url": down, "status": {"up": True}},
+                    ],
+                },
+                # The same URL in two groups is probed once
+                {"name": "Prod", "services": [{"name": "Ok again", "url": ok}]},
+            ],
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "services.json")
+            with open(path, "w") as f:
+                json.dump(data, f)
+            service_probe.probe_json(path, samples=2)
+            with open(path) as f:
+                merged = json.load(f)
+
+        self.assertEqual(merged["generated"], "test")
+        dev, prod = merged["groups"]
+        self.assertEqual(dev["services"][0]["extra"], 1)
+        self.assertTrue(dev["services"][0]["status"]["up"])
+        # Stale statuses are replaced
+        self.assertFalse(dev["services"][1]["status"]["up"])
+        self.assertEqual(dev["services"][1]["status"]["code"], 500)
+        self.assertTrue(prod["services"][0]["status"]["up"])
+        self.assertEqual(self.server.requests.count("/ok"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()